@@ -3,6 +3,10 @@
 option(ENABLE_JUNIT_REPORT "Enable Junit report generation for targets that support it" OFF)
 
 set(JUNIT_REPORT_DIRECTORY "${CMAKE_BINARY_DIR}/test/junit")
+# Each test saves its junit report to this directory, the reports are merged
+# into the JUNIT_REPORT_DIRECTORY when the test suite completes.
+set(JUNIT_FRAGMENT_DIRECTORY "${CMAKE_BINARY_DIR}/test/tmp/junit")
+set(JUNIT_REPORTS_MERGE "${CMAKE_SOURCE_DIR}/cmake/utils/junit-reports-merge.py")
 set(TEST_LOG_DIRECTORY "${CMAKE_BINARY_DIR}/test/log")
 set_property(
 	DIRECTORY "${CMAKE_SOURCE_DIR}"
@@ -48,11 +52,37 @@ endmacro()
 
 include(Coverage)
 
+if(ENABLE_JUNIT_REPORT AND NOT TARGET junit-reports)
+	# Merge the junit reports of the tests that ran so far, even if some of them
+	# failed
+	add_custom_target(junit-reports
+		COMMENT "Merging the junit reports"
+		COMMAND
+			"${Python_EXECUTABLE}" "${JUNIT_REPORTS_MERGE}" --merge
+			"${JUNIT_REPORT_DIRECTORY}"
+			"${JUNIT_FRAGMENT_DIRECTORY}"
+		VERBATIM
+	)
+endif()
+
 function(create_test_suite_with_parent_targets NAME)
 	get_target_from_suite(${NAME} TARGET)
 
+	if(ENABLE_JUNIT_REPORT)
+		# Only merge the report of this suite, so the check-<suite> targets
+		# running in parallel don't rewrite each other's reports
+		set(JUNIT_MERGE_COMMAND
+			COMMAND
+				"${Python_EXECUTABLE}" "${JUNIT_REPORTS_MERGE}" --merge
+				"${JUNIT_REPORT_DIRECTORY}"
+				"${JUNIT_FRAGMENT_DIRECTORY}"
+				"${NAME}"
+		)
+	endif()
+
 	add_custom_target(${TARGET}
 		COMMENT "Running ${NAME} test suite"
+		${JUNIT_MERGE_COMMAND}
 		COMMAND "${CMAKE_COMMAND}" -E echo "PASSED: ${NAME} test suite"
 	)
 
@@ -134,9 +164,9 @@ function(add_test_runner SUITE NAME EXECUTABLE)
 			COMMENT "Processing junit report for test ${NAME} from suite ${SUITE}"
 			COMMAND_EXPAND_LISTS
 			COMMAND
-				"${Python_EXECUTABLE}" "${CMAKE_SOURCE_DIR}/cmake/utils/junit-reports-merge.py"
+				"${Python_EXECUTABLE}" "${JUNIT_REPORTS_MERGE}"
 				"${JUNIT_REPORT_DIRECTORY}"
-				"${CMAKE_BINARY_DIR}/test/tmp"
+				"${JUNIT_FRAGMENT_DIRECTORY}"
 				"${SUITE}"
 				"${NAME}"
 		)
@@ -4,28 +4,130 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 
 import argparse
+import io
+from multiprocessing import Pool
+import os
+import re
+import shutil
 
-parser = argparse.ArgumentParser(
-    description='Remove the coverage data from a tracefile for all files matching the pattern.')
-parser.add_argument('--pattern', '-p', action='append',
-                    help='the pattern of files to remove', required=True)
-parser.add_argument(
-    'tracefile', help='the tracefile to remove the coverage data from')
-parser.add_argument('outfile', help='filename for the output to be written to')
-
-args = parser.parse_args()
-tracefile = args.tracefile
-pattern = args.pattern
-outfile = args.outfile
-
-in_remove = False
-with open(tracefile, 'r', encoding="utf8") as f:
-    with open(outfile, 'w', encoding="utf8") as wf:
-        for line in f:
-            for p in pattern:
-                if line.startswith("SF:") and p in line:
-                    in_remove = True
-            if not in_remove:
-                wf.write(line)
-            if line == 'end_of_record\n':
-                in_remove = False
+# Size of the read and write buffers
+BUFFER_SIZE = 1024 * 1024
+# Tracefiles smaller than this size per job are not worth splitting
+MIN_SHARD_SIZE = 16 * 1024 * 1024
+
+END_OF_RECORD = b'end_of_record\n'
+
+
+def compile_matcher(patterns):
+    # A single regex alternation checks all the patterns in one pass over the
+    # line, and stops at the first match
+    return re.compile(b'|'.join(re.escape(p.encode('utf8'))
+                                for p in patterns)).search
+
+
+def filter_records(lines, outfile, match):
+    # A record starts with a SF: line and ends with an end_of_record line. The
+    # records with a SF: line matching any of the patterns are removed.
+    in_remove = False
+    for line in lines:
+        if line.startswith(b'SF:') and match(line):
+            in_remove = True
+        if not in_remove:
+            outfile.write(line)
+        if line == END_OF_RECORD:
+            in_remove = False
+
+
+def find_shard_boundaries(tracefile, jobs):
+    # Split the tracefile into shards of roughly equal size, each ending right
+    # after an end_of_record line
+    size = os.path.getsize(tracefile)
+    boundaries = [0]
+    with open(tracefile, 'rb') as f:
+        for i in range(1, jobs):
+            offset = max(size * i // jobs, boundaries[-1])
+            f.seek(offset)
+            if offset > 0:
+                # Skip the line the offset falls into
+                f.readline()
+            for line in f:
+                if line == END_OF_RECORD:
+                    break
+            boundary = f.tell()
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return boundaries
+
+
+def read_lines(f, end):
+    # Read the lines of the file up to the end offset, which is at the start
+    # of a line
+    remaining = end - f.tell()
+    pending = b''
+    while remaining > 0:
+        chunk = f.read(min(BUFFER_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        data = pending + chunk
+        # The last line might be incomplete
+        last = data.rfind(b'\n') + 1
+        pending = data[last:]
+        yield from io.BytesIO(data[:last])
+    if pending:
+        yield pending
+
+
+def filter_shard(tracefile, start, end, shardfile, patterns):
+    with open(tracefile, 'rb') as f, \
+            open(shardfile, 'wb', buffering=BUFFER_SIZE) as wf:
+        f.seek(start)
+        filter_records(read_lines(f, end), wf, compile_matcher(patterns))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Remove the coverage data from a tracefile for all files matching the pattern.')
+    parser.add_argument('--pattern', '-p', action='append',
+                        help='the pattern of files to remove', required=True)
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=os.cpu_count() or 1,
+        help='the number of shards of a large tracefile to filter in parallel')
+    parser.add_argument(
+        'tracefile', help='the tracefile to remove the coverage data from')
+    parser.add_argument(
+        'outfile', help='filename for the output to be written to')
+
+    args = parser.parse_args()
+    tracefile = args.tracefile
+    patterns = args.pattern
+    outfile = args.outfile
+
+    jobs = max(1, min(args.jobs, os.path.getsize(tracefile) // MIN_SHARD_SIZE))
+    if jobs == 1:
+        with open(tracefile, 'rb', buffering=BUFFER_SIZE) as f, \
+                open(outfile, 'wb', buffering=BUFFER_SIZE) as wf:
+            filter_records(f, wf, compile_matcher(patterns))
+        return
+
+    boundaries = find_shard_boundaries(tracefile, jobs)
+    shards = [(tracefile, start, end, '{}.shard{}'.format(outfile, i), patterns)
+              for i, (start, end) in enumerate(zip(boundaries, boundaries[1:]))]
+    try:
+        with Pool(len(shards)) as pool:
+            pool.starmap(filter_shard, shards)
+
+        with open(outfile, 'wb') as wf:
+            for shard in shards:
+                with open(shard[3], 'rb') as f:
+                    shutil.copyfileobj(f, wf, BUFFER_SIZE)
+    finally:
+        for shard in shards:
+            if os.path.exists(shard[3]):
+                os.remove(shard[3])
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,17 @@
 #!/usr/bin/env python3
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import os
+import pickle
 import subprocess
+import tempfile
+
+# Bump when the cache content changes
+CACHE_VERSION = 1
+# Maximum number of targets per ninja invocation, to keep the command line
+# length reasonable
+MAX_BATCH_SIZE = 500
 
 parser = argparse.ArgumentParser(description='Produce a dep file from ninja.')
 parser.add_argument(
@@ -23,6 +32,16 @@ parser.add_argument(
 parser.add_argument(
     '--extra-deps', nargs='+',
     help='Extra dependencies.')
+parser.add_argument(
+    '-j', '--jobs', type=int, default=os.cpu_count() or 1,
+    help='The number of ninja queries to run in parallel.')
+parser.add_argument(
+    '--cache-file',
+    help='The dependency graph cache file. Defaults to '
+    '.gen-ninja-deps.cache in the build directory.')
+parser.add_argument(
+    '--no-cache', action='store_true',
+    help='Do not use the dependency graph cache.')
 
 args = parser.parse_args()
 build_dir = os.path.abspath(args.build_dir)
@@ -31,6 +50,9 @@ ninja = args.ninja
 base_target = args.base_target
 targets = args.targets
 extra_deps = args.extra_deps
+jobs = max(1, args.jobs)
+cache_file = None if args.no_cache else os.path.abspath(
+    args.cache_file or os.path.join(build_dir, '.gen-ninja-deps.cache'))
 
 # Make sure we operate in the right folder.
 os.chdir(build_dir)
@@ -38,33 +60,125 @@ os.chdir(build_dir)
 if ninja is None:
     ninja = subprocess.check_output(['command', '-v', 'ninja'])[:-1]
 
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+# The cache holds the result of the ninja queries. The targets and their inputs
+# only change when build.ninja is regenerated, while the dependencies discovered
+# during the build change when .ninja_deps is updated, so they are invalidated
+# separately.
+def load_cache():
+    cache = None
+    if cache_file is not None:
+        try:
+            with open(cache_file, 'rb') as f:
+                cache = pickle.load(f)
+        except Exception:
+            pass
+
+    build_key = (CACHE_VERSION, ninja, get_mtime('build.ninja'))
+    deps_key = get_mtime('.ninja_deps')
+
+    if cache is None or cache['build_key'] != build_key:
+        cache = {
+            'build_key': build_key,
+            'all_targets': None,
+            'doto_targets': None,
+            'query': dict(),
+            'deps_key': deps_key,
+            'deps': dict(),
+        }
+    elif cache['deps_key'] != deps_key:
+        cache['deps_key'] = deps_key
+        cache['deps'] = dict()
+
+    cache['dirty'] = False
+    return cache
+
+
+def save_cache(cache):
+    if cache_file is None or not cache.pop('dirty'):
+        return
+
+    # Write to a temporary file first, so concurrent runs never read a
+    # partially written cache
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except BaseException:
+        os.unlink(tmp_file)
+        raise
+
+
+cache = load_cache()
+
 # Construct the set of all targets
-all_targets = set()
-doto_targets = set()
-for t in subprocess.check_output([ninja, '-t', 'targets', 'all']).splitlines():
-    t, r = t.split(b':')
-    all_targets.add(t)
-    if r[:13] == b' C_COMPILER__' or r[:15] == b' CXX_COMPILER__':
-        doto_targets.add(t)
+if cache['all_targets'] is None:
+    all_targets = set()
+    doto_targets = set()
+    for t in subprocess.check_output(
+            [ninja, '-t', 'targets', 'all']).splitlines():
+        t, r = t.split(b':')
+        all_targets.add(t)
+        if r[:13] == b' C_COMPILER__' or r[:15] == b' CXX_COMPILER__':
+            doto_targets.add(t)
+    cache['all_targets'] = all_targets
+    cache['doto_targets'] = doto_targets
+    cache['dirty'] = True
+
+all_targets = cache['all_targets']
+doto_targets = cache['doto_targets']
+
+
+def run_batches(tool, parse, workset, **kwargs):
+    # Split the targets into batches and run the ninja tool on the batches in
+    # parallel. The targets are independent, so the results can be merged.
+    workset = sorted(workset)
+    batch_size = min(MAX_BATCH_SIZE, -(-len(workset) // jobs))
+    batches = [workset[i:i + batch_size]
+               for i in range(0, len(workset), batch_size)]
+
+    def run(batch):
+        return parse(subprocess.check_output(
+            [ninja, '-t', tool] + batch, **kwargs))
+
+    results = dict()
+    with ThreadPoolExecutor(max_workers=min(jobs, len(batches))) as executor:
+        for result in executor.map(run, batches):
+            results.update(result)
+
+    return results
 
 
 def parse_ninja_query(query):
     deps = dict()
     lines = query.splitlines()
+    n = len(lines)
 
-    while len(lines):
-        line = lines.pop(0)
+    i = 0
+    while i < n:
+        line = lines[i]
+        i += 1
         if line[0] == ord(' '):
             continue
 
         # We have a new target
         target = line.split(b':')[0]
-        assert lines.pop(0)[:8] == b'  input:'
+        assert lines[i][:8] == b'  input:'
+        i += 1
 
         inputs = set()
-        while True:
-            i = lines.pop(0)
-            if i[:4] != b'    ':
+        while i < n:
+            dep = lines[i]
+            i += 1
+            if dep[:4] != b'    ':
                 break
 
             '''
@@ -76,26 +190,64 @@ def parse_ninja_query(query):
             Order only dependency do not require the target to be rebuilt
             and so we ignore them.
             '''
-            i = i[4:]
-            if i[0] == ord('|'):
-                if i[1] == ord('|'):
+            dep = dep[4:]
+            if dep[0] == ord('|'):
+                if dep[1] == ord('|'):
                     # We reached the order only dependencies.
                     break
-                i = i[2:]
+                dep = dep[2:]
 
-            inputs.add(i)
+            inputs.add(dep)
 
         deps[target] = inputs
 
     return deps
 
 
+def parse_ninja_deps(ndeps):
+    # Targets for which the deps are not found map to None
+    deps = dict()
+    lines = ndeps.splitlines()
+    n = len(lines)
+
+    i = 0
+    while i < n:
+        t, m = lines[i].split(b':')
+        i += 1
+        if m == b' deps not found':
+            deps[t] = None
+            continue
+
+        inputs = set()
+        while i < n:
+            dep = lines[i]
+            i += 1
+            if dep == b'':
+                break
+
+            assert dep[:4] == b'    '
+            inputs.add(dep[4:])
+
+        deps[t] = inputs
+
+    return deps
+
+
 def extract_deps(workset):
     # Recursively extract the dependencies of the target.
+    query_cache = cache['query']
     deps = dict()
     while len(workset) > 0:
-        query = subprocess.check_output([ninja, '-t', 'query'] + list(workset))
-        target_deps = parse_ninja_query(query)
+        missing = [t for t in workset if t not in query_cache]
+        queried = dict()
+        if missing:
+            # ninja reports the targets by their canonical path
+            queried = run_batches('query', parse_ninja_query, missing)
+            query_cache.update(queried)
+            cache['dirty'] = True
+
+        target_deps = {t: query_cache[t] for t in workset if t in query_cache}
+        target_deps.update(queried)
         deps.update(target_deps)
 
         workset = set()
@@ -107,27 +259,17 @@ def extract_deps(workset):
     if len(bt_targets) == 0:
         return deps
 
-    ndeps = subprocess.check_output(
-        [ninja, '-t', 'deps'] + bt_targets,
-        stderr=subprocess.DEVNULL)
+    deps_cache = cache['deps']
+    missing = [t for t in bt_targets if t not in deps_cache]
+    if missing:
+        deps_cache.update(run_batches(
+            'deps', parse_ninja_deps, missing, stderr=subprocess.DEVNULL))
+        cache['dirty'] = True
 
-    lines = ndeps.splitlines()
-    while len(lines) > 0:
-        line = lines.pop(0)
-        t, m = line.split(b':')
-        if m == b' deps not found':
-            continue
-
-        inputs = set()
-        while True:
-            i = lines.pop(0)
-            if i == b'':
-                break
-
-            assert i[:4] == b'    '
-            inputs.add(i[4:])
-
-        deps[t] = inputs
+    for t in bt_targets:
+        inputs = deps_cache.get(t)
+        if inputs is not None:
+            deps[t] = inputs
 
     return deps
 
@@ -155,7 +297,8 @@ def rebase_deps(deps):
     return rebased
 
 
-deps = extract_deps(set(targets))
+deps = extract_deps(set(t.encode() for t in targets))
+save_cache(cache)
 deps = rebase_deps(deps)
 
 
@@ -3,92 +3,48 @@
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 
+# Collect the junit reports of the tests into a report per test suite.
+#
+# After each test, its junit report is saved as a fragment:
+#   junit-reports-merge.py <report_dir> <fragment_dir> <suite> <test>
+# The fragments are then merged in a single pass into the test suite reports:
+#   junit-reports-merge.py --merge <report_dir> <fragment_dir> [<suite>]
+# Only the fragments and report of the suite are merged if it is given, so the
+# cost of merging a suite doesn't depend on the other suites.
+#
+# Each test writes its own fragment, so the tests can run in parallel without
+# contention, and the cost of the merge is linear with the number of tests.
+
+import argparse
 import datetime
-import fcntl
+import glob
 import os
+import shutil
 import sys
+import tempfile
 import xml.etree.ElementTree as ET
 
 
-class TestSuite:
-    def __init__(self, name, report_dir):
-        self.name = name
-        self.test_cases = {}
-        self.report_file = os.path.join(report_dir, '{}.xml'.format(self.name))
-
-    def add_test_case(self, test_case):
-        self.test_cases[test_case.test_id] = test_case
-
-    def get_failed_tests(self):
-        return [t for t in self.test_cases.values() if not t.test_success]
-
-    def dump(self):
-        # Calculate test suite duration as the sum of all test case duraration
-        duration = round(sum([
-            float(t.node.get('time', 0.0)) for t in self.test_cases.values()
-        ]), 3)
-
-        test_suite = ET.Element(
-            'testsuite',
-            {
-                'name': self.name,
-                'id': '0',
-                'timestamp': datetime.datetime.now().isoformat('T'),
-                'time': str(duration),
-                'tests': str(len(self.test_cases)),
-                'failures': str(len(self.get_failed_tests())),
-            }
-        )
-
-        for test_case in self.test_cases.values():
-            test_suite.append(test_case.node)
-
-        report_dir = os.path.dirname(self.report_file)
-        os.makedirs(report_dir, exist_ok=True)
-        ET.ElementTree(test_suite).write(
-            self.report_file,
-            'UTF-8',
-            xml_declaration=True,
-        )
-
-    def load(self):
-        tree = ET.parse(self.report_file)
-
-        xml_root = tree.getroot()
-        assert xml_root.tag == 'testsuite'
-        assert self.name == xml_root.get('name')
-
-        for test_case in xml_root.findall('testcase'):
-            self.add_test_case(TestCase(test_case))
-
-
-class TestCase:
-    def __init__(self, node):
-        self.node = node
-        self.test_success = self.node.find('failure') is None
-
-    def __getattr__(self, attribute):
-        if attribute == 'test_id':
-            return self.classname + '/' + self.name
+def atomic_write(path, write_fn):
+    # Write to a temporary file first so a concurrent reader never sees a
+    # partially written file
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_fn(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
-        return self.node.attrib[attribute]
 
+def is_failure(test_case):
+    return test_case.find('failure') is not None
 
-class Lock:
-    def __init__(self, suite, lock_dir):
-        self.lock_file = os.path.join(lock_dir, '{}.lock'.format(suite))
 
-    def __enter__(self):
-        os.makedirs(os.path.dirname(self.lock_file), exist_ok=True)
-        self.fd = open(self.lock_file, 'w', encoding='utf-8')
-        fcntl.lockf(self.fd, fcntl.LOCK_EX)
-
-    def __exit__(self, type, value, traceback):
-        fcntl.lockf(self.fd, fcntl.LOCK_UN)
-        self.fd.close()
-
-
-def main(report_dir, lock_dir, suite, test):
+def save_fragment(fragment_dir, suite, test):
     junit = '{}-{}.xml'.format(suite, test)
     if not os.path.isfile(junit):
         return 0
@@ -102,31 +58,124 @@ def main(report_dir, lock_dir, suite, test):
         raise AssertionError(
             "The parser only supports a single test suite per report")
 
-    test_suite_name = xml_root.get('name')
+    fragment = ET.Element('testsuite', {'name': xml_root.get('name')})
+    failed = False
+    for child in xml_root:
+        if child.tag != 'testcase' or (child.find('skipped') is not None):
+            continue
+        fragment.append(child)
+        failed |= (child.get('classname') == test and is_failure(child))
+
+    atomic_write(
+        os.path.join(fragment_dir, suite, '{}.xml'.format(test)),
+        lambda f: ET.ElementTree(fragment).write(
+            f, 'UTF-8', xml_declaration=True),
+    )
 
-    lock = Lock(suite, lock_dir)
-    with lock:
-        test_suite = TestSuite(test_suite_name, report_dir)
-        if os.path.isfile(test_suite.report_file):
-            test_suite.load()
+    return 1 if failed else 0
 
-        for child in xml_root:
-            if child.tag != 'testcase' or (child.find('skipped') is not None):
+
+class TestSuiteWriter:
+    """Stream the test cases of a test suite to a temporary file, so the
+    test suite attributes can be computed before the report is written."""
+
+    def __init__(self, name, report_dir):
+        self.name = name
+        self.report_file = os.path.join(
+            report_dir, '{}.xml'.format(self.name))
+        self.test_cases = tempfile.TemporaryFile()
+        self.tests = 0
+        self.failures = 0
+        self.duration = 0.0
+
+    def add_test_case(self, test_case):
+        self.tests += 1
+        self.failures += 1 if is_failure(test_case) else 0
+        self.duration += float(test_case.get('time', 0.0))
+        test_case.tail = None
+        self.test_cases.write(ET.tostring(test_case, encoding='utf-8'))
+
+    def dump(self):
+        test_suite = ET.Element(
+            'testsuite',
+            {
+                'name': self.name,
+                'id': '0',
+                'timestamp': datetime.datetime.now().isoformat('T'),
+                # Calculate test suite duration as the sum of all test case
+                # duration
+                'time': str(round(self.duration, 3)),
+                'tests': str(self.tests),
+                'failures': str(self.failures),
+            }
+        )
+        # Serialize the empty element as an opening and a closing tag, to
+        # insert the test cases in between
+        opening_tag, closing_tag = ET.tostring(
+            test_suite, encoding='unicode',
+            short_empty_elements=False).rsplit('><', 1)
+
+        def write(f):
+            f.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+            f.write('{}>'.format(opening_tag).encode('utf-8'))
+            self.test_cases.seek(0)
+            shutil.copyfileobj(self.test_cases, f)
+            f.write('<{}'.format(closing_tag).encode('utf-8'))
+
+        atomic_write(self.report_file, write)
+        self.test_cases.close()
+
+
+def merge(report_dir, fragment_dir, suite=None):
+    test_suites = {}
+
+    fragments = glob.glob(
+        os.path.join(fragment_dir, suite or '*', '*.xml'))
+    for fragment in sorted(fragments):
+        root = None
+        for event, element in ET.iterparse(fragment, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = element
+                    name = root.get('name')
+                    if name not in test_suites:
+                        test_suites[name] = TestSuiteWriter(name, report_dir)
                 continue
 
-            test_suite.add_test_case(TestCase(child))
+            if element.tag == 'testcase' and element is not root:
+                test_suites[name].add_test_case(element)
+                # Release the memory of the test cases already written
+                root.clear()
 
+    for test_suite in test_suites.values():
         test_suite.dump()
 
-    sys.exit(
-        1 if test in [case.classname for case in test_suite.get_failed_tests()]
-        else 0
-    )
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Collect the junit reports into a report per test suite")
+    parser.add_argument(
+        '--merge', action='store_true',
+        help="Merge the saved fragments into the test suite reports")
+    parser.add_argument('report_dir', help="The test suite reports directory")
+    parser.add_argument('fragment_dir', help="The fragments directory")
+    parser.add_argument(
+        'suite', nargs='?',
+        help="The suite of the test, or the suite to merge with --merge")
+    parser.add_argument('test', nargs='?', help="The test name")
+    args = parser.parse_args()
+
+    if args.merge:
+        if args.test is not None:
+            parser.error("No test is expected with --merge")
+        return merge(args.report_dir, args.fragment_dir, args.suite)
+
+    if args.suite is None or args.test is None:
+        parser.error("The suite and test are required to save a fragment")
+    return save_fragment(args.fragment_dir, args.suite, args.test)
 
 
-main(
-    report_dir=sys.argv[1],
-    lock_dir=sys.argv[2],
-    suite=sys.argv[3],
-    test=sys.argv[4],
-)
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,6 +15,7 @@ from logging.handlers import RotatingFileHandler
 
 from cirrus import Cirrus
 from phabricator_wrapper import PhabWrapper
+from response_cache import ResponseCache
 from slackbot import SlackBot
 from teamcity_wrapper import TeamCity
 
@@ -51,6 +52,12 @@ def main(args):
         '-p', '--port', help='port for server to start', type=int, default=8080)
     parser.add_argument(
         '-l', '--log-file', help='log file to dump requests payload', type=str, default='log.log')
+    parser.add_argument(
+        '-w', '--workers', help='number of threads processing the build status events, 0 to process them synchronously', type=int, default=4)
+    parser.add_argument(
+        '--panel-update-delay', help='delay in seconds during which the build status panel updates are merged', type=float, default=5)
+    parser.add_argument(
+        '--db-flush-interval', help='interval in seconds between two writes of the state changes to the database', type=float, default=1)
     args = parser.parse_args()
     port = args.port
     log_file = args.log_file
@@ -60,7 +67,11 @@ def main(args):
         phab,
         slackbot,
         cirrus,
-        db_file_no_ext=db_file_no_ext)
+        db_file_no_ext=db_file_no_ext,
+        event_workers=args.workers,
+        response_cache=ResponseCache(),
+        panel_update_delay=args.panel_update_delay,
+        db_flush_interval=args.db_flush_interval)
 
     formater = logging.Formatter(
         '[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
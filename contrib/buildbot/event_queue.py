@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+from collections import deque
+import shelve
+import threading
+import time
+
+
+# Number of samples the latency metrics are computed over
+LATENCY_WINDOW = 1000
+
+
+class LatencyWindow():
+    def __init__(self, size=LATENCY_WINDOW):
+        self.samples = deque(maxlen=size)
+
+    def add(self, latency):
+        self.samples.append(latency)
+
+    def summary(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {'count': 0}
+
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+        return {
+            'count': len(samples),
+            'avg': sum(samples) / len(samples),
+            'p50': percentile(0.5),
+            'p90': percentile(0.9),
+            'max': samples[-1],
+        }
+
+
+class QueuedEvent():
+    def __init__(self, seq, event, ordering_key, dedup_key, queued_at):
+        self.seq = seq
+        self.event = event
+        self.ordering_key = ordering_key
+        self.dedup_key = dedup_key
+        self.queued_at = queued_at
+
+
+class EventQueue():
+    """Processes events on a pool of worker threads.
+
+    Events sharing the same ordering key are processed one at a time in the
+    order they were queued, events with different ordering keys are processed
+    concurrently. An event is dropped if an event with the same dedup key is
+    already queued or being processed.
+
+    If a journal file is given, the events are persisted until they are
+    processed so they are not lost if the server restarts. The journal is kept
+    open from start() to stop().
+
+    With no worker thread, the events are processed by the caller: only the
+    events restored from the journal are, by start().
+    """
+
+    def __init__(self, process_fn, num_workers, journal_file_no_ext=None,
+                 logger=None):
+        self.process_fn = process_fn
+        self.num_workers = num_workers
+        self.journal_file_no_ext = journal_file_no_ext
+        self.logger = logger
+
+        self.lock = threading.Condition()
+        self.journal_lock = threading.Lock()
+        self.journal = None
+        self.next_seq = 0
+        # Queued events for each ordering key
+        self.pending = {}
+        # Ordering keys with queued events and no event being processed
+        self.ready = deque()
+        # Ordering keys with an event being processed
+        self.active = set()
+        # Dedup keys of the queued and in flight events
+        self.dedup_keys = set()
+        self.depth = 0
+        self.stopping = False
+
+        self.counters = {
+            'queued': 0,
+            'deduplicated': 0,
+            'processed': 0,
+            'failed': 0,
+        }
+        self.wait_latency = LatencyWindow()
+        self.processing_latency = LatencyWindow()
+
+        self.workers = []
+
+    def start(self):
+        self._open_journal()
+        self._restore_journal()
+        if not self.num_workers:
+            self._process_ready()
+        for i in range(self.num_workers):
+            worker = threading.Thread(
+                target=self._worker, name="event-worker-{}".format(i),
+                daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self, timeout=None):
+        with self.lock:
+            self.stopping = True
+            self.lock.notify_all()
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = []
+        with self.journal_lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+
+    def put(self, event, ordering_key, dedup_key=None):
+        """Queue an event. Returns False if it was dropped as a duplicate."""
+        with self.lock:
+            if dedup_key is not None and dedup_key in self.dedup_keys:
+                self.counters['deduplicated'] += 1
+                return False
+            queued_event = QueuedEvent(
+                self.next_seq, event, ordering_key, dedup_key, time.time())
+            self.next_seq += 1
+            self._journal_add(queued_event)
+            self._push(queued_event)
+            return True
+
+    def join(self, timeout=None):
+        """Wait for all the queued events to be processed. Returns False on
+        timeout."""
+        with self.lock:
+            return self.lock.wait_for(
+                lambda: self.depth == 0 and not self.active, timeout)
+
+    def get_metrics(self):
+        with self.lock:
+            now = time.time()
+            oldest = min([events[0].queued_at for events in self.pending.values()],
+                         default=None)
+            return {
+                'workers': self.num_workers,
+                'depth': self.depth,
+                'in_flight': len(self.active),
+                'oldest_event_age': now - oldest if oldest is not None else 0,
+                'counters': dict(self.counters),
+                'wait_latency': self.wait_latency.summary(),
+                'processing_latency': self.processing_latency.summary(),
+            }
+
+    def _push(self, queued_event):
+        # Must be called with the lock held
+        key = queued_event.ordering_key
+        if key not in self.pending:
+            self.pending[key] = deque()
+            if key not in self.active:
+                self.ready.append(key)
+        self.pending[key].append(queued_event)
+        if queued_event.dedup_key is not None:
+            self.dedup_keys.add(queued_event.dedup_key)
+        self.depth += 1
+        self.counters['queued'] += 1
+        self.lock.notify_all()
+
+    def _pop(self):
+        # Must be called with the lock held
+        key = self.ready.popleft()
+        events = self.pending[key]
+        queued_event = events.popleft()
+        if not events:
+            del self.pending[key]
+        self.active.add(key)
+        self.depth -= 1
+        self.lock.notify_all()
+        return queued_event
+
+    def _done(self, queued_event):
+        # Must be called with the lock held
+        key = queued_event.ordering_key
+        self.active.discard(key)
+        if key in self.pending:
+            self.ready.append(key)
+        self.dedup_keys.discard(queued_event.dedup_key)
+        self.lock.notify_all()
+
+    def _worker(self):
+        while True:
+            with self.lock:
+                self.lock.wait_for(lambda: self.ready or self.stopping)
+                if self.stopping:
+                    return
+                queued_event = self._pop()
+            self._process(queued_event)
+
+    def _process_ready(self):
+        while True:
+            with self.lock:
+                if not self.ready:
+                    return
+                queued_event = self._pop()
+            self._process(queued_event)
+
+    def _process(self, queued_event):
+        start = time.time()
+        with self.lock:
+            self.wait_latency.add(start - queued_event.queued_at)
+
+        try:
+            self.process_fn(queued_event.event)
+            failed = False
+        except BaseException:
+            failed = True
+            if self.logger:
+                self.logger.exception(
+                    "Failed to process event {}".format(queued_event.event))
+        end = time.time()
+
+        # The event is not retried on failure, as processing it might have
+        # partially succeeded.
+        self._journal_remove(queued_event)
+
+        with self.lock:
+            self.counters['failed' if failed else 'processed'] += 1
+            self.processing_latency.add(end - start)
+            self._done(queued_event)
+
+    def _journal_key(self, queued_event):
+        # Zero padded so the keys sort in queuing order
+        return "{:020d}".format(queued_event.seq)
+
+    def _open_journal(self):
+        if not self.journal_file_no_ext:
+            return
+        with self.journal_lock:
+            if self.journal is None:
+                self.journal = shelve.open(self.journal_file_no_ext)
+
+    def _journal_add(self, queued_event):
+        with self.journal_lock:
+            if self.journal is None:
+                return
+            self.journal[self._journal_key(queued_event)] = (
+                queued_event.event, queued_event.ordering_key,
+                queued_event.dedup_key)
+            self.journal.sync()
+
+    def _journal_remove(self, queued_event):
+        with self.journal_lock:
+            if self.journal is None:
+                return
+            self.journal.pop(self._journal_key(queued_event), None)
+            self.journal.sync()
+
+    def _restore_journal(self):
+        with self.journal_lock:
+            if self.journal is None:
+                return
+            entries = [(key, self.journal[key])
+                       for key in sorted(self.journal.keys())]
+        if not entries:
+            return
+
+        if self.logger:
+            self.logger.info(
+                "Restoring {} unprocessed events from the journal".format(
+                    len(entries)))
+        with self.lock:
+            for key, (event, ordering_key, dedup_key) in entries:
+                seq = int(key)
+                self.next_seq = max(self.next_seq, seq + 1)
+                self._push(QueuedEvent(
+                    seq, event, ordering_key, dedup_key, time.time()))
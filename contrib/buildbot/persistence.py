@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import json
+import os
+import pickle
+import shelve
+import threading
+
+
+# Interval between two writes of the changes to the database, in seconds
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+# The extensions of the files the dbm backends of shelve may write
+DB_FILE_EXTENSIONS = ['', '.db', '.dat', '.dir', '.pag', '.bak']
+
+
+class PersistentSection(dict):
+    """A dict whose changed keys are reported to the state. Values that are
+    modified in place must be assigned again to be persisted."""
+
+    def __init__(self, on_change, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_change = on_change
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.on_change(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.on_change(key)
+
+    def pop(self, key, *args):
+        value = super().pop(key, *args)
+        self.on_change(key)
+        return value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        for key in list(self.keys()):
+            del self[key]
+
+
+class PersistentState():
+    """The bot state, persisted incrementally.
+
+    The state is made of named entries. Entries whose default value is a dict
+    are sections: each key of a section is persisted separately, so only the
+    changed keys are written. Other entries are persisted as a whole.
+
+    The changes are recorded when commit() is called: they are appended to a
+    journal file right away, and written to the database in batches every
+    flush_interval seconds, after which the journal is truncated. On startup
+    the journal is replayed over the database, so no committed change is lost
+    if the process is killed. Each entry is loaded on first access.
+
+    The entries are pickled by commit() and by the background flushes, so the
+    threads reading or modifying them must hold the lock while doing so.
+    """
+
+    def __init__(self, defaults, db_file_no_ext=None,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, logger=None):
+        self.defaults = defaults
+        self.db_file_no_ext = db_file_no_ext
+        self.journal_file = "{}.journal".format(
+            db_file_no_ext) if db_file_no_ext else None
+        self.flush_interval = flush_interval
+        self.logger = logger
+
+        # The state lock, see above
+        self.lock = threading.RLock()
+        # The entries loaded so far
+        self.entries = {}
+        # (name, key) of the changes since the last commit. The key is None
+        # for the entries that are not sections.
+        self.uncommitted = set()
+        # (name, key) of the changes committed since the last flush
+        self.dirty = set()
+        # Old format entries to remove from the database on the next flush
+        self.obsolete = set()
+        self.timer = None
+        self.closed = False
+
+        # The journal is small as it is truncated on every flush, so read it
+        # entirely. The records are applied when the entries are loaded.
+        self.journal = {}
+        if self.journal_file:
+            self._read_journal()
+
+    def _is_section(self, name):
+        return isinstance(self.defaults[name], dict)
+
+    def _db_key(self, name, key):
+        if key is None:
+            return name
+        return "{}:{}".format(name, json.dumps(key))
+
+    def _open_db(self, flag='c'):
+        return shelve.open(self.db_file_no_ext, flag=flag)
+
+    def _read_journal(self):
+        try:
+            with open(self.journal_file, 'rb') as f:
+                while True:
+                    try:
+                        name, key, present, value = pickle.load(f)
+                    except (EOFError, pickle.UnpicklingError):
+                        # A truncated record is a change that was not
+                        # committed completely
+                        break
+                    self.journal[(name, key)] = (present, value)
+        except FileNotFoundError:
+            return
+
+        # The replayed changes are written to the database on the next flush
+        self.dirty.update(self.journal.keys())
+        if self.journal and self.logger:
+            self.logger.info(
+                "Replayed {} changes from the journal".format(len(self.journal)))
+
+    def _load(self, name):
+        # Must be called with the lock held
+        if name in self.entries:
+            return self.entries[name]
+
+        if self._is_section(name):
+            value = PersistentSection(
+                lambda key: self._on_change(name, key))
+            stored = self._load_section(name)
+            dict.update(value, stored)
+            for (journal_name, key), (present, journal_value) in self.journal.items():
+                if journal_name != name or key is None:
+                    continue
+                if present:
+                    dict.__setitem__(value, key, journal_value)
+                else:
+                    dict.pop(value, key, None)
+        else:
+            value = self.defaults[name]
+            if (name, None) in self.journal:
+                present, value = self.journal[(name, None)]
+            elif self.db_file_no_ext:
+                value = self._load_db_entry(name, value)
+
+        self.entries[name] = value
+        return value
+
+    def _load_db_entry(self, name, default):
+        try:
+            with self._open_db('r') as db:
+                return db.get(name, default)
+        except BaseException:
+            return default
+
+    def _load_section(self, name):
+        stored = {}
+        if not self.db_file_no_ext:
+            return stored
+        prefix = "{}:".format(name)
+        try:
+            with self._open_db('r') as db:
+                # Sections used to be stored as a whole under their name.
+                # Migrate them by rewriting all their keys.
+                if name in db:
+                    stored = dict(db[name])
+                    self.dirty.update((name, key) for key in stored)
+                    self.obsolete.add(name)
+                for db_key in db.keys():
+                    if db_key.startswith(prefix):
+                        stored[json.loads(db_key[len(prefix):])] = db[db_key]
+        except BaseException:
+            # The database does not exist yet
+            pass
+        if self.logger:
+            self.logger.info(
+                "Loaded {} keys of '{}' from persisted state".format(
+                    len(stored), name))
+        return stored
+
+    def _on_change(self, name, key):
+        with self.lock:
+            self.uncommitted.add((name, key))
+
+    def __getitem__(self, name):
+        with self.lock:
+            return self._load(name)
+
+    def __setitem__(self, name, value):
+        with self.lock:
+            if not self._is_section(name):
+                self.entries[name] = value
+                self.uncommitted.add((name, None))
+                return
+            section = self._load(name)
+            section.clear()
+            section.update(value)
+
+    def __contains__(self, name):
+        return name in self.defaults
+
+    def keys(self):
+        return self.defaults.keys()
+
+    def mark_dirty(self, name, key=None):
+        """Record a change made in place to an entry, or to a key of a
+        section (all the keys if key is None)."""
+        with self.lock:
+            if not self._is_section(name):
+                self.uncommitted.add((name, None))
+            elif key is None:
+                self.uncommitted.update(
+                    (name, k) for k in self._load(name).keys())
+            else:
+                self.uncommitted.add((name, key))
+
+    def _current_value(self, name, key):
+        # Returns (present, value)
+        entry = self.entries[name]
+        if key is None:
+            return (True, entry)
+        if key in entry:
+            return (True, entry[key])
+        return (False, None)
+
+    def commit(self):
+        """Record the changes made since the last commit."""
+        with self.lock:
+            if not self.uncommitted or self.closed:
+                return
+            changes = self.uncommitted
+            self.uncommitted = set()
+            if not self.db_file_no_ext:
+                return
+
+            with open(self.journal_file, 'ab') as f:
+                for name, key in changes:
+                    present, value = self._current_value(name, key)
+                    pickle.dump((name, key, present, value), f)
+                f.flush()
+                os.fsync(f.fileno())
+            self.dirty.update(changes)
+
+            if not self.flush_interval:
+                self.flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """Write the committed changes to the database."""
+        with self.lock:
+            self.timer = None
+            if not self.db_file_no_ext or not (self.dirty or self.obsolete):
+                return
+
+            with self._open_db() as db:
+                for name, key in self.dirty:
+                    # The replayed journal records of an entry that was never
+                    # loaded must be applied first
+                    self._load(name)
+                    present, value = self._current_value(name, key)
+                    db_key = self._db_key(name, key)
+                    if present:
+                        db[db_key] = value
+                    elif db_key in db:
+                        del db[db_key]
+                for name in self.obsolete:
+                    if name in db:
+                        del db[name]
+                db.sync()
+            self._fsync_db()
+
+            # Everything in the journal is on disk in the database now
+            open(self.journal_file, 'wb').close()
+            if self.logger:
+                self.logger.debug(
+                    "Persisted {} changed keys".format(len(self.dirty)))
+            self.dirty = set()
+            self.obsolete = set()
+            self.journal = {}
+
+    def _fsync_db(self):
+        for extension in DB_FILE_EXTENSIONS:
+            try:
+                fd = os.open(self.db_file_no_ext + extension, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def close(self, flush=True):
+        """Stop the background writes, writing the pending changes if flush is
+        True."""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if flush:
+                self.commit()
+                self.flush()
+            self.closed = True
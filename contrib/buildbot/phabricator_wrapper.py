@@ -28,6 +28,7 @@ class PhabWrapper(Phabricator):
                 Deployment.DEV))
         self.phid = None
         self.file_cache = {}
+        self.cache = None
 
     def get_current_user_phid(self):
         # The current user PHID is not expected to change, so cache the result
@@ -41,6 +42,9 @@ class PhabWrapper(Phabricator):
     def setLogger(self, logger):
         self.logger = logger
 
+    def set_cache(self, cache):
+        self.cache = cache
+
     def get_revisionPHID(self, branch):
         branch_info = branch.split("/")
         # Either refs/tags/* or refs/heads/*
@@ -371,6 +375,17 @@ class PhabWrapper(Phabricator):
             revision_id=int(revision_id)))
 
     def get_file_content_from_master(self, path):
+        if self.cache is None:
+            return self._get_file_content_from_master(path)
+
+        # Level 0 cache: the file content is cached for a short time, which
+        # saves the master commit lookup of the level 1 cache
+        return self.cache.get(
+            'get_file_content_from_master',
+            (path,),
+            lambda: self._get_file_content_from_master(path))
+
+    def _get_file_content_from_master(self, path):
         latest_commit_hash = self.get_latest_master_commit_hash()
 
         # Level 1 cache: check if the file is cached from the same commit
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import threading
+import time
+
+
+# Default time to live of the cached responses, in seconds. An endpoint with a
+# TTL of 0 is not cached, but the concurrent requests are still coalesced.
+DEFAULT_TTLS = {
+    # The build info only changes while the build is running, and is
+    # invalidated when a status event is received for the build.
+    'getBuildInfo': 600,
+    # Invalidated when a status event is received for the build type.
+    'getLatestCompletedBuild': 300,
+    'associate_configuration_names': 300,
+    'get_file_content_from_master': 60,
+    # The log of a completed build doesn't change. Only the search results are
+    # cached, not the logs.
+    'searchBuildLog': 3600,
+    'getBuildLogTail': 3600,
+}
+
+
+class InFlightRequest():
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class ResponseCache():
+    """A cache for the API responses, shared by the wrappers.
+
+    Responses are cached per endpoint and key tuple for the endpoint TTL, and
+    can be invalidated by key prefix. Concurrent
+    requests for the same endpoint and key are coalesced into a single API
+    request. Failed requests are not cached.
+
+    The cached responses are shared between the callers and must not be
+    modified.
+    """
+
+    def __init__(self, ttls=None, time_fn=time.time):
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.time_fn = time_fn
+
+        self.lock = threading.Lock()
+        # (endpoint, key) => (expiry time, response)
+        self.entries = {}
+        # (endpoint, key) => InFlightRequest. An invalidated request is removed
+        # so the next callers don't get its possibly stale response.
+        self.in_flight = {}
+        # endpoint => counter name => count
+        self.counters = {}
+
+    def _count(self, endpoint, counter):
+        # Must be called with the lock held
+        counters = self.counters.setdefault(endpoint, {
+            'hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'invalidated': 0,
+        })
+        counters[counter] += 1
+
+    def get(self, endpoint, key, fetch_fn):
+        """Return the cached response for endpoint and the key tuple, or call
+        fetch_fn() to get it."""
+        cache_key = (endpoint, key)
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None:
+                expiry, response = entry
+                if expiry > self.time_fn():
+                    self._count(endpoint, 'hits')
+                    return response
+                del self.entries[cache_key]
+
+            request = self.in_flight.get(cache_key)
+            coalesced = request is not None
+            if coalesced:
+                self._count(endpoint, 'coalesced')
+            else:
+                self._count(endpoint, 'misses')
+                request = InFlightRequest()
+                self.in_flight[cache_key] = request
+
+        if coalesced:
+            request.done.wait()
+            if request.exception is not None:
+                raise request.exception
+            return request.result
+
+        try:
+            request.result = fetch_fn()
+        except BaseException as e:
+            request.exception = e
+            raise
+        finally:
+            ttl = self.ttls.get(endpoint, 0)
+            with self.lock:
+                # If the request was invalidated while it was fetched it has
+                # been removed already, and its response is not cached as it
+                # might be stale.
+                if self.in_flight.get(cache_key) is request:
+                    del self.in_flight[cache_key]
+                    if request.exception is None and ttl > 0:
+                        self.entries[cache_key] = (
+                            self.time_fn() + ttl, request.result)
+            request.done.set()
+
+        return request.result
+
+    def invalidate(self, endpoint, key_prefix=()):
+        """Invalidate the cached responses for endpoint whose key starts with
+        key_prefix, all of them by default."""
+        def matches(cache_key):
+            return cache_key[0] == endpoint and \
+                cache_key[1][:len(key_prefix)] == key_prefix
+
+        with self.lock:
+            for cache_key in [k for k in self.entries if matches(k)]:
+                del self.entries[cache_key]
+                self._count(endpoint, 'invalidated')
+            for cache_key in [k for k in self.in_flight if matches(k)]:
+                del self.in_flight[cache_key]
+
+    def get_metrics(self):
+        with self.lock:
+            metrics = {}
+            for endpoint, counters in self.counters.items():
+                requests = counters['hits'] + \
+                    counters['misses'] + counters['coalesced']
+                metrics[endpoint] = dict(counters)
+                metrics[endpoint]['hit_rate'] = (
+                    counters['hits'] + counters['coalesced']) / requests if requests else 0
+            return metrics
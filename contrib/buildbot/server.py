@@ -6,21 +6,26 @@
 
 
 from build import BuildStatus, BuildTarget
+from concurrent.futures import ThreadPoolExecutor
+import copy
 from deepmerge import always_merger
-from flask import abort, Flask, request
+from event_queue import EventQueue
+from flask import abort, Flask, jsonify, request
 from functools import wraps
 import hashlib
 import hmac
+import inspect
 import logging
 import os
+from persistence import DEFAULT_FLUSH_INTERVAL, PersistentState
 from phabricator_wrapper import (
     BITCOIN_ABC_PROJECT_PHID,
 )
 import re
-import shelve
 from shieldio import RasterBadge
 from shlex import quote
 from teamcity_wrapper import TeamcityRequestException
+import threading
 import yaml
 
 
@@ -30,8 +35,15 @@ FAILURE = "failure"
 RUNNING = "running"
 UNRESOLVED = "UNRESOLVED"
 
+# Response to the webhooks whose event is queued for later processing
+QUEUED = "queued"
+
 LANDBOT_BUILD_TYPE = "BitcoinAbcLandBot"
 
+# Maximum number of concurrent TeamCity requests when updating the build
+# status panel
+PANEL_QUERY_WORKERS = 8
+
 # FIXME: figure out why the base64 logo started causing phabricator to
 # get a 502 response with the embedded {image} link.
 # In the meantime use the TeamCity icon from simpleicons.org
@@ -54,7 +66,9 @@ BADGE_CIRRUS_BASE = RasterBadge(
 
 
 def create_server(tc, phab, slackbot, cirrus,
-                  db_file_no_ext=None, jsonEncoder=None):
+                  db_file_no_ext=None, jsonEncoder=None, event_workers=0,
+                  response_cache=None, panel_update_delay=0,
+                  db_flush_interval=DEFAULT_FLUSH_INTERVAL):
     # Create Flask app for use as decorator
     app = Flask("abcbot")
     app.logger.setLevel(logging.INFO)
@@ -67,51 +81,60 @@ def create_server(tc, phab, slackbot, cirrus,
     tc.set_logger(app.logger)
     cirrus.set_logger(app.logger)
 
-    # Optionally persistable database
-    create_server.db = {
-        # A collection of the known build targets
-        'diff_targets': {},
-        # Build status panel data
-        'panel_data': {},
-        # Whether the last status check of master was green
-        'master_is_green': True,
-        # Coverage panel data
-        'coverage_data': {},
-    }
+    # The API responses can be cached and shared between the wrappers
+    if response_cache:
+        phab.set_cache(response_cache)
+        tc.set_cache(response_cache)
 
-    # If db_file_no_ext is not None, attempt to restore old database state
+    # Optionally persistable database. If db_file_no_ext is not None, the old
+    # database state is restored lazily, when each key is first accessed. Only
+    # the changed keys are persisted, see PersistentState.
     if db_file_no_ext:
         app.logger.info(
-            "Loading persisted state database with base name '{}'...".format(db_file_no_ext))
-        try:
-            with shelve.open(db_file_no_ext, flag='r') as db:
-                for key in create_server.db.keys():
-                    if key in db:
-                        create_server.db[key] = db[key]
-                        app.logger.info(
-                            "Restored key '{}' from persisted state".format(key))
-        except BaseException:
-            app.logger.info(
-                "Persisted state database with base name '{}' could not be opened. A new one will be created when written to.".format(db_file_no_ext))
-        app.logger.info("Done")
+            "Using persisted state database with base name '{}'".format(db_file_no_ext))
     else:
         app.logger.warning(
             "No database file specified. State will not be persisted.")
-
+    create_server.db = PersistentState(
+        {
+            # A collection of the known build targets
+            'diff_targets': {},
+            # Build status panel data
+            'panel_data': {},
+            # Whether the last status check of master was green
+            'master_is_green': True,
+            # Coverage panel data
+            'coverage_data': {},
+        },
+        db_file_no_ext=db_file_no_ext,
+        flush_interval=db_flush_interval,
+        logger=app.logger,
+    )
+
+    # The build status events are processed by a pool of event_workers
+    # threads, so the /status webhook can return immediately. If there are no
+    # workers, the events are processed synchronously.
+    create_server.event_queue = EventQueue(
+        lambda event: process_build_result(event),
+        event_workers,
+        journal_file_no_ext="{}_events".format(
+            db_file_no_ext) if db_file_no_ext else None,
+        logger=app.logger,
+    )
+
+    # The state is read and modified concurrently by the request threads, the
+    # event workers and the panel update timer, and it is pickled by the
+    # database commits. The functions hold the state lock while they access
+    # it, leaving it consistent when they release it, but not while they wait
+    # for TeamCity, Phabricator, Cirrus or Slack: a slow event must not hold
+    # back the other requests.
     def persistDatabase(fn):
         @wraps(fn)
         def decorated_function(*args, **kwargs):
             fn_ret = fn(*args, **kwargs)
 
-            # Persist database after executed decorated function
-            if db_file_no_ext:
-                with shelve.open(db_file_no_ext) as db:
-                    for key in create_server.db.keys():
-                        db[key] = create_server.db[key]
-                    app.logger.debug("Persisted current state")
-            else:
-                app.logger.debug(
-                    "No database file specified. Persisting state is being skipped.")
+            # Persist the changes made by the decorated function
+            create_server.db.commit()
 
             return fn_ret
         return decorated_function
@@ -238,12 +261,13 @@ def create_server(tc, phab, slackbot, cirrus,
             }]
 
         build_id = tc.trigger_build(buildTypeId, ref, PHID, properties)['id']
-        if PHID in create_server.db['diff_targets']:
-            build_target = create_server.db['diff_targets'][PHID]
-        else:
-            build_target = BuildTarget(PHID)
-        build_target.queue_build(build_id, abcBuildName)
-        create_server.db['diff_targets'][PHID] = build_target
+        with create_server.db.lock:
+            if PHID in create_server.db['diff_targets']:
+                build_target = create_server.db['diff_targets'][PHID]
+            else:
+                build_target = BuildTarget(PHID)
+            build_target.queue_build(build_id, abcBuildName)
+            create_server.db['diff_targets'][PHID] = build_target
         return SUCCESS, 200
 
     @app.route("/buildDiff", methods=['POST'])
@@ -312,11 +336,7 @@ def create_server(tc, phab, slackbot, cirrus,
                 else:
                     builds.append(build_name)
 
-        if target_phid in create_server.db['diff_targets']:
-            build_target = create_server.db['diff_targets'][target_phid]
-        else:
-            build_target = BuildTarget(target_phid)
-
+        queued_builds = []
         for build_name in builds:
             properties = [{
                 'name': 'env.ABC_BUILD_NAME',
@@ -330,11 +350,21 @@ def create_server(tc, phab, slackbot, cirrus,
                 staging_ref,
                 target_phid,
                 properties)['id']
-            build_target.queue_build(build_id, build_name)
+            queued_builds.append((build_id, build_name))
+
+        with create_server.db.lock:
+            if target_phid in create_server.db['diff_targets']:
+                build_target = create_server.db['diff_targets'][target_phid]
+            else:
+                build_target = BuildTarget(target_phid)
+            for build_id, build_name in queued_builds:
+                build_target.queue_build(build_id, build_name)
 
-        if len(build_target.builds) > 0:
-            create_server.db['diff_targets'][target_phid] = build_target
-        else:
+            if len(build_target.builds) > 0:
+                create_server.db['diff_targets'][target_phid] = build_target
+                build_target = None
+
+        if build_target is not None:
             phab.update_build_target_status(build_target)
 
         return SUCCESS, 200
@@ -524,11 +554,56 @@ def create_server(tc, phab, slackbot, cirrus,
         return SUCCESS, 200
 
     @app.route("/status", methods=['POST'])
-    @persistDatabase
     def buildStatus():
         out = get_json_request_data(request)
         app.logger.info("Received /status POST with data: {}".format(out))
-        return handle_build_result(**out)
+
+        # The build status changed, so the cached responses about this build
+        # and its build type are stale
+        if 'buildTypeId' in out and 'buildId' in out:
+            tc.invalidate_build_cache(out['buildTypeId'], out['buildId'])
+
+        if not create_server.event_queue.num_workers:
+            return process_build_result(out)
+
+        # Reject the malformed events before queuing them, so the webhook
+        # still gets an error.
+        try:
+            inspect.signature(handle_build_result).bind(**out)
+        except TypeError:
+            return FAILURE, 400
+        response = check_build_result(**out)
+        if response is not None:
+            return response
+
+        # Events are processed in order for each revision, and the repeated
+        # events for the same build and result are dropped.
+        if not create_server.event_queue.put(
+                out,
+                ordering_key=get_revision_ordering_key(out['branch']),
+                dedup_key=(out['buildId'], out['buildResult'])):
+            app.logger.info(
+                "Dropped duplicated /status event for build {}".format(
+                    out['buildId']))
+        return QUEUED, 202
+
+    def get_revision_ordering_key(branch):
+        # All the master builds are ordered together, as they update the same
+        # panels and master state.
+        if branch == "<default>":
+            return "refs/heads/master"
+        return branch
+
+    @app.route("/metrics", methods=['GET'])
+    def metrics():
+        return jsonify({
+            'event_queue': create_server.event_queue.get_metrics(),
+            'response_cache': response_cache.get_metrics() if response_cache else {},
+        })
+
+    @persistDatabase
+    def process_build_result(event):
+        return handle_build_result(**event)
 
     def send_harbormaster_build_link_if_required(
             build_link, build_target, build_name):
@@ -561,7 +636,55 @@ def create_server(tc, phab, slackbot, cirrus,
             }
         )
 
-    def update_build_status_panel(updated_build_type_id):
+    # The build status panel updates requested within panel_update_delay
+    # seconds are merged into a single update. If the delay is 0 the panel is
+    # updated immediately. The panel updates run one at a time, so the
+    # statuses fetched by an update don't overwrite the newer ones of the
+    # next update.
+    panel_update = {
+        'lock': threading.Lock(),
+        'update_lock': threading.Lock(),
+        'build_type_ids': set(),
+        'timer': None,
+    }
+
+    def request_build_status_panel_update(updated_build_type_id):
+        if not panel_update_delay:
+            update_build_status_panel([updated_build_type_id])
+            return
+
+        with panel_update['lock']:
+            panel_update['build_type_ids'].add(updated_build_type_id)
+            if panel_update['timer'] is None:
+                panel_update['timer'] = threading.Timer(
+                    panel_update_delay, run_build_status_panel_update)
+                panel_update['timer'].daemon = True
+                panel_update['timer'].start()
+
+    @persistDatabase
+    def run_build_status_panel_update():
+        with panel_update['lock']:
+            build_type_ids = panel_update['build_type_ids']
+            panel_update['build_type_ids'] = set()
+            panel_update['timer'] = None
+
+        try:
+            update_build_status_panel(build_type_ids)
+        except BaseException:
+            app.logger.exception(
+                "Failed to update the build status panel for build types {}".format(
+                    build_type_ids))
+
+    def update_build_status_panel(updated_build_type_ids):
+        # The TeamCity build statuses are fetched concurrently. The requests
+        # share the session of the TeamCity wrapper.
+        with panel_update['update_lock'], \
+                ThreadPoolExecutor(max_workers=PANEL_QUERY_WORKERS) as executor:
+            panel_content = build_status_panel_content(
+                executor, updated_build_type_ids)
+            phab.set_text_panel_content(17, panel_content)
+
+    def build_status_panel_content(executor, updated_build_type_ids):
         # Perform a XOR like operation on the dicts:
         #  - if a key from target is missing from reference, remove it from
         #    target.
@@ -600,7 +723,14 @@ def create_server(tc, phab, slackbot, cirrus,
         # secp256k1 is a special case because it has a Cirrus build from a
         # Github repo that is not managed by the build-configurations.yml config.
         # The status always need to be fetched.
-        sepc256k1_cirrus_status = cirrus.get_default_branch_status()
+        sepc256k1_cirrus_status_future = executor.submit(
+            cirrus.get_default_branch_status)
+
+        # Download the build configuration from master
+        config = yaml.safe_load(phab.get_file_content_from_master(
+            "contrib/teamcity/build-configurations.yml"))
+
+        sepc256k1_cirrus_status = sepc256k1_cirrus_status_future.result()
         cirrus_badge_url = BADGE_CIRRUS_BASE.get_badge_url(
             message=sepc256k1_cirrus_status.value,
             color=('brightgreen' if sepc256k1_cirrus_status == BuildStatus.Success else
@@ -623,10 +753,6 @@ def create_server(tc, phab, slackbot, cirrus,
         )
         panel_content = add_line_to_panel('')
 
-        # Download the build configuration from master
-        config = yaml.safe_load(phab.get_file_content_from_master(
-            "contrib/teamcity/build-configurations.yml"))
-
         # Get a list of the builds to display
         config_build_names = [
             k for k, v in config.get(
@@ -636,8 +762,7 @@ def create_server(tc, phab, slackbot, cirrus,
         # If there is no build to display, don't update the panel with teamcity
         # data
         if not config_build_names:
-            phab.set_text_panel_content(17, panel_content)
-            return
+            return panel_content
 
         # Associate with Teamcity data from the BitcoinABC project
         associated_builds = tc.associate_configuration_names(
@@ -657,8 +782,9 @@ def create_server(tc, phab, slackbot, cirrus,
 
         # If the list of project names has changed (project was added, deleted
         # or renamed, update the panel data accordingly.
-        (removed_projects, added_projects) = dict_xor(
-            create_server.db['panel_data'], project_ids, lambda key: {})
+        with create_server.db.lock:
+            (removed_projects, added_projects) = dict_xor(
+                create_server.db['panel_data'], project_ids, lambda key: {})
 
         # Log the project changes if any
         if (len(removed_projects) + len(added_projects)) > 0:
@@ -692,82 +818,103 @@ def create_server(tc, phab, slackbot, cirrus,
 
             return (build_status, build_status_message)
 
-        # Update the builds
-        for project_id, project_builds in sorted(
-                create_server.db['panel_data'].items()):
-            build_type_ids = [build['teamcity_build_type_id'] for build in list(
+        def get_project_build_type_ids(project_id):
+            return [build['teamcity_build_type_id'] for build in list(
                 associated_builds.values()) if build['teamcity_project_id'] == project_id]
 
-            # If the list of builds has changed (build was added, deleted,
-            # renamed, added to or removed from the items to display), update
-            # the panel data accordingly.
-            (removed_builds, added_builds) = dict_xor(
-                project_builds,
-                build_type_ids,
-                # We need to fetch the satus for each added build
-                lambda key: get_build_status_and_message(key)
-            )
+        # Fetch the status of the added builds and of the builds that
+        # triggered the update concurrently.
+        build_type_ids_to_fetch = set()
+        with create_server.db.lock:
+            for project_id, project_builds in create_server.db['panel_data'].items():
+                for build_type_id in get_project_build_type_ids(project_id):
+                    if build_type_id not in project_builds or build_type_id in updated_build_type_ids:
+                        build_type_ids_to_fetch.add(build_type_id)
+        build_type_ids_to_fetch = sorted(build_type_ids_to_fetch)
+        build_statuses = dict(zip(
+            build_type_ids_to_fetch,
+            executor.map(get_build_status_and_message, build_type_ids_to_fetch)))
+
+        # Update the builds. No request is made from here, so the panel
+        # content is built with the state lock held.
+        with create_server.db.lock:
+            for project_id, project_builds in sorted(
+                    create_server.db['panel_data'].items()):
+                build_type_ids = get_project_build_type_ids(project_id)
+
+                # If the list of builds has changed (build was added, deleted,
+                # renamed, added to or removed from the items to display), update
+                # the panel data accordingly.
+                (removed_builds, added_builds) = dict_xor(
+                    project_builds,
+                    build_type_ids,
+                    # The status of each added build has been fetched
+                    lambda key: build_statuses[key]
+                )
 
-            # Log the build changes if any
-            if (len(removed_builds) + len(added_builds)) > 0:
-                app.logger.info(
-                    "Teamcity build list has changed for project {}.\nRemoved: {}\nAdded: {}".format(
-                        project_id,
-                        removed_builds,
-                        added_builds,
+                # Log the build changes if any
+                if (len(removed_builds) + len(added_builds)) > 0:
+                    app.logger.info(
+                        "Teamcity build list has changed for project {}.\nRemoved: {}\nAdded: {}".format(
+                            project_id,
+                            removed_builds,
+                            added_builds,
+                        )
                     )
-                )
 
-            # From here only the build that triggered the call need to be
-            # updated. Note that it might already be up-to-date if the build was
-            # part of the added ones.
-            # Other data remains valid from the previous calls.
-            if updated_build_type_id not in added_builds and updated_build_type_id in list(
-                    project_builds.keys()):
-                project_builds[updated_build_type_id] = get_build_status_and_message(
-                    updated_build_type_id)
-
-            # Create a table view of the project:
-            #
-            #    | <project_name>       | Status      |
-            #    |------------------------------------|
-            #    | Link to latest build | Status icon |
-            #    | Link to latest build | Status icon |
-            #    | Link to latest build | Status icon |
-            panel_content = add_project_header_to_panel(
-                project_name_map[project_id])
-
-            for build_type_id, (build_status,
-                                build_status_message) in project_builds.items():
-                url = tc.build_url(
-                    "viewLog.html",
-                    {
-                        "buildTypeId": build_type_id,
-                        "buildId": "lastFinished"
-                    }
-                )
+                # From here only the builds that triggered the call need to be
+                # updated. Note that they might already be up-to-date if the build
+                # was part of the added ones.
+                # Other data remains valid from the previous calls.
+                for updated_build_type_id in updated_build_type_ids:
+                    if updated_build_type_id not in added_builds and updated_build_type_id in list(
+                            project_builds.keys()):
+                        project_builds[updated_build_type_id] = build_statuses[updated_build_type_id]
+
+                # The project builds are modified in place
+                create_server.db['panel_data'][project_id] = project_builds
+
+                # Create a table view of the project:
+                #
+                #    | <project_name>       | Status      |
+                #    |------------------------------------|
+                #    | Link to latest build | Status icon |
+                #    | Link to latest build | Status icon |
+                #    | Link to latest build | Status icon |
+                panel_content = add_project_header_to_panel(
+                    project_name_map[project_id])
+
+                for build_type_id, (build_status,
+                                    build_status_message) in project_builds.items():
+                    url = tc.build_url(
+                        "viewLog.html",
+                        {
+                            "buildTypeId": build_type_id,
+                            "buildId": "lastFinished"
+                        }
+                    )
 
-                # TODO insert Teamcity build failure message
-                badge_url = BADGE_TC_BASE.get_badge_url(
-                    message=build_status_message,
-                    color=(
-                        'lightgrey' if build_status == BuildStatus.Unknown
-                        else 'brightgreen' if build_status == BuildStatus.Success
-                        else 'red'
-                    ),
-                )
+                    # TODO insert Teamcity build failure message
+                    badge_url = BADGE_TC_BASE.get_badge_url(
+                        message=build_status_message,
+                        color=(
+                            'lightgrey' if build_status == BuildStatus.Unknown
+                            else 'brightgreen' if build_status == BuildStatus.Success
+                            else 'red'
+                        ),
+                    )
 
-                panel_content = add_line_to_panel(
-                    '| [[{} | {}]] | {{image uri="{}", alt="{}"}} |'.format(
-                        url,
-                        build_name_map[build_type_id],
-                        badge_url,
-                        build_status_message,
+                    panel_content = add_line_to_panel(
+                        '| [[{} | {}]] | {{image uri="{}", alt="{}"}} |'.format(
+                            url,
+                            build_name_map[build_type_id],
+                            badge_url,
+                            build_status_message,
+                        )
                     )
-                )
-            panel_content = add_line_to_panel('')
+                panel_content = add_line_to_panel('')
 
-        phab.set_text_panel_content(17, panel_content)
+        return panel_content
 
     def update_coverage_panel(build_type_id, project_name, coverage_summary):
         coverage_permalink = "**[[ https://build.bitcoinabc.org/viewLog.html?buildId=lastSuccessful&buildTypeId={}&tab=report__Root_Code_Coverage&guest=1 | {} coverage report ]]**\n\n".format(
@@ -802,14 +949,15 @@ def create_server(tc, phab, slackbot, cirrus,
             )
 
         # Cache the coverage data for this build type
-        coverage_data = create_server.db['coverage_data']
-        coverage_data[build_type_id] = coverage_permalink + coverage_report
+        with create_server.db.lock:
+            coverage_data = create_server.db['coverage_data']
+            coverage_data[build_type_id] = coverage_permalink + coverage_report
+            coverage_panel_content = "\n".join(coverage_data.values())
 
         # Update the coverage panel with our remarkup content
-        phab.set_text_panel_content(21, "\n".join(coverage_data.values()))
+        phab.set_text_panel_content(21, coverage_panel_content)
 
-    def handle_build_result(buildName, buildTypeId, buildResult,
-                            buildURL, branch, buildId, buildTargetPHID, projectName, **kwargs):
+    def check_build_result(buildTypeId, branch, **kwargs):
         # Do not report build status for ignored builds
         if phab.getIgnoreKeyword() in buildTypeId:
             return SUCCESS, 200
@@ -818,6 +966,14 @@ def create_server(tc, phab, slackbot, cirrus,
         if branch == "UNRESOLVED":
             return FAILURE, 400
 
+        return None
+
+    def handle_build_result(buildName, buildTypeId, buildResult,
+                            buildURL, branch, buildId, buildTargetPHID, projectName, **kwargs):
+        response = check_build_result(buildTypeId, branch)
+        if response is not None:
+            return response
+
         guest_url = tc.convert_to_guest_url(buildURL)
 
         status = BuildStatus(buildResult)
@@ -827,7 +983,7 @@ def create_server(tc, phab, slackbot, cirrus,
         # If a build completed on master, update the build status panel.
         if isMaster and (
                 status == BuildStatus.Success or status == BuildStatus.Failure):
-            update_build_status_panel(buildTypeId)
+            request_build_status_panel_update(buildTypeId)
 
             # If the build succeeded and there is a coverage report in the build
             # artifacts, update the coverage panel.
@@ -843,11 +999,22 @@ def create_server(tc, phab, slackbot, cirrus,
                     update_coverage_panel(
                         buildTypeId, projectName, coverage_summary)
 
-        # If we have a buildTargetPHID, report the status.
-        build_target = create_server.db['diff_targets'].get(
-            buildTargetPHID, None)
+        # If we have a buildTargetPHID, report the status. The target is
+        # reported from a copy, as /build may queue more builds to it
+        # meanwhile.
+        with create_server.db.lock:
+            build_target = create_server.db['diff_targets'].get(
+                buildTargetPHID, None)
+            if build_target is not None:
+                build_target.update_build_status(buildId, status)
+                if build_target.is_finished():
+                    del create_server.db['diff_targets'][buildTargetPHID]
+                else:
+                    create_server.db['diff_targets'][buildTargetPHID] = build_target
+                build_target = copy.deepcopy(build_target)
+
         if build_target is not None:
-            phab.update_build_target_status(build_target, buildId, status)
+            phab.update_build_target_status(build_target)
 
             send_harbormaster_build_link_if_required(
                 guest_url,
@@ -855,9 +1022,6 @@ def create_server(tc, phab, slackbot, cirrus,
                 build_target.builds[buildId].name
             )
 
-            if build_target.is_finished():
-                del create_server.db['diff_targets'][buildTargetPHID]
-
         revisionPHID = phab.get_revisionPHID(branch)
 
         buildInfo = tc.getBuildInfo(buildId)
@@ -869,8 +1033,7 @@ def create_server(tc, phab, slackbot, cirrus,
             if len(buildFailures) > 0:
                 # If any infrastructure-related failures occurred, ping the right
                 # people with a useful message.
-                buildLog = tc.getBuildLog(buildId)
-                if re.search(re.escape("[Infrastructure Error]"), buildLog):
+                if tc.searchBuildLog(buildId, [re.escape("[Infrastructure Error]")]) is not None:
                     slackbot.postMessage('infra',
                                          "<!subteam^S012TUC9S2Z> There was an infrastructure failure in '{}': {}".format(
                                              buildName, guest_url))
@@ -938,8 +1101,11 @@ def create_server(tc, phab, slackbot, cirrus,
                         (buildFailures, testFailures) = tc.getLatestBuildAndTestFailures(
                             'BitcoinABC')
                         if len(buildFailures) == 0 and len(testFailures) == 0:
-                            if not create_server.db['master_is_green']:
-                                create_server.db['master_is_green'] = True
+                            with create_server.db.lock:
+                                was_red = not create_server.db['master_is_green']
+                                if was_red:
+                                    create_server.db['master_is_green'] = True
+                            if was_red:
                                 slackbot.postMessage(
                                     'dev', "Master is green again.")
 
@@ -952,16 +1118,17 @@ def create_server(tc, phab, slackbot, cirrus,
                     )
 
                     # Explicitly ignored log lines. Use with care.
-                    buildLog = tc.getBuildLog(buildId)
+                    ignorePatterns = []
                     for line in tc.getIgnoreList():
                         # Skip empty lines and comments in the ignore file
                         if not line or line.decode().strip()[0] == '#':
                             continue
+                        ignorePatterns.append(line.decode())
 
-                        # If any of the ignore patterns match any line in the
-                        # build log, ignore this failure
-                        if re.search(line.decode(), buildLog):
-                            return SUCCESS, 200
+                    # If any of the ignore patterns match any line in the
+                    # build log, ignore this failure
+                    if tc.searchBuildLog(buildId, ignorePatterns) is not None:
+                        return SUCCESS, 200
 
                     # Get number of build failures over the last few days
                     numRecentFailures = tc.getNumAggregateFailuresSince(
@@ -1037,13 +1204,8 @@ def create_server(tc, phab, slackbot, cirrus,
                 if len(testFailures) == 0:
                     # If no test failure is available, print the tail of the
                     # build log
-                    buildLog = tc.getBuildLog(buildId)
-                    logLines = []
-                    for line in buildLog.splitlines(keepends=True):
-                        logLines.append(line)
-
                     msg += "Tail of the build log:\n```lines=16,COUNTEREXAMPLE\n{}```".format(
-                        ''.join(logLines[-60:]))
+                        tc.getBuildLogTail(buildId, 60))
                 else:
                     # Print the failure log for each test
                     msg += 'Failed tests logs:\n'
@@ -1062,4 +1224,6 @@ def create_server(tc, phab, slackbot, cirrus,
 
         return SUCCESS, 200
 
+    create_server.event_queue.start()
+
     return app
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
-from collections import UserDict
+import codecs
+from collections import deque, UserDict
 import io
 import json
 import os
@@ -17,6 +18,10 @@ from urllib.parse import (
 from zipfile import ZipFile
 
 
+# Size of the chunks the build logs are decompressed and processed by
+BUILD_LOG_CHUNK_SIZE = 64 * 1024
+
+
 class TeamcityRequestException(Exception):
     pass
 
@@ -50,6 +55,7 @@ class TeamCity():
         self.base_url = base_url
         self.auth = (username, password)
         self.logger = None
+        self.cache = None
         self.mockTime = None
         with open(os.path.join(os.path.dirname(__file__), 'ignore-logs.txt'), 'rb') as ignoreList:
             self.ignoreList = ignoreList.readlines()
@@ -57,6 +63,24 @@ class TeamCity():
     def set_logger(self, logger):
         self.logger = logger
 
+    def set_cache(self, cache):
+        self.cache = cache
+
+    def _cached(self, endpoint, key, fetch):
+        if self.cache is None:
+            return fetch()
+        return self.cache.get(endpoint, key, fetch)
+
+    # Called when a build status changed, so the cached responses about this
+    # build and its build type are no longer valid
+    def invalidate_build_cache(self, buildTypeId, buildId):
+        if self.cache is None:
+            return
+        self.cache.invalidate('getBuildInfo', (buildId,))
+        self.cache.invalidate('searchBuildLog', (buildId,))
+        self.cache.invalidate('getBuildLogTail', (buildId,))
+        self.cache.invalidate('getLatestCompletedBuild', (buildTypeId,))
+
     def getTime(self):
         if self.mockTime:
             return self.mockTime
@@ -139,12 +163,19 @@ class TeamCity():
     def get_clean_build_log(self, buildId):
         return self.get_artifact(buildId, "artifacts.tar.gz!/build.clean.log")
 
-    def getBuildLog(self, buildId):
+    def iterBuildLogLines(self, buildId):
+        """Yield the lines of the build log, with their line ending.
+
+        The archived log is decompressed and decoded chunk by chunk, so the
+        whole log is never held in memory.
+        """
         # Try to get the clean build log first, then fallback to the full log
         try:
             clean_log = self.get_clean_build_log(buildId)
             if clean_log:
-                return clean_log
+                for line in io.StringIO(clean_log.replace('\r\n', '\n')):
+                    yield line
+                return
         except TeamcityRequestException:
             # This is likely a 404 and the log doesn't exist. Either way,
             # ignore the failure since there is an alternative log we can
@@ -160,15 +191,73 @@ class TeamCity():
         )
         req = self._request('GET', endpoint)
         content = self.getResponse(req, expectJson=False)
-        ret = ""
         if not content:
-            ret = "[Error Fetching Build Log]"
-        else:
-            z = ZipFile(io.BytesIO(content))
+            yield "[Error Fetching Build Log]"
+            return
+
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        pending = ''
+        with ZipFile(io.BytesIO(content)) as z:
+            # The files are concatenated, as if they were a single log
             for filename in z.namelist():
-                for line in z.open(filename).readlines():
-                    ret += line.decode('utf-8')
-        return ret.replace('\r\n', '\n')
+                with z.open(filename) as f:
+                    while True:
+                        chunk = f.read(BUILD_LOG_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        lines = (pending + decoder.decode(chunk)).split('\n')
+                        # The last line is incomplete
+                        pending = lines.pop()
+                        for line in lines:
+                            if line.endswith('\r'):
+                                line = line[:-1]
+                            yield line + '\n'
+        pending += decoder.decode(b'', final=True)
+        if pending:
+            yield pending
+
+    def getBuildLog(self, buildId):
+        return ''.join(self.iterBuildLogLines(buildId))
+
+    def searchBuildLog(self, buildId, patterns, context_lines=2):
+        """Search the build log for the first line matching any of the regex
+        patterns.
+
+        The log is streamed and the search stops after the first match.
+        Returns the matching line surrounded by up to context_lines lines of
+        context, or None if there is no match.
+        """
+        patterns = tuple(patterns)
+
+        def fetch():
+            regexes = [re.compile(pattern) for pattern in patterns]
+            before = deque(maxlen=context_lines)
+            match = None
+            after = 0
+            for line in self.iterBuildLogLines(buildId):
+                if match is not None:
+                    match.append(line)
+                    after += 1
+                    if after >= context_lines:
+                        break
+                elif any(regex.search(line) for regex in regexes):
+                    match = list(before) + [line]
+                    if context_lines == 0:
+                        break
+                else:
+                    before.append(line)
+            return ''.join(match) if match is not None else None
+
+        return self._cached(
+            'searchBuildLog', (buildId, patterns, context_lines), fetch)
+
+    def getBuildLogTail(self, buildId, num_lines):
+        """Return the last num_lines lines of the build log."""
+        def fetch():
+            return ''.join(
+                deque(self.iterBuildLogLines(buildId), maxlen=num_lines))
+
+        return self._cached('getBuildLogTail', (buildId, num_lines), fetch)
 
     def getBuildProblems(self, buildId):
         endpoint = self.build_url(
@@ -258,21 +347,24 @@ class TeamCity():
         return []
 
     def getBuildInfo(self, buildId):
-        endpoint = self.build_url(
-            "app/rest/builds",
-            {
-                "locator": "id:{}".format(buildId),
-                # Note: Wildcard does not match recursively, so if you need data
-                # from a sub-field, be sure to include it in the list.
-                "fields": "build(*,changes(*),properties(*),triggered(*))",
-            }
-        )
-        req = self._request('GET', endpoint)
-        content = self.getResponse(req)
-        if 'build' in (content or {}):
-            return BuildInfo.fromSingleBuildResponse(content)
+        def fetch():
+            endpoint = self.build_url(
+                "app/rest/builds",
+                {
+                    "locator": "id:{}".format(buildId),
+                    # Note: Wildcard does not match recursively, so if you need data
+                    # from a sub-field, be sure to include it in the list.
+                    "fields": "build(*,changes(*),properties(*),triggered(*))",
+                }
+            )
+            req = self._request('GET', endpoint)
+            content = self.getResponse(req)
+            if 'build' in (content or {}):
+                return BuildInfo.fromSingleBuildResponse(content)
+
+            return BuildInfo()
 
-        return BuildInfo()
+        return self._cached('getBuildInfo', (buildId,), fetch)
 
     def checkBuildIsAutomated(self, buildInfo):
         trigger = buildInfo['triggered']
@@ -330,8 +422,15 @@ class TeamCity():
                 "count": 1,
             }
         )
-        req = self._request('GET', endpoint)
-        content = self.getResponse(req)
+
+        def fetch():
+            req = self._request('GET', endpoint)
+            return self.getResponse(req)
+
+        content = self._cached(
+            'getLatestCompletedBuild',
+            (buildType, tuple(build_fields)),
+            fetch)
 
         builds = content.get('build', [])
 
@@ -385,8 +484,13 @@ class TeamCity():
                 "fields": "buildType(project(id,name),id,name,parameters($locator(name:env.ABC_BUILD_NAME),property))",
             }
         )
-        req = self._request('GET', endpoint)
-        content = self.getResponse(req)
+
+        def fetch():
+            req = self._request('GET', endpoint)
+            return self.getResponse(req)
+
+        content = self._cached(
+            'associate_configuration_names', (project_id,), fetch)
 
         # Example of output:
         # "buildType": [
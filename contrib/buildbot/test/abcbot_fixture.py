@@ -43,6 +43,9 @@ class ABCBotFixture(unittest.TestCase):
         self.test_output_dir = os.path.join(
             os.path.dirname(__file__), "test_output")
         self.db_file_no_ext = None
+        self.event_workers = 0
+        self.panel_update_delay = 0
+        self.db_flush_interval = 0
 
     def setUp(self):
         shutil.rmtree(self.test_output_dir, ignore_errors=True)
@@ -57,10 +60,15 @@ class ABCBotFixture(unittest.TestCase):
             self.slackbot,
             self.cirrus,
             db_file_no_ext=self.db_file_no_ext,
-            jsonEncoder=test.mocks.fixture.MockJSONEncoder).test_client()
+            jsonEncoder=test.mocks.fixture.MockJSONEncoder,
+            event_workers=self.event_workers,
+            panel_update_delay=self.panel_update_delay,
+            db_flush_interval=self.db_flush_interval).test_client()
+        self.event_queue = server.create_server.event_queue
 
     def tearDown(self):
-        pass
+        self.event_queue.stop()
+        server.create_server.db.close()
 
     def compute_hmac(self, data):
         return hmac.new(self.hmac_secret.encode(),
@@ -5,11 +5,16 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 
 import json
+import mock
 import requests
+import threading
 import unittest
 
+from build import BuildStatus
+from teamcity_wrapper import BuildInfo
 from test.abcbot_fixture import ABCBotFixture
 import test.mocks.teamcity
+from test.test_endpoint_status import statusRequestData
 from testutil import AnyWith
 
 
@@ -77,5 +82,67 @@ class EndpointBuildTestCase(ABCBotFixture):
         }))
 
 
+class EndpointBuildConcurrencyTestCase(ABCBotFixture):
+    def setUp(self):
+        self.event_workers = 1
+        super().setUp()
+
+        self.phab.get_file_content_from_master = mock.Mock()
+        self.phab.get_file_content_from_master.return_value = json.dumps({})
+        self.phab.set_text_panel_content = mock.Mock()
+
+        self.teamcity.get_coverage_summary = mock.Mock()
+        self.teamcity.get_coverage_summary.return_value = None
+        self.teamcity.getBuildInfo = mock.Mock()
+        self.teamcity.getBuildInfo.return_value = BuildInfo.fromSingleBuildResponse(
+            json.loads(test.mocks.teamcity.buildInfo().content)
+        )
+        self.teamcity.getBuildProblems = mock.Mock()
+        self.teamcity.getBuildProblems.return_value = []
+        self.teamcity.getLatestCompletedBuild = mock.Mock()
+        self.teamcity.getLatestCompletedBuild.return_value = None
+
+        self.cirrus.get_default_branch_status = mock.Mock()
+        self.cirrus.get_default_branch_status.return_value = BuildStatus.Success
+
+        self.teamcity.session.send.return_value = test.mocks.teamcity.buildInfo(
+            test.mocks.teamcity.buildInfo_changes(
+                ['test-change']), buildqueue=True)
+
+    def test_build_while_processing_event(self):
+        data = buildRequestQuery()
+        data.abcBuildName = 'build-name'
+        data.PHID = 'buildTargetPHID'
+        response = self.app.post('/build{}'.format(data), headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+        # Block the status event of the build while it reports the build
+        # target status to Phabricator
+        reporting = threading.Event()
+        release = threading.Event()
+
+        def send_message(**kwargs):
+            reporting.set()
+            release.wait(timeout=10)
+
+        self.phab.harbormaster.sendmessage.side_effect = send_message
+
+        response = self.app.post(
+            '/status', headers=self.headers, json=statusRequestData())
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(reporting.wait(timeout=10))
+
+        # Another build is triggered while the event is being processed
+        data.PHID = 'otherBuildTargetPHID'
+        response = self.app.post('/build{}'.format(data), headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.event_queue.get_metrics()['in_flight'], 1)
+
+        release.set()
+        self.assertTrue(self.event_queue.join(timeout=10))
+        self.assertEqual(self.event_queue.get_metrics()[
+                         'counters']['processed'], 1)
+
+
 if __name__ == '__main__':
     unittest.main()
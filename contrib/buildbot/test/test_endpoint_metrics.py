@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import json
+import mock
+import unittest
+
+from build import BuildStatus
+from teamcity_wrapper import BuildInfo
+from test.abcbot_fixture import ABCBotFixture
+import test.mocks.teamcity
+from test.test_endpoint_status import statusRequestData
+
+
+class EndpointMetricsTestCase(ABCBotFixture):
+    def setUp(self):
+        self.event_workers = 2
+        super().setUp()
+
+        self.phab.get_file_content_from_master = mock.Mock()
+        self.phab.get_file_content_from_master.return_value = json.dumps({})
+        self.phab.set_text_panel_content = mock.Mock()
+
+        self.teamcity.get_coverage_summary = mock.Mock()
+        self.teamcity.get_coverage_summary.return_value = None
+        self.teamcity.getBuildInfo = mock.Mock()
+        self.teamcity.getBuildInfo.return_value = BuildInfo.fromSingleBuildResponse(
+            json.loads(test.mocks.teamcity.buildInfo().content)
+        )
+        self.teamcity.getBuildProblems = mock.Mock()
+        self.teamcity.getBuildProblems.return_value = []
+        self.teamcity.getLatestCompletedBuild = mock.Mock()
+        self.teamcity.getLatestCompletedBuild.return_value = None
+
+        self.cirrus.get_default_branch_status = mock.Mock()
+        self.cirrus.get_default_branch_status.return_value = BuildStatus.Success
+
+    def get_metrics(self):
+        response = self.app.get('/metrics', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['event_queue']
+
+    def test_status_queued(self):
+        metrics = self.get_metrics()
+        self.assertEqual(metrics['workers'], 2)
+        self.assertEqual(metrics['depth'], 0)
+        self.assertEqual(metrics['counters']['queued'], 0)
+
+        data = statusRequestData()
+
+        # Hold the queue lock so the workers don't pick the first event before
+        # it is repeated
+        with self.event_queue.lock:
+            for _ in range(3):
+                response = self.app.post(
+                    '/status', headers=self.headers, json=data)
+                self.assertEqual(response.status_code, 202)
+        self.assertTrue(self.event_queue.join(timeout=10))
+
+        # The repeated events were dropped
+        self.teamcity.getBuildInfo.assert_called_once()
+        metrics = self.get_metrics()
+        self.assertEqual(metrics['depth'], 0)
+        self.assertEqual(metrics['in_flight'], 0)
+        self.assertEqual(metrics['counters']['queued'], 1)
+        self.assertEqual(metrics['counters']['deduplicated'], 2)
+        self.assertEqual(metrics['counters']['processed'], 1)
+        self.assertEqual(metrics['processing_latency']['count'], 1)
+
+        # The same build with a different result is not a duplicate
+        data.buildResult = 'failure'
+        response = self.app.post('/status', headers=self.headers, json=data)
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(self.event_queue.join(timeout=10))
+        self.assertEqual(self.teamcity.getBuildInfo.call_count, 2)
+        self.assertEqual(self.get_metrics()['counters']['processed'], 2)
+
+    def test_status_rejected(self):
+        # Malformed events are rejected before being queued
+        data = statusRequestData()
+        del data.buildId
+        response = self.app.post('/status', headers=self.headers, json=data)
+        self.assertEqual(response.status_code, 400)
+
+        data = statusRequestData()
+        data.branch = 'UNRESOLVED'
+        response = self.app.post('/status', headers=self.headers, json=data)
+        self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(self.get_metrics()['counters']['queued'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
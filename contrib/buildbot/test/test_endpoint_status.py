@@ -823,8 +823,8 @@ class EndpointStatusTestCase(ABCBotFixture):
         data.buildResult = 'failure'
         data.branch = 'phabricator/diff/456'
 
-        self.teamcity.getBuildLog = mock.Mock()
-        self.teamcity.getBuildLog.return_value = "dummy log"
+        self.teamcity.getBuildLogTail = mock.Mock()
+        self.teamcity.getBuildLogTail.return_value = "dummy log"
 
         self.configure_build_info(
             properties=test.mocks.teamcity.buildInfo_properties(propsList=[{
@@ -1210,11 +1210,12 @@ class EndpointStatusTestCase(ABCBotFixture):
             else {'id': DEFAULT_BUILD_ID}
         )
 
-        build_info = BuildInfo.fromSingleBuildResponse(
-            json.loads(test.mocks.teamcity.buildInfo().content)
-        )
-
         def _get_build_info(build_id):
+            # The build info is requested concurrently, so return a new object
+            # for each call
+            build_info = BuildInfo.fromSingleBuildResponse(
+                json.loads(test.mocks.teamcity.buildInfo().content)
+            )
             status = BuildStatus.Failure if build_id == 42 else BuildStatus.Success
             build_info['id'] = build_id
             build_info['status'] = status.value.upper()
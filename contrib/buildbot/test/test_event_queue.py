@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import os
+import shutil
+import threading
+import unittest
+
+from event_queue import EventQueue
+
+
+class EventQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_output_dir = os.path.join(
+            os.path.dirname(__file__), "test_output")
+        shutil.rmtree(self.test_output_dir, ignore_errors=True)
+        os.makedirs(self.test_output_dir, exist_ok=True)
+        self.journal_file_no_ext = os.path.join(
+            self.test_output_dir, "test_events")
+
+        self.processed = []
+        self.lock = threading.Lock()
+        # Set to block the processing of the events
+        self.release = threading.Event()
+        self.release.set()
+
+    def process(self, event):
+        self.release.wait()
+        if event.get('fail', False):
+            raise AssertionError("Failed event")
+        with self.lock:
+            self.processed.append(event['id'])
+
+    def test_ordering(self):
+        queue = EventQueue(self.process, 4)
+        queue.start()
+
+        for i in range(50):
+            queue.put({'id': i}, ordering_key=i % 3)
+        self.assertTrue(queue.join(timeout=10))
+        queue.stop()
+
+        self.assertEqual(sorted(self.processed), list(range(50)))
+        # The events are processed in order for each key
+        for key in range(3):
+            self.assertEqual(
+                [i for i in self.processed if i % 3 == key],
+                list(range(key, 50, 3)))
+
+        metrics = queue.get_metrics()
+        self.assertEqual(metrics['depth'], 0)
+        self.assertEqual(metrics['in_flight'], 0)
+        self.assertEqual(metrics['counters']['queued'], 50)
+        self.assertEqual(metrics['counters']['processed'], 50)
+        self.assertEqual(metrics['wait_latency']['count'], 50)
+        self.assertEqual(metrics['processing_latency']['count'], 50)
+
+    def test_deduplication(self):
+        queue = EventQueue(self.process, 1)
+        queue.start()
+
+        self.release.clear()
+        self.assertTrue(queue.put({'id': 0}, 'key', dedup_key=(0, 'running')))
+        self.assertFalse(
+            queue.put({'id': 1}, 'key', dedup_key=(0, 'running')))
+        self.assertTrue(queue.put({'id': 2}, 'key', dedup_key=(0, 'success')))
+        self.assertTrue(queue.put({'id': 3}, 'key'))
+        self.assertTrue(queue.put({'id': 4}, 'key'))
+
+        metrics = queue.get_metrics()
+        self.assertEqual(metrics['counters']['deduplicated'], 1)
+        self.assertEqual(metrics['depth'] + metrics['in_flight'], 4)
+
+        self.release.set()
+        self.assertTrue(queue.join(timeout=10))
+        self.assertEqual(self.processed, [0, 2, 3, 4])
+
+        # Once processed, the same event can be queued again
+        self.assertTrue(queue.put({'id': 5}, 'key', dedup_key=(0, 'running')))
+        self.assertTrue(queue.join(timeout=10))
+        self.assertEqual(self.processed, [0, 2, 3, 4, 5])
+        queue.stop()
+
+    def test_failure(self):
+        queue = EventQueue(self.process, 2)
+        queue.start()
+
+        queue.put({'id': 0, 'fail': True}, 'key')
+        queue.put({'id': 1}, 'key')
+        self.assertTrue(queue.join(timeout=10))
+        queue.stop()
+
+        self.assertEqual(self.processed, [1])
+        counters = queue.get_metrics()['counters']
+        self.assertEqual(counters['failed'], 1)
+        self.assertEqual(counters['processed'], 1)
+
+    def test_journal(self):
+        queue = EventQueue(self.process, 1, self.journal_file_no_ext)
+        queue.start()
+
+        self.release.clear()
+        for i in range(3):
+            queue.put({'id': i}, 'key', dedup_key=i)
+        # Stop while the first event is being processed
+        with queue.lock:
+            self.assertTrue(queue.lock.wait_for(
+                lambda: queue.active, timeout=10))
+            queue.stopping = True
+        self.release.set()
+        queue.stop()
+        self.assertEqual(self.processed, [0])
+
+        # The unprocessed events are restored on restart
+        queue = EventQueue(self.process, 1, self.journal_file_no_ext)
+        queue.start()
+        self.assertFalse(queue.put({'id': 1}, 'key', dedup_key=1))
+        queue.put({'id': 3}, 'key', dedup_key=3)
+        self.assertTrue(queue.join(timeout=10))
+        queue.stop()
+        self.assertEqual(self.processed, [0, 1, 2, 3])
+
+        # Nothing is left in the journal
+        queue = EventQueue(self.process, 1, self.journal_file_no_ext)
+        queue.start()
+        self.assertEqual(queue.get_metrics()['depth'], 0)
+        queue.stop()
+
+    def test_journal_without_workers(self):
+        # Queue the events after the worker exited, so they are only in the
+        # journal
+        queue = EventQueue(self.process, 1, self.journal_file_no_ext)
+        queue.start()
+        with queue.lock:
+            queue.stopping = True
+            queue.lock.notify_all()
+        queue.workers[0].join()
+        for i in range(3):
+            queue.put({'id': i}, 'key')
+        queue.stop()
+        self.assertEqual(self.processed, [])
+
+        # Without workers, the restored events are processed on start
+        queue = EventQueue(self.process, 0, self.journal_file_no_ext)
+        queue.start()
+        self.assertEqual(queue.get_metrics()['depth'], 0)
+        queue.stop()
+        self.assertEqual(self.processed, [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import json
+import mock
+import threading
+import unittest
+
+from build import BuildStatus
+import server
+from teamcity_wrapper import BuildInfo
+from test.abcbot_fixture import ABCBotFixture
+import test.mocks.teamcity
+from test.test_endpoint_status import statusRequestData
+
+NUM_BUILDS = 20
+
+
+class PanelUpdateTestCase(ABCBotFixture):
+    def setUp(self):
+        self.panel_update_delay = 0.2
+        super().setUp()
+
+        self.phab.get_file_content_from_master = mock.Mock()
+        self.phab.get_file_content_from_master.return_value = json.dumps({
+            "builds": {
+                "build-{}".format(i): {} for i in range(NUM_BUILDS)
+            },
+        })
+        self.phab.set_text_panel_content = mock.Mock()
+
+        self.teamcity.associate_configuration_names = mock.Mock()
+        self.teamcity.associate_configuration_names.return_value = {
+            "build-{}".format(i): {
+                "teamcity_build_type_id": "build-{}_Type".format(i),
+                "teamcity_build_name": "My Build {}".format(i),
+                "teamcity_project_id": "ProjectId",
+                "teamcity_project_name": "Project Name",
+            } for i in range(NUM_BUILDS)
+        }
+
+        self.panel_updated = threading.Event()
+        self.phab.set_text_panel_content.side_effect = \
+            lambda *args: self.panel_updated.set()
+
+        # The status requests of the panel update, which don't run on the
+        # main thread, wait for each other so they only complete if they run
+        # concurrently
+        self.lock = threading.Lock()
+        self.running = 0
+        self.concurrent = threading.Event()
+
+        def get_latest_completed_build(build_type_id):
+            if threading.current_thread() is not threading.main_thread():
+                with self.lock:
+                    self.running += 1
+                    if self.running > 1:
+                        self.concurrent.set()
+                self.concurrent.wait(timeout=10)
+                with self.lock:
+                    self.running -= 1
+            return {'id': test.mocks.teamcity.DEFAULT_BUILD_ID}
+
+        self.teamcity.getLatestCompletedBuild = mock.Mock()
+        self.teamcity.getLatestCompletedBuild.side_effect = get_latest_completed_build
+
+        def get_build_info(build_id):
+            build_info = BuildInfo.fromSingleBuildResponse(
+                json.loads(test.mocks.teamcity.buildInfo().content))
+            build_info['status'] = 'SUCCESS'
+            return build_info
+
+        self.teamcity.getBuildInfo = mock.Mock()
+        self.teamcity.getBuildInfo.side_effect = get_build_info
+        self.teamcity.get_coverage_summary = mock.Mock()
+        self.teamcity.get_coverage_summary.return_value = None
+
+        self.cirrus.get_default_branch_status = mock.Mock()
+        self.cirrus.get_default_branch_status.return_value = BuildStatus.Success
+
+    def test_debounced_concurrent_update(self):
+        # The delayed panel update waits for the state lock to read the panel
+        # data, so it can't complete before all the status events are
+        # processed
+        with server.create_server.db.lock:
+            for i in range(3):
+                data = statusRequestData()
+                data.buildTypeId = "build-{}_Type".format(i)
+                response = self.app.post(
+                    '/status', headers=self.headers, json=data)
+                self.assertEqual(response.status_code, 200)
+            # The panel is updated later
+            self.phab.set_text_panel_content.assert_not_called()
+
+        self.assertTrue(self.panel_updated.wait(timeout=10))
+
+        # The 3 status events caused a single panel update, and all the build
+        # statuses were fetched concurrently (the status events also fetch the
+        # latest build of their own build type).
+        self.phab.set_text_panel_content.assert_called_once()
+        self.assertEqual(
+            self.teamcity.getLatestCompletedBuild.call_count, NUM_BUILDS + 3)
+        self.assertTrue(self.concurrent.is_set())
+        panel_content = self.phab.set_text_panel_content.call_args[0][1]
+        for i in range(NUM_BUILDS):
+            self.assertIn("My Build {}".format(i), panel_content)
+
+
+if __name__ == '__main__':
+    unittest.main()
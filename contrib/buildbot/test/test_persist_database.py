@@ -8,10 +8,10 @@ import json
 import mock
 import os
 import server
-import shelve
 import unittest
 
 from build import BuildStatus
+from persistence import PersistentState
 from teamcity_wrapper import BuildInfo
 from test.abcbot_fixture import ABCBotFixture
 import test.mocks.teamcity
@@ -63,31 +63,23 @@ class PersistDataTestCase(ABCBotFixture):
         self.assertEqual(response.status_code, 200)
 
         # Check the diff target state was persisted
-        with shelve.open(self.db_file_no_ext, flag='r') as db:
-            self.assertIn('diff_targets', db)
-            self.assertIn(BUILD_TARGET_PHID, db['diff_targets'])
-            self.assertIn(
-                DEFAULT_BUILD_ID,
-                db['diff_targets'][BUILD_TARGET_PHID].builds)
-            self.assertEqual(
-                db['diff_targets'][BUILD_TARGET_PHID].builds[DEFAULT_BUILD_ID].build_id,
-                DEFAULT_BUILD_ID)
-            self.assertEqual(
-                db['diff_targets'][BUILD_TARGET_PHID].builds[DEFAULT_BUILD_ID].status,
-                BuildStatus.Queued)
-            self.assertEqual(
-                db['diff_targets'][BUILD_TARGET_PHID].builds[DEFAULT_BUILD_ID].name,
-                BUILD_NAME)
+        diff_targets = self.read_diff_targets()
+        self.assertIn(BUILD_TARGET_PHID, diff_targets)
+        self.assertIn(
+            DEFAULT_BUILD_ID,
+            diff_targets[BUILD_TARGET_PHID].builds)
+        self.assertEqual(
+            diff_targets[BUILD_TARGET_PHID].builds[DEFAULT_BUILD_ID].build_id,
+            DEFAULT_BUILD_ID)
+        self.assertEqual(
+            diff_targets[BUILD_TARGET_PHID].builds[DEFAULT_BUILD_ID].status,
+            BuildStatus.Queued)
+        self.assertEqual(
+            diff_targets[BUILD_TARGET_PHID].builds[DEFAULT_BUILD_ID].name,
+            BUILD_NAME)
 
         # Restart the server, which we expect to restore the persisted state
-        del self.app
-        self.app = server.create_server(
-            self.teamcity,
-            self.phab,
-            self.slackbot,
-            self.cirrus,
-            db_file_no_ext=self.db_file_no_ext,
-            jsonEncoder=test.mocks.fixture.MockJSONEncoder).test_client()
+        self.restart_server(flush=True)
 
         data = statusRequestData()
         data.buildName = BUILD_NAME
@@ -116,8 +108,66 @@ class PersistDataTestCase(ABCBotFixture):
         )
 
         # Check the diff target was cleared from persisted state
-        with shelve.open(self.db_file_no_ext, flag='r') as db:
-            self.assertNotIn(BUILD_TARGET_PHID, db['diff_targets'])
+        self.assertNotIn(BUILD_TARGET_PHID, self.read_diff_targets())
+
+    def test_restore_from_journal(self):
+        # Only write the changes to the database when the server stops, so
+        # they are only in the journal if it is killed
+        server.create_server.db.close()
+        self.db_flush_interval = 3600
+        self.restart_server(flush=True)
+
+        queryData = buildRequestQuery()
+        queryData.abcBuildName = BUILD_NAME
+        queryData.buildTypeId = BUILD_TYPE_ID
+        queryData.PHID = BUILD_TARGET_PHID
+
+        self.teamcity.session.send.return_value = test.mocks.teamcity.buildInfo(
+            test.mocks.teamcity.buildInfo_changes(
+                ['test-change']), buildqueue=True)
+        response = self.app.post(
+            '/build{}'.format(queryData),
+            headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+        # The change is not in the database yet
+        self.assertEqual(
+            self.read_diff_targets(replay_journal=False), {})
+
+        # Kill the server, the restarted server replays the journal
+        self.restart_server(flush=False)
+        diff_targets = server.create_server.db['diff_targets']
+        self.assertIn(BUILD_TARGET_PHID, diff_targets)
+        self.assertEqual(
+            diff_targets[BUILD_TARGET_PHID].builds[DEFAULT_BUILD_ID].name,
+            BUILD_NAME)
+
+        # The replayed changes are written on the next flush
+        server.create_server.db.flush()
+        self.assertIn(
+            BUILD_TARGET_PHID,
+            self.read_diff_targets(replay_journal=False))
+
+    def read_diff_targets(self, replay_journal=True):
+        db = PersistentState(
+            {'diff_targets': {}}, db_file_no_ext=self.db_file_no_ext)
+        if not replay_journal:
+            db.journal = {}
+        return dict(db['diff_targets'])
+
+    def restart_server(self, flush):
+        self.event_queue.stop()
+        server.create_server.db.close(flush=flush)
+        del self.app
+        self.app = server.create_server(
+            self.teamcity,
+            self.phab,
+            self.slackbot,
+            self.cirrus,
+            db_file_no_ext=self.db_file_no_ext,
+            jsonEncoder=test.mocks.fixture.MockJSONEncoder,
+            db_flush_interval=self.db_flush_interval).test_client()
+        self.event_queue = server.create_server.event_queue
 
 
 if __name__ == '__main__':
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import mock
+import os
+import shelve
+import shutil
+import unittest
+
+from persistence import PersistentState
+
+
+def defaults():
+    return {
+        'section': {},
+        'flag': True,
+    }
+
+
+class PersistentStateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_output_dir = os.path.join(
+            os.path.dirname(__file__), "test_output")
+        shutil.rmtree(self.test_output_dir, ignore_errors=True)
+        os.makedirs(self.test_output_dir, exist_ok=True)
+        self.db_file_no_ext = os.path.join(self.test_output_dir, "test_state")
+
+    def new_state(self, flush_interval=0):
+        return PersistentState(
+            defaults(), db_file_no_ext=self.db_file_no_ext,
+            flush_interval=flush_interval)
+
+    def read_db(self):
+        with shelve.open(self.db_file_no_ext, flag='r') as db:
+            return dict(db)
+
+    def journal_size(self):
+        return os.path.getsize("{}.journal".format(self.db_file_no_ext))
+
+    def test_defaults(self):
+        state = self.new_state()
+        self.assertEqual(state['section'], {})
+        self.assertEqual(state['flag'], True)
+        self.assertIn('section', state)
+        self.assertNotIn('other', state)
+
+        # Nothing is written if nothing changed
+        state.commit()
+        state.close()
+        self.assertFalse(os.path.exists(
+            "{}.journal".format(self.db_file_no_ext)))
+
+    def test_dirty_keys(self):
+        state = self.new_state()
+        state['section']['a'] = 1
+        state['section']['b'] = 2
+        state['flag'] = False
+        state.commit()
+        self.assertEqual(self.read_db(), {
+            'section:"a"': 1,
+            'section:"b"': 2,
+            'flag': False,
+        })
+        self.assertEqual(self.journal_size(), 0)
+
+        # Only the changed keys are written
+        with shelve.open(self.db_file_no_ext) as db:
+            db['section:"b"'] = 'not rewritten'
+        state['section']['a'] = 3
+        state.commit()
+        self.assertEqual(self.read_db()['section:"a"'], 3)
+        self.assertEqual(self.read_db()['section:"b"'], 'not rewritten')
+
+        del state['section']['a']
+        state.commit()
+        self.assertNotIn('section:"a"', self.read_db())
+
+        # Changes made in place are persisted once marked dirty
+        state['section']['c'] = []
+        state.commit()
+        state['section']['c'].append(1)
+        state.commit()
+        self.assertEqual(self.read_db()['section:"c"'], [])
+        state.mark_dirty('section', 'c')
+        state.commit()
+        self.assertEqual(self.read_db()['section:"c"'], [1])
+        state.close()
+
+        # Restored on restart
+        state = self.new_state()
+        self.assertEqual(
+            dict(state['section']), {'b': 'not rewritten', 'c': [1]})
+        self.assertEqual(state['flag'], False)
+
+        # A section is replaced as a whole
+        state['section'] = {'d': 4}
+        state.close()
+        self.assertEqual(self.read_db(), {
+            'section:"d"': 4,
+            'flag': False,
+        })
+
+    def test_write_behind(self):
+        state = self.new_state(flush_interval=3600)
+        state['section']['a'] = 1
+        state.commit()
+        state['section']['b'] = 2
+        state.commit()
+
+        # The changes are in the journal, not in the database yet
+        self.assertGreater(self.journal_size(), 0)
+        self.assertFalse(os.path.exists(self.db_file_no_ext) and self.read_db())
+
+        # The changes are replayed if the process is killed
+        state.close(flush=False)
+        state = self.new_state(flush_interval=3600)
+        self.assertEqual(dict(state['section']), {'a': 1, 'b': 2})
+
+        # And written on the next flush
+        state.flush()
+        self.assertEqual(self.read_db(), {
+            'section:"a"': 1,
+            'section:"b"': 2,
+        })
+        self.assertEqual(self.journal_size(), 0)
+        state.close()
+
+    def test_sync_before_truncate(self):
+        state = self.new_state(flush_interval=3600)
+        state['section']['a'] = 1
+        state.commit()
+
+        journal_sizes = []
+        fsync = os.fsync
+
+        def record_fsync(fd):
+            journal_sizes.append(self.journal_size())
+            fsync(fd)
+
+        with mock.patch('persistence.os.fsync', side_effect=record_fsync):
+            state.flush()
+        # The database was synced to disk before the journal was truncated
+        self.assertGreater(len(journal_sizes), 0)
+        self.assertTrue(all(size > 0 for size in journal_sizes))
+        self.assertEqual(self.journal_size(), 0)
+        state.close()
+
+    def test_truncated_journal(self):
+        state = self.new_state(flush_interval=3600)
+        state['section']['a'] = 1
+        state.commit()
+        size = self.journal_size()
+        state['section']['b'] = 2
+        state.commit()
+        state.close(flush=False)
+
+        # The last record was not written completely
+        journal_file = "{}.journal".format(self.db_file_no_ext)
+        with open(journal_file, 'r+b') as f:
+            f.truncate(size + 5)
+
+        state = self.new_state()
+        self.assertEqual(dict(state['section']), {'a': 1})
+
+    def test_lazy_load(self):
+        state = self.new_state()
+        state['section']['a'] = 1
+        state.close()
+
+        state = self.new_state()
+        self.assertEqual(state.entries, {})
+        state['flag'] = False
+        state.close()
+        # The section was neither loaded nor rewritten
+        self.assertNotIn('section', state.entries)
+        self.assertEqual(self.read_db(), {
+            'section:"a"': 1,
+            'flag': False,
+        })
+
+    def test_migrate_old_format(self):
+        with shelve.open(self.db_file_no_ext) as db:
+            db['section'] = {'a': 1, 'b': 2}
+            db['flag'] = False
+
+        state = self.new_state()
+        self.assertEqual(dict(state['section']), {'a': 1, 'b': 2})
+        self.assertEqual(state['flag'], False)
+        state.close()
+        self.assertEqual(self.read_db(), {
+            'section:"a"': 1,
+            'section:"b"': 2,
+            'flag': False,
+        })
+
+    def test_no_database(self):
+        state = PersistentState(defaults())
+        state['section']['a'] = 1
+        state.commit()
+        state.close()
+        self.assertEqual(state['section'], {'a': 1})
+        self.assertFalse(os.path.exists(self.db_file_no_ext))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import threading
+import unittest
+
+from response_cache import ResponseCache
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.time = 1000
+        self.cache = ResponseCache(
+            ttls={'endpoint': 10, 'uncached': 0},
+            time_fn=lambda: self.time)
+        self.fetched = 0
+
+    def fetch(self, response='response'):
+        def fn():
+            self.fetched += 1
+            return response
+        return fn
+
+    def test_ttl(self):
+        for _ in range(3):
+            self.assertEqual(
+                self.cache.get('endpoint', ('key',), self.fetch()), 'response')
+        self.assertEqual(self.fetched, 1)
+
+        # A different key is a different response
+        self.cache.get('endpoint', ('other',), self.fetch())
+        self.assertEqual(self.fetched, 2)
+
+        # Expired
+        self.time += 10
+        self.cache.get('endpoint', ('key',), self.fetch())
+        self.assertEqual(self.fetched, 3)
+
+        # Not cached
+        self.cache.get('uncached', ('key',), self.fetch())
+        self.cache.get('uncached', ('key',), self.fetch())
+        self.assertEqual(self.fetched, 5)
+
+        metrics = self.cache.get_metrics()
+        self.assertEqual(metrics['endpoint']['hits'], 2)
+        self.assertEqual(metrics['endpoint']['misses'], 3)
+        self.assertEqual(metrics['endpoint']['hit_rate'], 2 / 5)
+        self.assertEqual(metrics['uncached']['misses'], 2)
+        self.assertEqual(metrics['uncached']['hit_rate'], 0)
+
+    def test_failure(self):
+        def fail():
+            raise AssertionError("Failed request")
+
+        self.assertRaises(
+            AssertionError, self.cache.get, 'endpoint', ('key',), fail)
+        # Failures are not cached
+        self.cache.get('endpoint', ('key',), self.fetch())
+        self.assertEqual(self.fetched, 1)
+
+    def test_invalidate(self):
+        self.cache.get('endpoint', ('a', 1), self.fetch())
+        self.cache.get('endpoint', ('a', 2), self.fetch())
+        self.cache.get('endpoint', ('b', 1), self.fetch())
+        self.assertEqual(self.fetched, 3)
+
+        self.cache.invalidate('endpoint', ('a',))
+        self.cache.get('endpoint', ('a', 1), self.fetch())
+        self.cache.get('endpoint', ('a', 2), self.fetch())
+        self.cache.get('endpoint', ('b', 1), self.fetch())
+        self.assertEqual(self.fetched, 5)
+        self.assertEqual(
+            self.cache.get_metrics()['endpoint']['invalidated'], 2)
+
+        self.cache.invalidate('endpoint')
+        self.cache.get('endpoint', ('b', 1), self.fetch())
+        self.assertEqual(self.fetched, 6)
+
+    def test_coalescing(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_fetch():
+            started.set()
+            release.wait()
+            return self.fetch()()
+
+        results = []
+
+        def get():
+            results.append(self.cache.get('endpoint', ('key',), slow_fetch))
+
+        threads = [threading.Thread(target=get) for _ in range(5)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        # Wait for all the requests to be coalesced
+        while self.cache.get_metrics()['endpoint']['coalesced'] < 4:
+            pass
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['response'] * 5)
+        self.assertEqual(self.fetched, 1)
+        metrics = self.cache.get_metrics()['endpoint']
+        self.assertEqual(metrics['misses'], 1)
+        self.assertEqual(metrics['coalesced'], 4)
+        self.assertEqual(metrics['hit_rate'], 4 / 5)
+
+    def test_invalidate_in_flight(self):
+        def fetch_and_invalidate():
+            # Invalidated while the request is in flight
+            self.cache.invalidate('endpoint', ('key',))
+            return self.fetch('stale')()
+
+        self.assertEqual(
+            self.cache.get('endpoint', ('key',), fetch_and_invalidate), 'stale')
+        # The possibly stale response was not cached
+        self.assertEqual(
+            self.cache.get('endpoint', ('key',), self.fetch('fresh')), 'fresh')
+        self.assertEqual(self.fetched, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
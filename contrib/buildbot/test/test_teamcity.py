@@ -4,13 +4,18 @@
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 
+import io
 import json
 import mock
+from pathlib import Path
 import requests
 import time
 import unittest
 from urllib.parse import urljoin
+from zipfile import ZipFile
 
+from response_cache import ResponseCache
+import teamcity_wrapper
 from teamcity_wrapper import TeamcityRequestException
 from testutil import AnyWith
 
@@ -385,6 +390,116 @@ class TeamcityTests(unittest.TestCase):
             )
         }))
 
+    def test_getBuildInfo_cached(self):
+        self.teamcity.set_cache(ResponseCache())
+        self.teamcity.session.send.return_value = test.mocks.teamcity.buildInfo()
+
+        for _ in range(3):
+            buildInfo = self.teamcity.getBuildInfo('1234')
+            self.assertEqual(buildInfo['triggered']['type'], 'vcs')
+        self.teamcity.getLatestCompletedBuild('build-type-id')
+        self.teamcity.getLatestCompletedBuild('build-type-id')
+        self.assertEqual(self.teamcity.session.send.call_count, 2)
+
+        # A status change for the build invalidates the cached responses
+        self.teamcity.invalidate_build_cache('build-type-id', '1234')
+        self.teamcity.getBuildInfo('1234')
+        self.teamcity.getLatestCompletedBuild('build-type-id')
+        self.assertEqual(self.teamcity.session.send.call_count, 4)
+
+        # Another build is not affected
+        self.teamcity.getBuildInfo('5678')
+        self.teamcity.invalidate_build_cache('other-build-type-id', '1234')
+        self.teamcity.getBuildInfo('5678')
+        self.teamcity.getLatestCompletedBuild('build-type-id')
+        self.assertEqual(self.teamcity.session.send.call_count, 5)
+
+    def setupBuildLog(self, buildLogFile='testlog.zip'):
+        with open(Path(__file__).parent / 'data' / buildLogFile, 'rb') as f:
+            buildLog = f.read()
+        # The clean log doesn't exist, then the archived log is returned
+        self.teamcity.session.send.side_effect = lambda request: \
+            test.mocks.teamcity.Response(buildLog) if 'downloadBuildLog' in request.url \
+            else test.mocks.teamcity.Response(status_code=requests.codes.not_found)
+
+        with ZipFile(io.BytesIO(buildLog)) as z:
+            return ''.join(z.read(name).decode('utf-8')
+                           for name in z.namelist()).replace('\r\n', '\n')
+
+    def test_getBuildLog(self):
+        expectedLog = self.setupBuildLog()
+        self.assertEqual(self.teamcity.getBuildLog('1234'), expectedLog)
+
+        # The result doesn't depend on the chunk boundaries
+        for chunk_size in [1, 7, 100]:
+            with mock.patch.object(teamcity_wrapper, 'BUILD_LOG_CHUNK_SIZE', chunk_size):
+                self.assertEqual(
+                    self.teamcity.getBuildLog('1234'), expectedLog)
+
+        # The clean log is returned if it exists
+        self.teamcity.session.send.side_effect = None
+        self.teamcity.session.send.return_value = test.mocks.teamcity.Response(
+            b'clean\r\nlog')
+        self.assertEqual(self.teamcity.getBuildLog('1234'), 'clean\nlog')
+
+        self.teamcity.session.send.return_value = test.mocks.teamcity.Response(
+            b'')
+        self.assertEqual(
+            self.teamcity.getBuildLog('1234'),
+            '[Error Fetching Build Log]')
+
+    def test_searchBuildLog(self):
+        expectedLines = self.setupBuildLog().splitlines(keepends=True)
+        index = next(i for i, line in enumerate(expectedLines)
+                     if 'status FAILURE' in line)
+
+        self.assertEqual(
+            self.teamcity.searchBuildLog('1234', ['status FAILURE']),
+            ''.join(expectedLines[max(0, index - 2):index + 3]))
+        self.assertEqual(
+            self.teamcity.searchBuildLog(
+                '1234', ['no match', r'status \w+'], context_lines=0),
+            expectedLines[index])
+        self.assertIsNone(
+            self.teamcity.searchBuildLog('1234', ['no match']))
+        self.assertIsNone(self.teamcity.searchBuildLog('1234', []))
+
+        self.assertEqual(
+            self.teamcity.getBuildLogTail('1234', 3),
+            ''.join(expectedLines[-3:]))
+
+    def test_searchBuildLog_earlyExit(self):
+        self.setupBuildLog()
+        lines = []
+
+        def iterBuildLogLines(buildId):
+            for line in ['a\n', 'b\n', 'match\n', 'c\n', 'd\n', 'e\n']:
+                lines.append(line)
+                yield line
+        self.teamcity.iterBuildLogLines = iterBuildLogLines
+
+        self.assertEqual(
+            self.teamcity.searchBuildLog('1234', ['match'], context_lines=1),
+            'b\nmatch\nc\n')
+        # The rest of the log was not read
+        self.assertEqual(lines, ['a\n', 'b\n', 'match\n', 'c\n'])
+
+    def test_searchBuildLog_cached(self):
+        self.setupBuildLog()
+        self.teamcity.set_cache(ResponseCache())
+
+        for _ in range(3):
+            self.assertIsNotNone(
+                self.teamcity.searchBuildLog('1234', ['status FAILURE']))
+        self.teamcity.getBuildLogTail('1234', 60)
+        self.teamcity.getBuildLogTail('1234', 60)
+        # 2 requests (clean log then archived log) per log read
+        self.assertEqual(self.teamcity.session.send.call_count, 4)
+
+        self.teamcity.invalidate_build_cache('build-type-id', '1234')
+        self.teamcity.searchBuildLog('1234', ['status FAILURE'])
+        self.assertEqual(self.teamcity.session.send.call_count, 6)
+
     def test_buildTriggeredByAutomatedUser(self):
         self.teamcity.session.send.return_value = test.mocks.teamcity.buildInfo_automatedBuild()
         buildInfo = self.teamcity.getBuildInfo('1234')
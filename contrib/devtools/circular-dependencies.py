@@ -3,6 +3,12 @@
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import heapq
+import json
+import os
 import re
 import sys
 
@@ -18,6 +24,12 @@ HEADER_MODULE_PATHS = [
     'interfaces/'
 ]
 
+DEFAULT_CACHE_FILE = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'lotusd', 'circular-dependencies.json')
+
+RE = re.compile("^#include <(.*)>", re.MULTILINE)
+
 
 def module_name(path):
     if path in MAPPING:
@@ -33,64 +45,212 @@ def module_name(path):
     return None
 
 
-files = dict()
-deps = dict()
-
-RE = re.compile("^#include <(.*)>")
-
-# Iterate over files, and create list of modules
-for arg in sys.argv[1:]:
-    module = module_name(arg)
-    if module is None:
-        print("Ignoring file {} (does not constitute module)\n".format(arg))
-    else:
-        files[arg] = module
-        deps[module] = set()
-
-# Iterate again, and build list of direct dependencies for each module
-# TODO: implement support for multiple include directories
-for arg in sorted(files.keys()):
-    module = files[arg]
-    with open(arg, 'r', encoding="utf8") as f:
-        for line in f:
-            match = RE.match(line)
-            if match:
-                include = match.group(1)
-                included_module = module_name(include)
-                if included_module is not None and included_module in deps and included_module != module:
-                    deps[module].add(included_module)
-
-# Loop to find the shortest (remaining) circular dependency
-have_cycle = False
-while True:
-    shortest_cycle = None
-    for module in sorted(deps.keys()):
-        # Build the transitive closure of dependencies of module
-        closure = dict()
-        for dep in deps[module]:
-            closure[dep] = []
-        while True:
-            old_size = len(closure)
-            old_closure_keys = sorted(closure.keys())
-            for src in old_closure_keys:
-                for dep in deps[src]:
-                    if dep not in closure:
-                        closure[dep] = closure[src] + [src]
-            if len(closure) == old_size:
+def read_includes(content):
+    return RE.findall(content.decode('utf8'))
+
+
+def load_cache(cache_file):
+    if cache_file is None:
+        return dict()
+    try:
+        with open(cache_file, 'r', encoding="utf8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def save_cache(cache_file, cache):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+    with open(tmp_file, 'w', encoding="utf8") as f:
+        json.dump(cache, f)
+    os.replace(tmp_file, cache_file)
+
+
+def get_includes(paths, cache_file, jobs):
+    # The includes of a file are cached by the hash of its content, so only
+    # the modified files are parsed again
+    cache = load_cache(cache_file)
+    includes = dict()
+    missing = dict()
+    for path in paths:
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        if digest in cache:
+            includes[path] = cache[digest]
+        else:
+            missing[path] = (digest, content)
+
+    if missing:
+        with ProcessPoolExecutor(jobs) as executor:
+            results = executor.map(
+                read_includes, [content for _, content in missing.values()],
+                chunksize=64)
+            for (path, (digest, _)), file_includes in zip(missing.items(), results):
+                includes[path] = file_includes
+                cache[digest] = file_includes
+
+    if cache_file is not None and missing:
+        save_cache(cache_file, cache)
+
+    return includes
+
+
+def strongly_connected_components(nodes, deps):
+    '''
+    Tarjan's algorithm, iterative to support deep dependency chains. Returns
+    the components with more than one module, which are the ones containing a
+    cycle.
+    '''
+    index = dict()
+    lowlink = dict()
+    on_stack = set()
+    stack = []
+    components = []
+
+    for root in sorted(nodes):
+        if root in index:
+            continue
+        work = [(root, iter(sorted(deps[root] & nodes)))]
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(sorted(deps[child] & nodes))))
+                    break
+                if child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = set()
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.add(member)
+                        if member == node:
+                            break
+                    if len(component) > 1:
+                        components.append(component)
+
+    return components
+
+
+def shortest_cycle(component, deps):
+    '''
+    Find the shortest cycle in a strongly connected component. Among the
+    shortest cycles, the one starting with the first module in sorted order
+    is returned.
+    '''
+    best = None
+    for module in sorted(component):
+        # Breadth first search of the shortest path back to module. The
+        # modules of each level are visited in sorted order, so the path is
+        # deterministic.
+        frontier = deps[module] & component
+        paths = {dep: [] for dep in frontier}
+        depth = 0
+        while frontier and module not in paths:
+            if best is not None and depth + 2 >= len(best):
+                # Can't find a shorter cycle from this module
                 break
-        # If module is in its own transitive closure, it's a circular
-        # dependency; check if it is the shortest
-        if module in closure and (shortest_cycle is None or len(
-                closure[module]) + 1 < len(shortest_cycle)):
-            shortest_cycle = [module] + closure[module]
-    if shortest_cycle is None:
-        break
-    # We have the shortest circular dependency; report it
-    module = shortest_cycle[0]
-    print("Circular dependency: {}".format(
-        " -> ".join(shortest_cycle + [module])))
-    # And then break the dependency to avoid repeating in other cycles
-    deps[shortest_cycle[-1]] = deps[shortest_cycle[-1]] - set([module])
-    have_cycle = True
-
-sys.exit(1 if have_cycle else 0)
+            next_frontier = set()
+            for src in sorted(frontier):
+                for dep in deps[src] & component:
+                    if dep not in paths:
+                        paths[dep] = paths[src] + [src]
+                        next_frontier.add(dep)
+            frontier = next_frontier
+            depth += 1
+        if module in paths and (best is None or len(
+                paths[module]) + 1 < len(best)):
+            best = [module] + paths[module]
+    return best
+
+
+def find_cycles(deps):
+    '''
+    Report the shortest circular dependency, break it by removing its last
+    dependency and repeat until there is no cycle left.
+
+    A cycle is always contained in a strongly connected component, so the
+    search is restricted to the components and only the component of the
+    removed dependency needs to be searched again.
+    '''
+    cycles = []
+    heap = []
+
+    def push_components(nodes):
+        for component in strongly_connected_components(nodes, deps):
+            cycle = shortest_cycle(component, deps)
+            heapq.heappush(heap, (len(cycle), cycle[0], cycle, component))
+
+    push_components(set(deps.keys()))
+    while heap:
+        _, _, cycle, component = heapq.heappop(heap)
+        cycles.append(cycle + [cycle[0]])
+        # Break the dependency to avoid repeating in other cycles
+        deps[cycle[-1]] = deps[cycle[-1]] - set([cycle[0]])
+        push_components(component)
+
+    return cycles
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Find the circular dependencies between the modules")
+    parser.add_argument('files', nargs='*', help="The source files")
+    parser.add_argument(
+        '--cache-file', default=DEFAULT_CACHE_FILE,
+        help="The cache of the includes of each file, by content hash")
+    parser.add_argument(
+        '--no-cache', action='store_true', help="Don't use the cache")
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count() or 1,
+        help="The number of files parsed in parallel")
+    args = parser.parse_args()
+
+    files = dict()
+    deps = dict()
+
+    # Iterate over files, and create list of modules
+    for arg in args.files:
+        module = module_name(arg)
+        if module is None:
+            print("Ignoring file {} (does not constitute module)\n".format(arg))
+        else:
+            files[arg] = module
+            deps[module] = set()
+
+    # Build list of direct dependencies for each module
+    # TODO: implement support for multiple include directories
+    includes = get_includes(
+        sorted(files.keys()),
+        None if args.no_cache else args.cache_file,
+        max(1, args.jobs))
+    for arg in sorted(files.keys()):
+        module = files[arg]
+        for include in includes[arg]:
+            included_module = module_name(include)
+            if included_module is not None and included_module in deps and included_module != module:
+                deps[module].add(included_module)
+
+    cycles = find_cycles(deps)
+    for cycle in cycles:
+        print("Circular dependency: {}".format(" -> ".join(cycle)))
+
+    return 1 if cycles else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
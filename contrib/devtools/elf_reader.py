@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+'''
+A minimal ELF reader for the release checks.
+
+The file is mapped in memory and the ELF header, the program headers, the
+dynamic section and the dynamic symbols (with their version) are parsed once,
+using struct.
+'''
+import mmap
+import struct
+
+# e_type
+ET_DYN = 3
+
+# e_machine, named after the readelf output
+MACHINES = {
+    3: '80386',
+    40: 'ARM',
+    62: 'X86-64',
+    183: 'AArch64',
+}
+
+# p_type
+PT_GNU_STACK = 0x6474e551
+PT_GNU_RELRO = 0x6474e552
+
+# p_flags
+PF_X = 1
+PF_W = 2
+PF_R = 4
+
+# sh_type
+SHT_DYNAMIC = 6
+SHT_DYNSYM = 11
+SHT_GNU_VERDEF = 0x6ffffffd
+SHT_GNU_VERNEED = 0x6ffffffe
+SHT_GNU_VERSYM = 0x6fffffff
+
+# d_tag
+DT_NULL = 0
+DT_NEEDED = 1
+DT_BIND_NOW = 24
+DT_FLAGS = 30
+
+# DT_FLAGS value
+DF_BIND_NOW = 8
+
+SHN_UNDEF = 0
+
+# Version symbol indexes 0 and 1 are for local and global symbols without
+# version
+VER_NDX_GLOBAL = 1
+VERSYM_VERSION = 0x7fff
+
+# vd_flags value of the version definition of the file itself (its soname)
+VER_FLG_BASE = 1
+
+
+class ELFSymbol:
+    def __init__(self, name, version, is_import):
+        self.name = name
+        self.version = version
+        self.is_import = is_import
+
+
+class ELFFile:
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # The file is empty
+                raise IOError('{} is not an ELF file'.format(filename))
+
+        with data:
+            try:
+                self._parse(data)
+            except (struct.error, IndexError) as e:
+                raise IOError('{} is truncated or corrupted: {}'.format(
+                    filename, e))
+
+    def _parse(self, data):
+        if data[:4] != b'\x7fELF':
+            raise IOError('Not an ELF file')
+
+        is_64bit = data[4] == 2
+        endian = '<' if data[5] == 1 else '>'
+
+        def unpack(fmt, offset):
+            return struct.unpack_from(endian + fmt, data, offset)
+
+        if is_64bit:
+            (self.type, machine, _, _, phoff, shoff, _, _, phentsize, phnum,
+             shentsize, shnum, shstrndx) = unpack('HHIQQQIHHHHHH', 16)
+        else:
+            (self.type, machine, _, _, phoff, shoff, _, _, phentsize, phnum,
+             shentsize, shnum, shstrndx) = unpack('HHIIIIIHHHHHH', 16)
+        self.machine = MACHINES.get(machine, 'EM_{}'.format(machine))
+
+        # Program headers, as (p_type, p_flags)
+        self.program_headers = []
+        for i in range(phnum):
+            offset = phoff + i * phentsize
+            if is_64bit:
+                p_type, p_flags = unpack('II', offset)
+            else:
+                p_type, p_flags = (unpack('I', offset)[0],
+                                   unpack('I', offset + 24)[0])
+            self.program_headers.append((p_type, p_flags))
+
+        # Section headers, as (sh_type, sh_offset, sh_size, sh_link,
+        # sh_entsize)
+        sections = []
+        for i in range(shnum):
+            offset = shoff + i * shentsize
+            if is_64bit:
+                (_, sh_type, _, _, sh_offset, sh_size, sh_link, _, _,
+                 sh_entsize) = unpack('IIQQQQIIQQ', offset)
+            else:
+                (_, sh_type, _, _, sh_offset, sh_size, sh_link, _, _,
+                 sh_entsize) = unpack('IIIIIIIIII', offset)
+            sections.append((sh_type, sh_offset, sh_size, sh_link, sh_entsize))
+
+        def find_section(sh_type):
+            for section in sections:
+                if section[0] == sh_type:
+                    return section
+            return None
+
+        def read_string(section, index):
+            start = section[1] + index
+            end = data.find(b'\x00', start, section[1] + section[2])
+            return data[start:end].decode('utf-8', 'replace')
+
+        # Dynamic section
+        self.needed = []
+        self.bind_now = False
+        dynamic = find_section(SHT_DYNAMIC)
+        if dynamic is not None:
+            dynstr = sections[dynamic[3]]
+            entsize = dynamic[4] or (16 if is_64bit else 8)
+            for offset in range(dynamic[1], dynamic[1] + dynamic[2], entsize):
+                d_tag, d_val = unpack('qQ' if is_64bit else 'iI', offset)
+                if d_tag == DT_NULL:
+                    break
+                if d_tag == DT_NEEDED:
+                    self.needed.append(read_string(dynstr, d_val))
+                elif d_tag == DT_BIND_NOW:
+                    self.bind_now = True
+                elif d_tag == DT_FLAGS and d_val & DF_BIND_NOW:
+                    self.bind_now = True
+
+        # Version names, by version index
+        versions = {}
+        verneed = find_section(SHT_GNU_VERNEED)
+        if verneed is not None:
+            strtab = sections[verneed[3]]
+            offset = verneed[1]
+            while True:
+                _, _, _, vn_aux, vn_next = unpack('HHIII', offset)
+                aux_offset = offset + vn_aux
+                while True:
+                    _, _, vna_other, vna_name, vna_next = unpack(
+                        'IHHII', aux_offset)
+                    versions[vna_other] = read_string(strtab, vna_name)
+                    if vna_next == 0:
+                        break
+                    aux_offset += vna_next
+                if vn_next == 0:
+                    break
+                offset += vn_next
+        verdef = find_section(SHT_GNU_VERDEF)
+        if verdef is not None:
+            strtab = sections[verdef[3]]
+            offset = verdef[1]
+            while True:
+                _, vd_flags, vd_ndx, _, _, vd_aux, vd_next = unpack(
+                    'HHHHIII', offset)
+                if not vd_flags & VER_FLG_BASE:
+                    vda_name, _ = unpack('II', offset + vd_aux)
+                    versions[vd_ndx] = read_string(strtab, vda_name)
+                if vd_next == 0:
+                    break
+                offset += vd_next
+
+        # Dynamic symbols
+        self.dynamic_symbols = []
+        dynsym = find_section(SHT_DYNSYM)
+        if dynsym is not None:
+            dynstr = sections[dynsym[3]]
+            versym = find_section(SHT_GNU_VERSYM)
+            entsize = dynsym[4] or (24 if is_64bit else 16)
+            for i in range(dynsym[2] // entsize):
+                offset = dynsym[1] + i * entsize
+                if is_64bit:
+                    st_name, _, _, st_shndx = unpack('IBBH', offset)
+                else:
+                    st_name, _, _, _, _, st_shndx = unpack('IIIBBH', offset)
+                name = read_string(dynstr, st_name)
+                if not name:
+                    continue
+                version = ''
+                if versym is not None:
+                    index = unpack('H', versym[1] + 2 * i)[0] & VERSYM_VERSION
+                    if index > VER_NDX_GLOBAL:
+                        version = versions.get(index, '')
+                self.dynamic_symbols.append(
+                    ELFSymbol(name, version, st_shndx == SHN_UNDEF))
+
+    def is_pie(self):
+        return self.type == ET_DYN
+
+    def has_program_header(self, p_type):
+        return any(typ == p_type for (typ, _) in self.program_headers)
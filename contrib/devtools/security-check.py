@@ -6,125 +6,67 @@
 Perform basic ELF security checks on a series of executables.
 Exit status will be 0 if successful, and the program will be silent.
 Otherwise the exit status will be 1 and it will log which executables failed which checks.
-Needs `readelf` (for ELF) and `objdump` (for PE).
+Needs `objdump` (for PE).
 '''
+from concurrent.futures import ProcessPoolExecutor
 import subprocess
 import sys
 import os
 
-READELF_CMD = os.getenv('READELF', '/usr/bin/readelf')
+from elf_reader import (
+    ELFFile,
+    PF_W,
+    PF_X,
+    PT_GNU_RELRO,
+    PT_GNU_STACK,
+)
+
 OBJDUMP_CMD = os.getenv('OBJDUMP', '/usr/bin/objdump')
 # checks which are non-fatal for now but only generate a warning
 NONFATAL = {}
 
 
-def check_ELF_PIE(executable):
+def check_ELF_PIE(elf):
     '''
     Check for position independent executable (PIE), allowing for address space randomization.
     '''
-    p = subprocess.Popen([READELF_CMD, '-h', '-W', executable], stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE, stdin=subprocess.PIPE, universal_newlines=True)
-    (stdout, stderr) = p.communicate()
-    if p.returncode:
-        raise IOError('Error opening file')
-
-    ok = False
-    for line in stdout.splitlines():
-        line = line.split()
-        if len(line) >= 2 and line[0] == 'Type:' and line[1] == 'DYN':
-            ok = True
-    return ok
+    return elf.is_pie()
 
 
-def get_ELF_program_headers(executable):
-    '''Return type and flags for ELF program headers'''
-    p = subprocess.Popen([READELF_CMD, '-l', '-W', executable], stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE, stdin=subprocess.PIPE, universal_newlines=True)
-    (stdout, stderr) = p.communicate()
-    if p.returncode:
-        raise IOError('Error opening file')
-    in_headers = False
-    count = 0
-    headers = []
-    for line in stdout.splitlines():
-        if line.startswith('Program Headers:'):
-            in_headers = True
-        if line == '':
-            in_headers = False
-        if in_headers:
-            if count == 1:  # header line
-                ofs_typ = line.find('Type')
-                ofs_offset = line.find('Offset')
-                ofs_flags = line.find('Flg')
-                ofs_align = line.find('Align')
-                if ofs_typ == -1 or ofs_offset == -1 or ofs_flags == -1 or ofs_align == -1:
-                    raise ValueError('Cannot parse elfread -lW output')
-            elif count > 1:
-                typ = line[ofs_typ:ofs_offset].rstrip()
-                flags = line[ofs_flags:ofs_align].rstrip()
-                headers.append((typ, flags))
-            count += 1
-    return headers
-
-
-def check_ELF_NX(executable):
+def check_ELF_NX(elf):
     '''
     Check that no sections are writable and executable (including the stack)
     '''
     have_wx = False
     have_gnu_stack = False
-    for (typ, flags) in get_ELF_program_headers(executable):
-        if typ == 'GNU_STACK':
+    for (typ, flags) in elf.program_headers:
+        if typ == PT_GNU_STACK:
             have_gnu_stack = True
-        if 'W' in flags and 'E' in flags:  # section is both writable and executable
+        if flags & PF_W and flags & PF_X:  # section is both writable and executable
             have_wx = True
     return have_gnu_stack and not have_wx
 
 
-def check_ELF_RELRO(executable):
+def check_ELF_RELRO(elf):
     '''
     Check for read-only relocations.
     GNU_RELRO program header must exist
     Dynamic section must have BIND_NOW flag
     '''
-    have_gnu_relro = False
-    for (typ, flags) in get_ELF_program_headers(executable):
-        # Note: not checking flags == 'R': here as linkers set the permission differently
-        # This does not affect security: the permission flags of the GNU_RELRO program header are ignored, the PT_LOAD header determines the effective permissions.
-        # However, the dynamic linker need to write to this area so these are RW.
-        # Glibc itself takes care of mprotecting this area R after relocations are finished.
-        # See also https://marc.info/?l=binutils&m=1498883354122353
-        if typ == 'GNU_RELRO':
-            have_gnu_relro = True
-
-    have_bindnow = False
-    p = subprocess.Popen([READELF_CMD, '-d', '-W', executable], stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE, stdin=subprocess.PIPE, universal_newlines=True)
-    (stdout, stderr) = p.communicate()
-    if p.returncode:
-        raise IOError('Error opening file')
-    for line in stdout.splitlines():
-        tokens = line.split()
-        if len(tokens) > 1 and tokens[1] == '(BIND_NOW)' or (
-                len(tokens) > 2 and tokens[1] == '(FLAGS)' and 'BIND_NOW' in tokens[2:]):
-            have_bindnow = True
-    return have_gnu_relro and have_bindnow
+    # Note: not checking flags == 'R': here as linkers set the permission differently
+    # This does not affect security: the permission flags of the GNU_RELRO program header are ignored, the PT_LOAD header determines the effective permissions.
+    # However, the dynamic linker need to write to this area so these are RW.
+    # Glibc itself takes care of mprotecting this area R after relocations are finished.
+    # See also https://marc.info/?l=binutils&m=1498883354122353
+    have_gnu_relro = elf.has_program_header(PT_GNU_RELRO)
+    return have_gnu_relro and elf.bind_now
 
 
-def check_ELF_Canary(executable):
+def check_ELF_Canary(elf):
     '''
     Check for use of stack canary
     '''
-    p = subprocess.Popen([READELF_CMD, '--dyn-syms', '-W', executable], stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE, stdin=subprocess.PIPE, universal_newlines=True)
-    (stdout, stderr) = p.communicate()
-    if p.returncode:
-        raise IOError('Error opening file')
-    ok = False
-    for line in stdout.splitlines():
-        if '__stack_chk_fail' in line:
-            ok = True
-    return ok
+    return any('__stack_chk_fail' in sym.name for sym in elf.dynamic_symbols)
 
 
 def get_PE_dll_characteristics(executable):
@@ -198,7 +140,7 @@ CHECKS = {
 
 
 def identify_executable(executable):
-    with open(filename, 'rb') as f:
+    with open(executable, 'rb') as f:
         magic = f.read(4)
     if magic.startswith(b'MZ'):
         return 'PE'
@@ -207,30 +149,44 @@ def identify_executable(executable):
     return None
 
 
+def check_executable(filename):
+    '''
+    Run the checks on an executable. Returns the output lines and whether it
+    failed.
+    '''
+    try:
+        etype = identify_executable(filename)
+        if etype is None:
+            return (['{}: unknown format'.format(filename)], True)
+
+        # The ELF file is parsed once for all the checks
+        executable = ELFFile(filename) if etype == 'ELF' else filename
+
+        failed = []
+        warning = []
+        for (name, func) in CHECKS[etype]:
+            if not func(executable):
+                if name in NONFATAL:
+                    warning.append(name)
+                else:
+                    failed.append(name)
+        output = []
+        if failed:
+            output.append('{}: failed {}'.format(filename, ' '.join(failed)))
+        if warning:
+            output.append('{}: warning {}'.format(filename, ' '.join(warning)))
+        return (output, bool(failed))
+    except IOError:
+        return (['{}: cannot open'.format(filename)], True)
+
+
 if __name__ == '__main__':
     retval = 0
-    for filename in sys.argv[1:]:
-        try:
-            etype = identify_executable(filename)
-            if etype is None:
-                print('{}: unknown format'.format(filename))
-                retval = 1
-                continue
-
-            failed = []
-            warning = []
-            for (name, func) in CHECKS[etype]:
-                if not func(filename):
-                    if name in NONFATAL:
-                        warning.append(name)
-                    else:
-                        failed.append(name)
+    # Check the executables in parallel, the output is in the argument order
+    with ProcessPoolExecutor() as executor:
+        for output, failed in executor.map(check_executable, sys.argv[1:]):
+            for line in output:
+                print(line)
             if failed:
-                print('{}: failed {}'.format(filename, ' '.join(failed)))
                 retval = 1
-            if warning:
-                print('{}: warning {}'.format(filename, ' '.join(warning)))
-        except IOError:
-            print('{}: cannot open'.format(filename))
-            retval = 1
     sys.exit(retval)
@@ -11,11 +11,13 @@ Example usage:
 
     find contrib/gitian-builder/build -type f -executable | xargs python3 contrib/devtools/symbol-check.py
 '''
+from concurrent.futures import ProcessPoolExecutor
 import subprocess
-import re
 import sys
 import os
 
+from elf_reader import ELFFile
+
 # Debian 8.11 (Jessie) has:
 #
 # - g++ version 4.9.2 (https://packages.debian.org/search?suite=default&section=all&arch=any&searchon=names&keywords=g%2B%2B)
@@ -57,7 +59,6 @@ IGNORE_EXPORTS = {
     '_ZNKSt5ctypeIcE8do_widenEc', 'in6addr_any', 'optarg',
     '_ZNSt16_Sp_counted_baseILN9__gnu_cxx12_Lock_policyE2EE10_M_destroyEv'
 }
-READELF_CMD = os.getenv('READELF', '/usr/bin/readelf')
 CPPFILT_CMD = os.getenv('CPPFILT', '/usr/bin/c++filt')
 # Allowed NEEDED libraries
 ALLOWED_LIBRARIES = {
@@ -87,52 +88,27 @@ ARCH_MIN_GLIBC_VER = {
 }
 
 
-class CPPFilt(object):
+def cppfilt(mangled):
     '''
-    Demangle C++ symbol names.
+    Demangle a list of C++ symbol names.
 
-    Use a pipe to the 'c++filt' command.
+    The names are demangled in a single 'c++filt' invocation.
     '''
-
-    def __init__(self):
-        self.proc = subprocess.Popen(
-            CPPFILT_CMD, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
-
-    def __call__(self, mangled):
-        self.proc.stdin.write(mangled + '\n')
-        self.proc.stdin.flush()
-        return self.proc.stdout.readline().rstrip()
-
-    def close(self):
-        self.proc.stdin.close()
-        self.proc.stdout.close()
-        self.proc.wait()
+    if not mangled:
+        return []
+    stdout = subprocess.run(
+        CPPFILT_CMD, input='\n'.join(mangled) + '\n', stdout=subprocess.PIPE,
+        universal_newlines=True, check=True).stdout
+    return stdout.splitlines()
 
 
-def read_symbols(executable, imports=True):
+def read_symbols(elf, imports=True):
     '''
-    Parse an ELF executable and return a list of (symbol,version) tuples
-    for dynamic, imported symbols.
+    Return a list of (symbol,version,arch) tuples for the dynamic, imported
+    symbols of an ELF executable.
     '''
-    p = subprocess.Popen([READELF_CMD, '--dyn-syms', '-W', '-h', executable], stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE, stdin=subprocess.PIPE, universal_newlines=True)
-    (stdout, stderr) = p.communicate()
-    if p.returncode:
-        raise IOError('Could not read symbols for {}: {}'.format(
-            executable, stderr.strip()))
-    syms = []
-    for line in stdout.splitlines():
-        line = line.split()
-        if 'Machine:' in line:
-            arch = line[-1]
-        if len(line) > 7 and re.match('[0-9]+:$', line[0]):
-            (sym, _, version) = line[7].partition('@')
-            is_import = line[6] == 'UND'
-            if version.startswith('@'):
-                version = version[1:]
-            if is_import == imports:
-                syms.append((sym, version, arch))
-    return syms
+    return [(sym.name, sym.version, elf.machine)
+            for sym in elf.dynamic_symbols if sym.is_import == imports]
 
 
 def check_version(max_versions, version, arch):
@@ -147,47 +123,40 @@ def check_version(max_versions, version, arch):
     return ver <= max_versions[lib] or lib == 'GLIBC' and ver <= ARCH_MIN_GLIBC_VER[arch]
 
 
-def read_libraries(filename):
-    p = subprocess.Popen([READELF_CMD, '-d', '-W', filename], stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE, stdin=subprocess.PIPE, universal_newlines=True)
-    (stdout, stderr) = p.communicate()
-    if p.returncode:
-        raise IOError('Error opening file')
-    libraries = []
-    for line in stdout.splitlines():
-        tokens = line.split()
-        if len(tokens) > 2 and tokens[1] == '(NEEDED)':
-            match = re.match(
-                r'^Shared library: \[(.*)\]$', ' '.join(tokens[2:]))
-            if match:
-                libraries.append(match.group(1))
-            else:
-                raise ValueError('Unparseable (NEEDED) specification')
-    return libraries
+def check_executable(filename):
+    '''
+    Check an executable. Returns a list of (message,symbol) tuples, the
+    mangled symbol name being formatted into the message after demangling.
+    '''
+    errors = []
+    elf = ELFFile(filename)
+    # Check imported symbols
+    for sym, version, arch in read_symbols(elf, True):
+        if version and not check_version(MAX_VERSIONS, version, arch):
+            errors.append(('{}: symbol {{}} from unsupported version {}'.format(
+                filename, version), sym))
+    # Check exported symbols
+    for sym, version, arch in read_symbols(elf, False):
+        if sym in IGNORE_EXPORTS:
+            continue
+        errors.append(
+            ('{}: export of symbol {{}} not allowed'.format(filename), sym))
+    # Check dependency libraries
+    for library_name in elf.needed:
+        if library_name not in ALLOWED_LIBRARIES:
+            errors.append(('{}: NEEDED library {} is not allowed'.format(
+                filename, library_name), None))
+    return errors
 
 
 if __name__ == '__main__':
-    cppfilt = CPPFilt()
-    retval = 0
-    for filename in sys.argv[1:]:
-        # Check imported symbols
-        for sym, version, arch in read_symbols(filename, True):
-            if version and not check_version(MAX_VERSIONS, version, arch):
-                print('{}: symbol {} from unsupported version {}'.format(
-                    filename, cppfilt(sym), version))
-                retval = 1
-        # Check exported symbols
-        for sym, version, arch in read_symbols(filename, False):
-            if sym in IGNORE_EXPORTS:
-                continue
-            print('{}: export of symbol {} not allowed'.format(
-                filename, cppfilt(sym)))
-            retval = 1
-        # Check dependency libraries
-        for library_name in read_libraries(filename):
-            if library_name not in ALLOWED_LIBRARIES:
-                print('{}: NEEDED library {} is not allowed'.format(
-                    filename, library_name))
-                retval = 1
-
-    sys.exit(retval)
+    # Check the executables in parallel, the output is in the argument order
+    with ProcessPoolExecutor() as executor:
+        errors = [error for file_errors in executor.map(
+            check_executable, sys.argv[1:]) for error in file_errors]
+
+    demangled = iter(cppfilt([sym for _, sym in errors if sym is not None]))
+    for message, sym in errors:
+        print(message.format(next(demangled)) if sym is not None else message)
+
+    sys.exit(1 if errors else 0)
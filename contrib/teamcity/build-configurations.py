@@ -35,6 +35,7 @@ class BuildConfiguration:
         self.build_steps = []
         self.build_directory = None
         self.junit_reports_dir = None
+        self.junit_fragments_dir = None
         self.test_logs_dir = None
         self.jobs = (os.cpu_count() or 0) + 1
 
@@ -112,6 +113,8 @@ class BuildConfiguration:
 
         # Define the junit and logs directories
         self.junit_reports_dir = self.build_directory.joinpath("test/junit")
+        self.junit_fragments_dir = self.build_directory.joinpath(
+            "test/tmp/junit")
         self.test_logs_dir = self.build_directory.joinpath("test/log")
         self.functional_test_logs = self.build_directory.joinpath(
             "test/tmp/test_runner_*")
@@ -300,6 +303,24 @@ class UserBuild():
             shutil.rmtree(self.configuration.build_directory)
         self.configuration.build_directory.mkdir(exist_ok=True, parents=True)
 
+    def merge_junit_reports(self):
+        # The junit reports of each test are merged when its test suite
+        # completes, which doesn't happen if a test failed. Merge them again so
+        # the reports of all the tests that ran are available.
+        if not self.configuration.junit_fragments_dir.is_dir():
+            return
+
+        subprocess.run(
+            [
+                sys.executable,
+                str(self.configuration.project_root.joinpath(
+                    "cmake/utils/junit-reports-merge.py")),
+                "--merge",
+                str(self.configuration.junit_reports_dir),
+                str(self.configuration.junit_fragments_dir),
+            ],
+        )
+
     def copy_artifacts(self, artifacts):
         # Make sure the artifact directory always exists. It is created before
         # the build is run (to let the build install things to it) but since we
@@ -434,6 +455,8 @@ class UserBuild():
 
             build_directory = self.configuration.build_directory
 
+            self.merge_junit_reports()
+
             # Always add the build logs to the root of the artifacts
             artifacts = {
                 **self.configuration.get("artifacts", {}),
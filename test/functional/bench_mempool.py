@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark the mempool of a node with large transaction graphs.
+
+The transaction graphs are built locally beforehand, on top of outputs funded
+by mined transactions splitting coinbases. The scenarios are:
+    chains     chains of --chainlength transactions
+    fanouts    transactions with --fanout outputs, and a transaction spending
+               each of these outputs
+    conflicts  packages of a parent and a child, each followed by a
+               conflicting package spending the same output, which is
+               rejected
+Each scenario is submitted to the node over the selected paths: batches of
+sendrawtransaction over RPC, or tx messages from a P2P connection. For each
+scenario and path, the following is reported:
+    - the acceptance throughput, from the first submission until the node has
+      processed all the transactions;
+    - the latency percentiles of getrawmempool and of getmempoolentry on
+      random transactions, with the mempool full;
+    - the time invalidateblock takes to put the transactions back in the
+      mempool, once they are all mined, as in mempool_resurrect.py.
+
+The report is logged, and written as json to --jsonfile so it can be tracked
+over time, e.g.:
+    test/functional/bench_mempool.py --txs 100000 --scenario chains,fanouts \\
+        --submit rpc --jsonfile mempool-$(git rev-parse --short HEAD).json
+
+This is not a functional test and is not run by test_runner.py."""
+
+import json
+import random
+import time
+
+from test_framework.loadgen import LatencyStats
+from test_framework.messages import COIN, COutPoint, CTransaction, CTxIn, CTxOut, msg_tx
+from test_framework.p2p import P2PInterface
+from test_framework.script import CScript
+from test_framework.test_framework import BitcoinTestFramework
+from test_framework.txtools import pad_tx
+from test_framework.util import assert_equal
+
+SCENARIOS = ['chains', 'fanouts', 'conflicts']
+PATHS = ['rpc', 'p2p']
+# The number of outputs of the transactions splitting the coinbases, each
+# funding a chain, a fan-out or a pair of conflicting packages
+FUNDING_OUTPUTS = 250
+# In satoshis per byte, above the default -minrelaytxfee
+FEE_RATE = 2
+DUST_THRESHOLD = 546
+
+
+class SilentPeer(P2PInterface):
+    """Doesn't request the transactions the node announces back."""
+
+    def on_inv(self, message):
+        pass
+
+
+def spend(outpoints, value, num_outputs, script, fee_rate=FEE_RATE):
+    """Returns a transaction spending the anyone-can-spend outpoints, worth
+    value, into num_outputs outputs of the same value."""
+    tx = CTransaction()
+    tx.vin = [CTxIn(COutPoint(txid, n), CScript([b'\x51'])) for txid, n in outpoints]
+    tx.vout = [CTxOut(0, script) for _ in range(num_outputs)]
+    pad_tx(tx)
+    output_value = (value - len(tx.serialize()) * fee_rate) // num_outputs
+    assert output_value > DUST_THRESHOLD, \
+        "Not enough funds for {} outputs".format(num_outputs)
+    for output in tx.vout[:num_outputs]:
+        output.nValue = output_value
+    tx.rehash()
+    return tx
+
+
+class MempoolBench(BitcoinTestFramework):
+    def add_options(self, parser):
+        parser.add_argument('--scenario', default=','.join(SCENARIOS),
+                            help='comma separated scenarios among {} (default: %(default)s)'.format(
+                                ', '.join(SCENARIOS)))
+        parser.add_argument('--submit', default=','.join(PATHS),
+                            help='comma separated submission paths among {} (default: %(default)s)'.format(
+                                ', '.join(PATHS)))
+        parser.add_argument('--txs', type=int, default=10000,
+                            help='number of transactions per scenario and path (default: %(default)s)')
+        parser.add_argument('--chainlength', type=int, default=25,
+                            help='number of transactions of the chains (default: %(default)s)')
+        parser.add_argument('--fanout', type=int, default=100,
+                            help='number of outputs of the fan-out transactions (default: %(default)s)')
+        parser.add_argument('--batchsize', type=int, default=100,
+                            help='number of transactions sent per RPC batch (default: %(default)s)')
+        parser.add_argument('--queries', type=int, default=50,
+                            help='number of getrawmempool and getmempoolentry calls (default: %(default)s)')
+        parser.add_argument('--jsonfile',
+                            help='also write the report as json to this file')
+
+    def set_test_params(self):
+        self.num_nodes = 1
+        self.setup_clean_chain = True
+        self.rpc_timeout = 3600
+        self.scenarios = self.options.scenario.split(',')
+        self.paths = self.options.submit.split(',')
+        for scenario in self.scenarios:
+            assert scenario in SCENARIOS, "Unknown scenario {}".format(scenario)
+        for path in self.paths:
+            assert path in PATHS, "Unknown submission path {}".format(path)
+
+        # Let the chains and fan-outs in, and the whole graph fit in the
+        # mempool
+        package_count = max(self.options.chainlength, self.options.fanout + 1)
+        package_size = max(101, package_count)
+        self.extra_args = [[
+            "-limitancestorcount={}".format(package_count),
+            "-limitdescendantcount={}".format(package_count),
+            "-limitancestorsize={}".format(package_size),
+            "-limitdescendantsize={}".format(package_size),
+            "-maxmempool=3000",
+            "-blockmaxsize=32000000",
+            "-maxreorgdepth=-1",
+            "-whitelist=noban@127.0.0.1",
+        ]]
+
+    def run_test(self):
+        node = self.nodes[0]
+        self.anyone_addr = node.decodescript('51')['p2sh']
+        self.anyone_script = CScript.fromhex(
+            node.validateaddress(self.anyone_addr)['scriptPubKey'])
+
+        runs = [(scenario, path) for scenario in self.scenarios for path in self.paths]
+        roots_per_run = {scenario: -(-self.options.txs // self.txs_per_root(scenario))
+                         for scenario in self.scenarios}
+        roots = self.fund(node, sum(roots_per_run[scenario] for scenario, _ in runs))
+
+        results = {}
+        for scenario, path in runs:
+            name = "{}.{}".format(scenario, path)
+            run_roots = roots[:roots_per_run[scenario]]
+            roots = roots[roots_per_run[scenario]:]
+            txs = self.build(scenario, run_roots)
+            self.log.info("{}: submit {} transactions".format(name, len(txs)))
+            results[name] = self.run_scenario(node, path, txs)
+            self.log.info("{}: {}".format(name, json.dumps(results[name], sort_keys=True)))
+
+        report = {
+            'params': {
+                'txs': self.options.txs,
+                'chainlength': self.options.chainlength,
+                'fanout': self.options.fanout,
+                'batchsize': self.options.batchsize,
+                'queries': self.options.queries,
+            },
+            'version': node.getnetworkinfo()['subversion'],
+            'timestamp': int(time.time()),
+            'results': results,
+        }
+        self.log.info("Report:\n" + json.dumps(report, indent=4, sort_keys=True))
+        if self.options.jsonfile:
+            with open(self.options.jsonfile, 'w', encoding='utf8') as f:
+                json.dump(report, f, indent=4, sort_keys=True)
+
+    def txs_per_root(self, scenario):
+        if scenario == 'chains':
+            return self.options.chainlength
+        if scenario == 'fanouts':
+            return self.options.fanout + 1
+        return 4
+
+    def fund(self, node, num_roots):
+        """Mines the transactions splitting coinbases into num_roots outputs,
+        and returns these outputs as (outpoint, value)."""
+        num_coinbases = -(-num_roots // FUNDING_OUTPUTS)
+        self.log.info("Fund {} roots from {} coinbases".format(num_roots, num_coinbases))
+        coinbases = node.generatetoaddress(num_coinbases, self.anyone_addr)
+        node.generatetoaddress(100, self.anyone_addr)
+
+        funding = []
+        for blockhash in coinbases:
+            coinbase = node.getblock(blockhash, 2)['tx'][0]
+            value = int(coinbase['vout'][1]['value'] * COIN)
+            funding.append(spend([(int(coinbase['txid'], 16), 1)], value,
+                                 FUNDING_OUTPUTS, self.anyone_script))
+        assert_equal(self.submit_rpc(node, funding), len(funding))
+        self.mine_mempool(node)
+        return [((tx.txid, n), tx.vout[n].nValue)
+                for tx in funding for n in range(FUNDING_OUTPUTS)][:num_roots]
+
+    def build(self, scenario, roots):
+        """Returns the transactions of the scenario in submission order, each
+        after its parents."""
+        txs = []
+        for outpoint, value in roots:
+            if scenario == 'chains':
+                for _ in range(self.options.chainlength):
+                    tx = spend([outpoint], value, 1, self.anyone_script)
+                    txs.append(tx)
+                    outpoint, value = (tx.txid, 0), tx.vout[0].nValue
+            elif scenario == 'fanouts':
+                parent = spend([outpoint], value, self.options.fanout, self.anyone_script)
+                txs.append(parent)
+                txs += [spend([(parent.txid, n)], parent.vout[n].nValue, 1, self.anyone_script)
+                        for n in range(self.options.fanout)]
+            else:
+                # The conflicting package pays a different fee, so it has
+                # other txids
+                for fee_rate in (FEE_RATE, 2 * FEE_RATE):
+                    parent = spend([outpoint], value, 1, self.anyone_script, fee_rate)
+                    child = spend([(parent.txid, 0)], parent.vout[0].nValue, 1,
+                                  self.anyone_script, fee_rate)
+                    txs += [parent, child]
+        return txs
+
+    def run_scenario(self, node, path, txs):
+        assert_equal(node.getmempoolinfo()['size'], 0)
+        start = time.perf_counter()
+        if path == 'rpc':
+            accepted = self.submit_rpc(node, txs)
+        else:
+            accepted = self.submit_p2p(node, txs)
+        seconds = time.perf_counter() - start
+        assert_equal(node.getmempoolinfo()['size'], accepted)
+
+        result = {
+            'submitted': len(txs),
+            'accepted': accepted,
+            'acceptance': {
+                'seconds': round(seconds, 3),
+                'tx_per_s': round(len(txs) / seconds, 1),
+            },
+        }
+        result.update(self.measure_queries(node))
+        result['resurrection'] = self.measure_resurrection(node)
+        return result
+
+    def submit_rpc(self, node, txs):
+        """Sends the transactions in batches of sendrawtransaction, and
+        returns the number of transactions accepted."""
+        accepted = 0
+        for i in range(0, len(txs), self.options.batchsize):
+            requests = [node.sendrawtransaction.get_request(tx.serialize().hex())
+                        for tx in txs[i:i + self.options.batchsize]]
+            accepted += sum(result['error'] is None for result in node.batch(requests))
+        return accepted
+
+    def submit_p2p(self, node, txs):
+        """Sends the transactions from a P2P connection, and returns the
+        number of transactions accepted once the node processed them all."""
+        peer = node.add_p2p_connection(SilentPeer())
+        for tx in txs:
+            peer.send_message(msg_tx(tx))
+        # The messages of a peer are processed in order
+        peer.sync_with_ping(timeout=self.rpc_timeout)
+        node.disconnect_p2ps()
+        return node.getmempoolinfo()['size']
+
+    def measure_queries(self, node):
+        getrawmempool = LatencyStats()
+        getmempoolentry = LatencyStats()
+        txids = []
+        for _ in range(self.options.queries):
+            start = time.perf_counter()
+            txids = node.getrawmempool()
+            getrawmempool.add(time.perf_counter() - start)
+        for _ in range(self.options.queries if txids else 0):
+            txid = random.choice(txids)
+            start = time.perf_counter()
+            node.getmempoolentry(txid)
+            getmempoolentry.add(time.perf_counter() - start)
+        return {
+            'getrawmempool_ms': getrawmempool.summary(),
+            'getmempoolentry_ms': getmempoolentry.summary(),
+        }
+
+    def measure_resurrection(self, node):
+        """Mines the mempool, then times the invalidation of the blocks,
+        which puts their transactions back in the mempool."""
+        blocks = self.mine_mempool(node)
+        start = time.perf_counter()
+        node.invalidateblock(blocks[0])
+        seconds = time.perf_counter() - start
+        resurrected = node.getmempoolinfo()['size']
+
+        # Restore the chain, which empties the mempool again
+        node.reconsiderblock(blocks[0])
+        assert_equal(node.getbestblockhash(), blocks[-1])
+        assert_equal(node.getmempoolinfo()['size'], 0)
+        return {
+            'blocks': len(blocks),
+            'txs': resurrected,
+            'seconds': round(seconds, 3),
+        }
+
+    def mine_mempool(self, node):
+        """Mines blocks until the mempool is empty, and returns their
+        hashes."""
+        blocks = []
+        while node.getmempoolinfo()['size']:
+            blocks += node.generatetoaddress(1, self.anyone_addr)
+        return blocks
+
+
+if __name__ == '__main__':
+    MempoolBench().main()
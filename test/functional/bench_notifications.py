@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark the NNG and ZMQ notifications of a node.
+
+The transactions and blocks are built locally beforehand: fan-out
+transactions splitting coinbases into many outputs are mined, and the
+transactions spending these outputs, independent from each other, are sent
+in batches of sendrawtransaction. Then a chain of blocks is submitted.
+
+The notifications are received on background threads: mempooltxadd and
+blkconnected over -nngpub, rawtx and hashblock over ZMQ, for the interfaces
+the node was built with. For each notification type, the number of
+notifications received, the sustained rate (notifications per second from the
+first submission to the last notification) and the latency percentiles from
+the submission to the notification are reported.
+
+A budget file sets limits per notification type, and the benchmark fails if
+any is exceeded, e.g.:
+    {
+        "nng.mempooltxadd": {"max_p99_ms": 50, "min_rate": 1000},
+        "zmq.hashblock": {"max_p50_ms": 5, "max_lost": 0}
+    }
+The limits are max_<p50|p90|p99|max>_ms, min_rate and max_lost.
+
+This is not a functional test and is not run by test_runner.py."""
+
+import asyncio
+import json
+import threading
+import time
+from io import BytesIO
+
+from test_framework.blocktools import create_block, create_coinbase, prepare_block
+from test_framework.loadgen import LatencyStats
+from test_framework.messages import COIN, COutPoint, CTransaction, CTxIn, CTxOut
+from test_framework.nng import NngSubscriber, fb_hash
+from test_framework.script import OP_EQUAL, OP_HASH160, CScript
+from test_framework.test_framework import BitcoinTestFramework, SkipTest
+from test_framework.txtools import pad_tx
+from test_framework.util import assert_equal, p2p_port, rpc_port
+
+# The number of outputs of the fan-out transactions
+FANOUT = 500
+FEE = 10000
+
+NNG_TOPICS = ['mempooltxadd', 'blkconnected']
+ZMQ_TOPICS = [b'rawtx', b'hashblock']
+# So the node doesn't drop the ZMQ notifications the subscriber is late to
+# receive
+ZMQ_HWM = 1000000
+
+
+class NngReceiver(threading.Thread):
+    """Receives the NNG notifications on an event loop of its own."""
+
+    def __init__(self, url):
+        super().__init__(name="NngReceiver", daemon=True)
+        self.url = url
+        self.messages = {topic: [] for topic in NNG_TOPICS}
+        self.loop = asyncio.new_event_loop()
+        self.subscriber = None
+        self.ready = threading.Event()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.subscriber = NngSubscriber(self.url)
+        for topic in NNG_TOPICS:
+            self.subscriber.subscribe(topic, self.messages[topic].append)
+        self.ready.set()
+        self.loop.run_forever()
+        self.subscriber.close()
+        # Let the dispatcher task handle its cancellation
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.join()
+
+    def count(self):
+        return sum(len(messages) for messages in self.messages.values())
+
+    def received(self):
+        """Returns the receive times of the notifications, by topic and by
+        txid or block hash."""
+        from NngInterface.BlockConnected import BlockConnected
+        from NngInterface.TransactionAddedToMempool import TransactionAddedToMempool
+        received = {'mempooltxadd': {}, 'blkconnected': {}}
+        for message in self.messages['mempooltxadd']:
+            tx = TransactionAddedToMempool.GetRootAs(message.payload, 0).MempoolTx().Tx()
+            received['mempooltxadd'].setdefault(
+                fb_hash(tx.Txid().Hash())[::-1].hex(), message.time)
+        for message in self.messages['blkconnected']:
+            header = BlockConnected.GetRootAs(message.payload, 0).Block().Header()
+            received['blkconnected'].setdefault(
+                fb_hash(header.BlockHash().Hash())[::-1].hex(), message.time)
+        return received
+
+
+class ZmqReceiver(threading.Thread):
+    def __init__(self, url):
+        super().__init__(name="ZmqReceiver", daemon=True)
+        import zmq
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.SUB)
+        self.socket.set(zmq.RCVHWM, 0)
+        for topic in ZMQ_TOPICS:
+            self.socket.setsockopt(zmq.SUBSCRIBE, topic)
+        self.socket.connect(url)
+        self.messages = []
+        self.stopped = threading.Event()
+        self.ready = threading.Event()
+        self.ready.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            if self.socket.poll(100):
+                topic, body, _ = self.socket.recv_multipart()
+                self.messages.append((time.perf_counter(), topic, body))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.context.destroy(linger=0)
+
+    def count(self):
+        return len(self.messages)
+
+    def received(self):
+        received = {'rawtx': {}, 'hashblock': {}}
+        for received_time, topic, body in self.messages:
+            if topic == b'rawtx':
+                tx = CTransaction()
+                tx.deserialize(BytesIO(body))
+                tx.rehash()
+                received['rawtx'].setdefault(tx.txid_hex, received_time)
+            else:
+                received['hashblock'].setdefault(body.hex(), received_time)
+        return received
+
+
+def summarize(sent, received):
+    """Returns the report of a notification type, from the submission times
+    and the notification times of the txids or block hashes."""
+    latency = LatencyStats()
+    for key, sent_time in sent.items():
+        if key in received:
+            latency.add(received[key] - sent_time)
+    times = [received[key] for key in sent if key in received]
+    summary = latency.summary()
+    elapsed = max(times) - min(sent.values()) if times else 0
+    return {
+        'sent': len(sent),
+        'received': summary.pop('count'),
+        'lost': len(sent) - len(times),
+        'rate': round(len(times) / elapsed, 1) if elapsed > 0 else None,
+        'latency_ms': summary,
+    }
+
+
+def check_budgets(report, budgets):
+    """Returns the budgets exceeded by the report, as a list of strings."""
+    exceeded = []
+    for name, limits in sorted(budgets.items()):
+        interface, _, topic = name.partition('.')
+        results = report.get(interface, {}).get(topic)
+        if results is None:
+            exceeded.append("{}: not measured".format(name))
+            continue
+        for limit, value in sorted(limits.items()):
+            if limit == 'min_rate':
+                actual = results['rate']
+                ok = actual is not None and actual >= value
+            elif limit == 'max_lost':
+                actual = results['lost']
+                ok = actual <= value
+            else:
+                # max_<percentile>_ms
+                actual = results['latency_ms'][limit[len('max_'):-len('_ms')]]
+                ok = actual is not None and actual <= value
+            if not ok:
+                exceeded.append("{}: {} is {}, the budget is {}".format(
+                    name, limit, actual, value))
+    return exceeded
+
+
+class NotificationsBench(BitcoinTestFramework):
+    def add_options(self, parser):
+        parser.add_argument('--txs', type=int, default=2000,
+                            help='number of transactions sent (default: %(default)s)')
+        parser.add_argument('--blocks', type=int, default=200,
+                            help='number of blocks submitted (default: %(default)s)')
+        parser.add_argument('--batchsize', type=int, default=100,
+                            help='number of transactions sent per RPC batch (default: %(default)s)')
+        parser.add_argument('--budget', dest='budget_file',
+                            help='json file of the budgets per notification type')
+        parser.add_argument('--jsonfile',
+                            help='also write the report as json to this file')
+
+    def set_test_params(self):
+        self.num_nodes = 1
+        self.setup_clean_chain = True
+        self.rpc_timeout = 600
+
+    def run_test(self):
+        node = self.nodes[0]
+        args = []
+        receivers = {}
+        if self.is_nng_interface_compiled():
+            try:
+                import pynng  # noqa
+                import flatbuffers  # noqa
+                url = "tcp://127.0.0.1:{}".format(p2p_port(self.num_nodes))
+                args += ["-nngpub={}".format(url)] + [
+                    "-nngpubmsg={}".format(topic) for topic in NNG_TOPICS]
+                receivers['nng'] = lambda: NngReceiver(url)
+            except ImportError:
+                self.log.warning("pynng or flatbuffers not available")
+        if self.is_zmq_compiled():
+            try:
+                import zmq  # noqa
+                url = "tcp://127.0.0.1:{}".format(rpc_port(self.num_nodes))
+                for topic in ZMQ_TOPICS:
+                    args += ["-zmqpub{}={}".format(topic.decode(), url),
+                             "-zmqpub{}hwm={}".format(topic.decode(), ZMQ_HWM)]
+                receivers['zmq'] = lambda: ZmqReceiver(url)
+            except ImportError:
+                self.log.warning("python3-zmq not available")
+        if not receivers:
+            raise SkipTest("Neither the NNG nor the ZMQ interface is available")
+
+        budgets = {}
+        if self.options.budget_file:
+            with open(self.options.budget_file, encoding='utf8') as f:
+                budgets = json.load(f)
+
+        self.restart_node(0, args)
+        anyone_addr = node.decodescript('51')['p2sh']
+        self.anyone_script = CScript.fromhex(
+            node.validateaddress(anyone_addr)['scriptPubKey'])
+
+        txs = self.build_transactions(node, anyone_addr)
+        blocks = self.build_blocks(node)
+
+        started = {name: make_receiver() for name, make_receiver in receivers.items()}
+        for receiver in started.values():
+            receiver.start()
+            receiver.ready.wait()
+        # Relax so that the subscribers are connected before the notifications
+        time.sleep(0.5)
+
+        self.log.info("Send {} transactions".format(len(txs)))
+        tx_sent = self.send_transactions(node, txs)
+        self.log.info("Submit {} blocks".format(len(blocks)))
+        block_sent = self.submit_blocks(node, blocks)
+
+        # Wait for the late notifications. ZMQ also sends the rawtx of the
+        # coinbase of each block.
+        for name, receiver in started.items():
+            self.wait_for_notifications(
+                receiver, len(tx_sent) + len(block_sent) * (2 if name == 'zmq' else 1))
+            receiver.stop()
+
+        report = {}
+        for name, receiver in started.items():
+            received = receiver.received()
+            tx_topic, block_topic = ('mempooltxadd', 'blkconnected') if name == 'nng' else (
+                'rawtx', 'hashblock')
+            report[name] = {
+                tx_topic: summarize(tx_sent, received[tx_topic]),
+                block_topic: summarize(block_sent, received[block_topic]),
+            }
+
+        self.log.info("Report:\n" + json.dumps(report, indent=4, sort_keys=True))
+        if self.options.jsonfile:
+            with open(self.options.jsonfile, 'w', encoding='utf8') as f:
+                json.dump(report, f, indent=4, sort_keys=True)
+
+        exceeded = check_budgets(report, budgets)
+        if exceeded:
+            raise AssertionError("Budgets exceeded:\n" + "\n".join(exceeded))
+
+    def build_transactions(self, node, anyone_addr):
+        """Mines the fan-out transactions and returns the transactions
+        spending their outputs."""
+        num_fanouts = (self.options.txs + FANOUT - 1) // FANOUT
+        self.log.info("Build {} transactions".format(self.options.txs))
+        coinbases = node.generatetoaddress(num_fanouts, anyone_addr)
+        node.generatetoaddress(100, anyone_addr)
+
+        fanouts = []
+        for blockhash in coinbases:
+            coinbase = node.getblock(blockhash, 2)['tx'][0]
+            value = int(coinbase['vout'][1]['value'] * COIN)
+            tx = CTransaction()
+            tx.vin.append(CTxIn(COutPoint(int(coinbase['txid'], 16), 1), CScript([b'\x51'])))
+            tx.vout = [CTxOut((value - FEE) // FANOUT, self.anyone_script)
+                       for _ in range(FANOUT)]
+            tx.rehash()
+            fanouts.append(tx)
+        for tx in fanouts:
+            node.sendrawtransaction(tx.serialize().hex())
+        node.generatetoaddress(1, anyone_addr)
+        assert_equal(node.getrawmempool(), [])
+
+        burn_script = CScript([OP_HASH160, bytes(20), OP_EQUAL])
+        txs = []
+        for i in range(self.options.txs):
+            fanout = fanouts[i // FANOUT]
+            tx = CTransaction()
+            tx.vin.append(CTxIn(COutPoint(fanout.txid, i % FANOUT), CScript([b'\x51'])))
+            tx.vout.append(CTxOut(fanout.vout[0].nValue - FEE, burn_script))
+            pad_tx(tx)
+            tx.rehash()
+            txs.append(tx)
+        return txs
+
+    def build_blocks(self, node):
+        """Returns a chain of blocks on top of the tip, with only a
+        coinbase, so they can be built before the transactions are sent."""
+        tip = node.getblock(node.getbestblockhash())
+        blocks = []
+        prev_hash = int(tip['hash'], 16)
+        for i in range(1, self.options.blocks + 1):
+            block = create_block(prev_hash, create_coinbase(tip['height'] + i),
+                                 tip['height'] + i, tip['time'] + i)
+            prepare_block(block)
+            prev_hash = block.sha256
+            blocks.append(block)
+        return blocks
+
+    def send_transactions(self, node, txs):
+        """Sends the transactions in batches, and returns the time each one
+        was sent, by txid."""
+        sent = {}
+        for i in range(0, len(txs), self.options.batchsize):
+            batch = txs[i:i + self.options.batchsize]
+            requests = [node.sendrawtransaction.get_request(tx.serialize().hex())
+                        for tx in batch]
+            start = time.perf_counter()
+            for result in node.batch(requests):
+                assert result['error'] is None, result['error']
+            for tx in batch:
+                sent[tx.txid_hex] = start
+        return sent
+
+    def submit_blocks(self, node, blocks):
+        """Submits the blocks, and returns the time each one was submitted, by
+        block hash."""
+        sent = {}
+        for block in blocks:
+            start = time.perf_counter()
+            assert_equal(node.submitblock(block.serialize().hex()), None)
+            sent[block.hash] = start
+        return sent
+
+    def wait_for_notifications(self, receiver, expected):
+        """Waits until the expected number of notifications is received, or
+        none is received for a while, as they can be lost."""
+        count = receiver.count()
+        last_change = time.time()
+        while count < expected and time.time() - last_change < 5 * self.options.timeout_factor:
+            time.sleep(0.05)
+            if receiver.count() != count:
+                count = receiver.count()
+                last_change = time.time()
+
+
+if __name__ == '__main__':
+    NotificationsBench().main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark the P2PConnection receive path.
+
+A local server floods a P2PConnection with messages over a loopback
+connection, and the number of messages per second the connection parses and
+deserializes is reported. No node is involved, so this only measures the test
+framework side.
+
+This is not a functional test and is not run by test_runner.py."""
+
+import argparse
+import asyncio
+import threading
+import time
+
+from test_framework.messages import CInv, MSG_TX, msg_inv, msg_ping
+from test_framework.p2p import MAGIC_BYTES, NetworkThread, P2PConnection
+from test_framework.util import wait_until_helper
+
+MESSAGES = {
+    "ping": lambda i: msg_ping(nonce=i),
+    "inv": lambda i: msg_inv([CInv(MSG_TX, i * 1000 + j) for j in range(10)]),
+    "biginv": lambda i: msg_inv(
+        [CInv(MSG_TX, i * 50000 + j) for j in range(50000)]),
+}
+
+
+class FloodServer(asyncio.Protocol):
+    """Writes the payload to every connection, in pieces of chunk_size."""
+
+    def __init__(self, payload, chunk_size):
+        self.payload = payload
+        self.chunk_size = chunk_size
+
+    def connection_made(self, transport):
+        for i in range(0, len(self.payload), self.chunk_size):
+            transport.write(self.payload[i:i + self.chunk_size])
+
+
+class CountingConnection(P2PConnection):
+    def __init__(self):
+        super().__init__()
+        self.received = 0
+        self.done = threading.Event()
+        self.expected = 0
+
+    def on_open(self):
+        pass
+
+    def on_close(self):
+        pass
+
+    def on_message(self, message):
+        self.received += 1
+        if self.received == self.expected:
+            self.done.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--msgtype', choices=sorted(MESSAGES), default='inv',
+                        help='the type of message to flood (default: %(default)s)')
+    parser.add_argument('--messages', type=int, default=50000,
+                        help='number of messages to send (default: %(default)s)')
+    parser.add_argument('--chunksize', type=int, default=64 * 1024,
+                        help='size of the writes of the server, in bytes (default: %(default)s)')
+    parser.add_argument('--noverifychecksum', action='store_true',
+                        help='skip the checksum verification of the received messages')
+    args = parser.parse_args()
+
+    network_thread = NetworkThread()
+    network_thread.start()
+    loop = NetworkThread.network_event_loop
+
+    conn = CountingConnection()
+    build = MESSAGES[args.msgtype]
+    # build_message only needs the magic bytes
+    conn.magic_bytes = MAGIC_BYTES["regtest"]
+    payload = b"".join(conn.build_message(build(i))
+                       for i in range(args.messages))
+    conn.expected = args.messages
+
+    server = asyncio.run_coroutine_threadsafe(
+        loop.create_server(
+            lambda: FloodServer(payload, args.chunksize), '127.0.0.1', 0),
+        loop).result()
+    port = server.sockets[0].getsockname()[1]
+
+    start = time.time()
+    conn.peer_connect('127.0.0.1', port, net="regtest", timeout_factor=1,
+                      verify_checksum=not args.noverifychecksum)()
+    conn.done.wait()
+    elapsed = time.time() - start
+
+    print("Received {} {} messages ({} bytes) in {:.3f}s: {:.0f} msg/s, {:.1f} MB/s".format(
+        conn.received, args.msgtype, len(payload), elapsed,
+        conn.received / elapsed, len(payload) / elapsed / 1e6))
+
+    conn.peer_disconnect()
+    wait_until_helper(lambda: not conn.is_connected, timeout=10)
+    server.close()
+    network_thread.close()
+
+
+if __name__ == '__main__':
+    main()
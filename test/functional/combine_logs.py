@@ -12,12 +12,14 @@ If no argument is provided, the most recent test directory will be used."""
 import argparse
 import heapq
 import itertools
+import mmap
 import os
 import pathlib
 import re
 import sys
 import tempfile
-from collections import defaultdict, namedtuple
+from collections import defaultdict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
 # N.B.: don't import any local modules here - this script must remain executable
 # without the parent module installed.
@@ -29,8 +31,29 @@ TMPDIR_PREFIX = "bitcoin_func_test_"
 TIMESTAMP_PATTERN = re.compile(
     r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{6})?Z")
 
+# Matches the line breaks that precede a new log event. Starting the pattern
+# with a literal character makes the regex engine skip quickly to the
+# candidate positions.
+EVENT_SPLIT_PATTERN = re.compile(
+    r"\n(?=\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d{6})?Z)")
+
+# Same pattern, used to find event boundaries in the raw (mmap'ed) log files
+TIMESTAMP_PATTERN_BYTES = re.compile(
+    rb"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{6})?Z")
+
+# Log files are split at event boundaries into chunks of roughly this size,
+# which are then parsed in parallel
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# Number of chunks per log file that are being parsed ahead of the merge
+PREFETCH_CHUNKS = 4
+
 LogEvent = namedtuple('LogEvent', ['timestamp', 'source', 'event'])
 
+# Filters applied by the readers. since and until are (possibly truncated)
+# ISO 8601 timestamps, pattern is a regular expression searched in the event.
+LogFilter = namedtuple('LogFilter', ['since', 'until', 'pattern'])
+
 
 def main():
     """Main function. Parses args, reads the log files and renders them as text or html."""
@@ -47,6 +70,26 @@ def main():
     parser.add_argument('--html', dest='html', action='store_true',
                         help='outputs the combined log as html. '
                              'Requires jinja2. pip install jinja2')
+    parser.add_argument('--since', dest='since', default=None,
+                        help='only output events logged at or after this '
+                             'timestamp, e.g. 2021-03-01T12:30 (UTC)')
+    parser.add_argument('--until', dest='until', default=None,
+                        help='only output events logged at or before this '
+                             'timestamp. A truncated timestamp includes the '
+                             'whole period, e.g. 2021-03-01T12:30 includes '
+                             'the full minute')
+    parser.add_argument('--sources', dest='sources', default=None,
+                        help='comma separated list of log sources to '
+                             'combine, e.g. test,node0. Defaults to all')
+    parser.add_argument('--grep', dest='pattern', default=None,
+                        help='only output events matching this regular '
+                             'expression, e.g. a thread name such as '
+                             '"\\[msghand\\]" or a test logger such as '
+                             '"TestFramework.p2p"')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int,
+                        default=os.cpu_count() or 1,
+                        help='number of processes used to parse the log '
+                             'files. Defaults to the number of cpus')
     args = parser.parse_args()
 
     if args.html and args.color:
@@ -72,20 +115,34 @@ def main():
         colors["node3"] = "\033[0;33m"  # YELLOW
         colors["reset"] = "\033[0m"  # Reset font color
 
-    log_events = read_logs(testdir)
+    sources = args.sources.split(',') if args.sources else None
+    log_filter = LogFilter(since=args.since, until=args.until,
+                           pattern=args.pattern)
 
-    if args.html:
-        print_logs_html(log_events)
-    else:
-        print_logs_plain(log_events, colors)
-        print_node_warnings(testdir, colors)
+    executor = ProcessPoolExecutor(args.jobs) if args.jobs > 1 else None
+    try:
+        log_events = read_logs(testdir, sources, log_filter, executor)
 
+        if args.html:
+            print_logs_html(log_events)
+        else:
+            print_logs_plain(log_events, colors)
+            print_node_warnings(testdir, colors)
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
-def read_logs(tmp_dir):
+
+def read_logs(tmp_dir, sources=None, log_filter=None, executor=None):
     """Reads log files.
 
     Delegates to generator function get_log_events() to provide individual log events
-    for each of the input log files."""
+    for each of the input log files. The events are merged lazily, so only the
+    chunks being parsed ahead are held in memory.
+
+    Files whose source is not in sources are not read at all."""
+    if log_filter is None:
+        log_filter = LogFilter(since=None, until=None, pattern=None)
 
     # Find out what the folder is called that holds the debug.log file
     glob = pathlib.Path(tmp_dir).glob('node0/**/debug.log')
@@ -107,7 +164,11 @@ def read_logs(tmp_dir):
             break
         files.append(("node{}".format(i), logfile))
 
-    return heapq.merge(*[get_log_events(source, f) for source, f in files])
+    if sources is not None:
+        files = [(source, f) for source, f in files if source in sources]
+
+    return heapq.merge(*[get_log_events(source, f, log_filter, executor)
+                         for source, f in files])
 
 
 def print_node_warnings(tmp_dir, colors):
@@ -154,43 +215,155 @@ def find_latest_test_dir():
     return max(testdir_paths, key=os.path.getmtime) if testdir_paths else None
 
 
-def get_log_events(source, logfile):
+def get_log_events(source, logfile, log_filter=None, executor=None):
     """Generator function that returns individual log events.
 
-    Log events may be split over multiple lines. We use the timestamp
-    regex match as the marker for a new log event."""
+    The file is split into chunks at event boundaries, restricted to the
+    requested time range, and the chunks are parsed by the executor (or
+    inline if there is none). Chunks are yielded in file order."""
+    if log_filter is None:
+        log_filter = LogFilter(since=None, until=None, pattern=None)
     try:
-        with open(logfile, 'r', encoding='utf-8') as infile:
-            event = ''
-            timestamp = ''
-            for line in infile:
-                # skip blank lines
-                if line == '\n':
-                    continue
-                # if this line has a timestamp, it's the start of a new log
-                # event.
-                time_match = TIMESTAMP_PATTERN.match(line)
-                if time_match:
-                    if event:
-                        yield LogEvent(timestamp=timestamp, source=source, event=event.rstrip())
-                    timestamp = time_match.group()
-                    if time_match.group(1) is None:
-                        # timestamp does not have microseconds. Add zeroes.
-                        timestamp_micro = timestamp.replace("Z", ".000000Z")
-                        line = line.replace(timestamp, timestamp_micro)
-                        timestamp = timestamp_micro
-                    event = line
-                # if it doesn't have a timestamp, it's a continuation line of
-                # the previous log.
-                else:
-                    # Add the line. Prefix with space equivalent to the source
-                    # + timestamp so log lines are aligned
-                    event += "                                   " + line
-            # Flush the final event
-            yield LogEvent(timestamp=timestamp, source=source, event=event.rstrip())
+        chunks = split_log(logfile, log_filter.since, log_filter.until)
     except FileNotFoundError:
         print("File {} could not be opened. Continuing without it.".format(
             logfile), file=sys.stderr)
+        return
+
+    if executor is None:
+        for start, end in chunks:
+            yield from parse_log_chunk(source, logfile, start, end,
+                                       log_filter)
+        return
+
+    pending = deque()
+    for start, end in chunks:
+        pending.append(executor.submit(parse_log_chunk, source, logfile,
+                                       start, end, log_filter))
+        if len(pending) >= PREFETCH_CHUNKS:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+def next_event_offset(buf, offset):
+    """Returns the offset of the first log event starting at or after offset.
+
+    Log events may be split over multiple lines. We use the timestamp regex
+    match at the start of a line as the marker for a new log event. Returns
+    len(buf) if there is no such event."""
+    if offset <= 0:
+        return 0
+    size = len(buf)
+    # Start looking from the beginning of the line containing offset
+    pos = buf.rfind(b'\n', 0, offset) + 1
+    while pos < size:
+        if pos >= offset and TIMESTAMP_PATTERN_BYTES.match(buf, pos):
+            return pos
+        newline = buf.find(b'\n', pos)
+        if newline == -1:
+            break
+        pos = newline + 1
+    return size
+
+
+def event_timestamp(buf, offset):
+    """Returns the timestamp of the event starting at offset, or None if there
+    is no timestamp there (only possible at the start of the file)."""
+    time_match = TIMESTAMP_PATTERN_BYTES.match(buf, offset)
+    return time_match.group().decode() if time_match else None
+
+
+def bisect_log(buf, predicate):
+    """Returns the offset of the first event whose timestamp satisfies the
+    predicate, assuming the events are ordered by timestamp."""
+    size = len(buf)
+    lo, hi = 0, size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        pos = next_event_offset(buf, mid)
+        if pos >= size:
+            hi = mid
+            continue
+        timestamp = event_timestamp(buf, pos)
+        if timestamp is not None and predicate(timestamp):
+            hi = mid
+        else:
+            lo = mid + 1
+    return next_event_offset(buf, lo)
+
+
+def split_log(logfile, since=None, until=None, chunk_size=CHUNK_SIZE):
+    """Returns the (start, end) offsets of the chunks of logfile that hold
+    the events between since and until.
+
+    Every chunk starts on an event boundary, so the chunks can be parsed
+    independently."""
+    with open(logfile, 'rb') as infile:
+        size = os.fstat(infile.fileno()).st_size
+        if size == 0:
+            return []
+        with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            start, end = 0, size
+            if since:
+                start = bisect_log(buf, lambda ts: ts >= since)
+            if until:
+                end = bisect_log(buf, lambda ts: ts[:len(until)] > until)
+            chunks = []
+            while start < end:
+                chunk_end = min(
+                    next_event_offset(buf, start + chunk_size), end)
+                chunks.append((start, chunk_end))
+                start = chunk_end
+            return chunks
+
+
+def parse_log_chunk(source, logfile, start, end, log_filter):
+    """Parses the log events found in logfile between the start and end
+    offsets, and returns the ones that pass the filter."""
+    with open(logfile, 'rb') as infile:
+        with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            text = buf[start:end].decode('utf-8', errors='replace')
+
+    since, until = log_filter.since, log_filter.until
+    pattern = re.compile(log_filter.pattern) if log_filter.pattern else None
+    filtered = since or until or pattern
+
+    events = []
+    segments = EVENT_SPLIT_PATTERN.split(text)
+    # Every segment but the first one is known to start with a timestamp
+    first_match = TIMESTAMP_PATTERN.match(segments[0])
+    for i, segment in enumerate(segments):
+        event = segment.rstrip()
+        if not event:
+            continue
+        if '\n' in event:
+            # Log events may be split over multiple lines: prefix the
+            # continuation lines with space equivalent to the source +
+            # timestamp so log lines are aligned, and skip blank lines.
+            lines = event.splitlines(keepends=True)
+            event = lines[0] + ''.join(
+                "                                   " + line
+                for line in lines[1:] if line != '\n')
+
+        if i == 0 and not first_match:
+            timestamp = ''
+        elif event[19] == '.':
+            timestamp = event[:27]
+        else:
+            # timestamp does not have microseconds. Add zeroes.
+            timestamp = event[:19] + ".000000Z"
+            event = timestamp + event[20:]
+
+        if filtered:
+            if since and timestamp < since:
+                continue
+            if until and timestamp[:len(until)] > until:
+                continue
+            if pattern and not pattern.search(event):
+                continue
+        events.append(LogEvent(timestamp, source, event))
+    return events
 
 
 def print_logs_plain(log_events, colors):
@@ -213,10 +386,15 @@ def print_logs_html(log_events):
     except ImportError:
         print("jinja2 not found. Try `pip install jinja2`")
         sys.exit(1)
-    print(jinja2.Environment(loader=jinja2.FileSystemLoader('./'))
-                .get_template('combined_log_template.html')
-                .render(title="Combined Logs from testcase",
-                        log_events=[event._asdict() for event in log_events]))
+    # Stream the rendered template so the whole document is never held in
+    # memory
+    template = jinja2.Environment(loader=jinja2.FileSystemLoader('./')) \
+        .get_template('combined_log_template.html')
+    for fragment in template.generate(
+            title="Combined Logs from testcase",
+            log_events=(event._asdict() for event in log_events)):
+        sys.stdout.write(fragment)
+    sys.stdout.write('\n')
 
 
 if __name__ == '__main__':
@@ -10,6 +10,7 @@ import asyncio
 from test_framework.blocktools import create_block, create_coinbase, prepare_block, SUBSIDY
 from test_framework.test_framework import BitcoinTestFramework
 from test_framework.messages import CTransaction, CTxIn, COutPoint, CTxOut, COIN, CBlockHeader
+from test_framework.nng import NngError, NngRpcClient, NngSubscriber, fb_bytes, fb_hash
 from test_framework.script import CScript, OP_HASH160, OP_EQUAL
 from test_framework.txtools import pad_tx
 from test_framework.util import assert_equal
@@ -19,12 +20,6 @@ RPC_URL = "tcp://127.0.0.1:52783"
 PUB_URL = "tcp://127.0.0.1:52784"
 
 
-def get_fb_bytes(obj, name):
-    get_item = getattr(obj, name)
-    get_length = getattr(obj, f'{name}Length')
-    return bytes(get_item(i) for i in range(get_length()))
-
-
 class NngInterfaceTest(BitcoinTestFramework):
     NUM_GENERATED_COINS = 10
     TIMESTAMP = 1630000000
@@ -60,154 +55,32 @@ class NngInterfaceTest(BitcoinTestFramework):
         asyncio.get_event_loop().run_until_complete(self._nng_test())
 
     async def _nng_test(self):
-        import pynng, flatbuffers
-
         node = self.nodes[0]
         node.setmocktime(self.TIMESTAMP)
-        with pynng.Req0() as rpc_sock:
-            rpc_sock.dial(RPC_URL)
-            await self._test_genesis(node, rpc_sock)
-            await self._test_get_block_errors(rpc_sock)
-            await self._test_get_block_slice_errors(rpc_sock)
-            await self._test_send_tx(node, rpc_sock)
-            await self._test_get_block_range(node, rpc_sock)
-        with pynng.Sub0() as pub_sock:
-            pub_sock.dial(PUB_URL)
-            await self._test_update_chain_tip(node, pub_sock)
-            await self._test_transaction_added_to_mempool(node, pub_sock)
-            await self._test_transaction_removed_from_mempool_conflict(node, pub_sock)
-            await self._test_transaction_removed_from_mempool_expiry(node, pub_sock)
-            await self._test_block_connected(node, pub_sock)
-            await self._test_block_disconnected(node, pub_sock)
-            await self._test_chain_state_flushed(node, pub_sock)
+        with NngRpcClient(RPC_URL, timeout=1) as rpc:
+            await self._test_genesis(node, rpc)
+            await self._test_get_block_errors(rpc)
+            await self._test_get_block_slice_errors(rpc)
+            await self._test_send_tx(node, rpc)
+            await self._test_get_block_range(node, rpc)
+            await self._test_pipelined_requests(node, rpc)
+        with NngSubscriber(PUB_URL) as sub:
+            await self._test_update_chain_tip(node, sub)
+            await self._test_transaction_added_to_mempool(node, sub)
+            await self._test_transaction_removed_from_mempool_conflict(node, sub)
+            await self._test_transaction_removed_from_mempool_expiry(node, sub)
+            await self._test_block_connected(node, sub)
+            await self._test_block_disconnected(node, sub)
+            await self._test_chain_state_flushed(node, sub)
         self._test_invalid_params(node)
 
-    def _make_get_block_request_fbb(self, *, height=None, blockhash=None):
-        from NngInterface import (
-            RpcCall,
-            RpcRequest,
-            GetBlockRequest,
-            BlockIdentifier,
-            BlockHeight,
-            BlockHash,
-            Hash,
-        )
-        import flatbuffers
-        fbb = flatbuffers.Builder()
-        if height is not None:
-            BlockHeight.Start(fbb)
-            BlockHeight.AddHeight(fbb, height)
-            block_height = BlockHeight.End(fbb)
-            GetBlockRequest.Start(fbb)
-            GetBlockRequest.AddBlockIdType(fbb, BlockIdentifier.BlockIdentifier.Height)
-            GetBlockRequest.AddBlockId(fbb, block_height)
-        else:
-            BlockHash.Start(fbb)
-            BlockHash.AddHash(fbb, Hash.CreateHash(fbb, blockhash))
-            block_hash = BlockHash.End(fbb)
-            GetBlockRequest.Start(fbb)
-            GetBlockRequest.AddBlockIdType(fbb, BlockIdentifier.BlockIdentifier.Hash)
-            GetBlockRequest.AddBlockId(fbb, block_hash)
-        get_block_request = GetBlockRequest.End(fbb)
-        RpcCall.Start(fbb)
-        RpcCall.AddRpcType(fbb, RpcRequest.RpcRequest.GetBlockRequest)
-        RpcCall.AddRpc(fbb, get_block_request)
-        rpc = RpcCall.End(fbb)
-        fbb.Finish(rpc)
-        return bytes(fbb.Output())
-
-    def _make_get_block_range_request_fbb(self, start_height, num_blocks):
-        from NngInterface import (
-            RpcCall,
-            RpcRequest,
-            GetBlockRangeRequest,
-            BlockIdentifier,
-            BlockHeight,
-            BlockHash,
-        )
-        import flatbuffers
-        fbb = flatbuffers.Builder()
-        GetBlockRangeRequest.Start(fbb)
-        GetBlockRangeRequest.AddStartHeight(fbb, start_height)
-        GetBlockRangeRequest.AddNumBlocks(fbb, num_blocks)
-        get_block_request = GetBlockRangeRequest.End(fbb)
-        RpcCall.Start(fbb)
-        RpcCall.AddRpcType(fbb, RpcRequest.RpcRequest.GetBlockRangeRequest)
-        RpcCall.AddRpc(fbb, get_block_request)
-        rpc = RpcCall.RpcCallEnd(fbb)
-        fbb.Finish(rpc)
-        return bytes(fbb.Output())
-
-    def _make_get_block_slice_request_fbb(self, file_num, data_pos, num_bytes):
-        from NngInterface import (
-            RpcCall,
-            RpcRequest,
-            GetBlockSliceRequest,
-        )
-        import flatbuffers
-        fbb = flatbuffers.Builder()
-        GetBlockSliceRequest.Start(fbb)
-        GetBlockSliceRequest.AddFileNum(fbb, file_num)
-        GetBlockSliceRequest.AddDataPos(fbb, data_pos)
-        GetBlockSliceRequest.AddNumBytes(fbb, num_bytes)
-        get_block_slice_request = GetBlockSliceRequest.End(fbb)
-        RpcCall.Start(fbb)
-        RpcCall.AddRpcType(fbb, RpcRequest.RpcRequest.GetBlockSliceRequest)
-        RpcCall.AddRpc(fbb, get_block_slice_request)
-        rpc = RpcCall.End(fbb)
-        fbb.Finish(rpc)
-        return bytes(fbb.Output())
-
-    def _make_get_undo_slice_request_fbb(self, file_num, undo_pos, num_bytes):
-        from NngInterface import (
-            RpcCall,
-            RpcRequest,
-            GetUndoSliceRequest,
-        )
-        import flatbuffers
-        fbb = flatbuffers.Builder()
-        GetUndoSliceRequest.Start(fbb)
-        GetUndoSliceRequest.AddFileNum(fbb, file_num)
-        GetUndoSliceRequest.AddUndoPos(fbb, undo_pos)
-        GetUndoSliceRequest.AddNumBytes(fbb, num_bytes)
-        get_undo_slice_request = GetUndoSliceRequest.End(fbb)
-        RpcCall.Start(fbb)
-        RpcCall.AddRpcType(fbb, RpcRequest.RpcRequest.GetUndoSliceRequest)
-        RpcCall.AddRpc(fbb, get_undo_slice_request)
-        rpc = RpcCall.End(fbb)
-        fbb.Finish(rpc)
-        return bytes(fbb.Output())
-
-    def _make_get_mempool_request_fbs(self):
-        from NngInterface import (
-            RpcCall,
-            RpcRequest,
-            GetMempoolRequest,
-        )
-        import flatbuffers
-        fbb = flatbuffers.Builder()
-        GetMempoolRequest.Start(fbb)
-        get_mempool_request = GetMempoolRequest.End(fbb)
-        RpcCall.Start(fbb)
-        RpcCall.AddRpcType(fbb, RpcRequest.RpcRequest.GetMempoolRequest)
-        RpcCall.AddRpc(fbb, get_mempool_request)
-        rpc = RpcCall.End(fbb)
-        fbb.Finish(rpc)
-        return bytes(fbb.Output())
-
-    async def _send_request(self, rpc_sock, request, *, timeout=1):
-        await asyncio.wait_for(rpc_sock.asend(request), timeout=timeout)
-
-    async def _recv_response(self, rpc_sock, *, expect_error=None, timeout=1):
-        from NngInterface import RpcResult
-        response_msg = await asyncio.wait_for(rpc_sock.arecv_msg(), timeout=timeout)
-        result = RpcResult.RpcResult.GetRootAs(response_msg.bytes, 0)
-        if expect_error is not None:
-            assert not result.IsSuccess()
-            assert_equal(result.ErrorMsg().decode(), expect_error)
+    async def _assert_nng_error(self, request, expected_error):
+        try:
+            await request
+        except NngError as e:
+            assert_equal(e.message, expected_error)
         else:
-            assert result.IsSuccess(), f"Unexpected error: {result.ErrorMsg().decode()}"
-            return get_fb_bytes(result, 'Data')
+            raise AssertionError("No NNG error")
 
     def _get_utxo(self, node):
         blockhash = self.coin_blocks.pop(0)
@@ -225,24 +98,15 @@ class NngInterfaceTest(BitcoinTestFramework):
         return create_block(
             int(bestblock['hash'], 16), coinbase, new_height, bestblock['time'] + 1)
 
-    async def _check_block_slice(self, rpc_sock, block_file_num, tx_data_pos, tx_raw):
-        from NngInterface import GetBlockSliceResponse
-        await self._send_request(
-            rpc_sock, self._make_get_block_slice_request_fbb(block_file_num, tx_data_pos, len(tx_raw)))
-        response = await self._recv_response(rpc_sock)
-        response = GetBlockSliceResponse.GetBlockSliceResponse.GetRootAs(response, 0)
-        assert_equal(get_fb_bytes(response, 'Data').hex(), tx_raw.hex())
-
-    async def _check_undo_slice(self, rpc_sock, block_file_num, tx_undo_pos, coins_raw):
-        from NngInterface import GetUndoSliceResponse
-        await self._send_request(
-            rpc_sock, self._make_get_undo_slice_request_fbb(block_file_num, tx_undo_pos, len(coins_raw)))
-        response = await self._recv_response(rpc_sock)
-        response = GetUndoSliceResponse.GetUndoSliceResponse.GetRootAs(response, 0)
-        assert_equal(get_fb_bytes(response, 'Data').hex(), coins_raw.hex())
-
-    async def _test_genesis(self, node, rpc_sock):
-        from NngInterface import GetBlockResponse
+    async def _check_block_slice(self, rpc, block_file_num, tx_data_pos, tx_raw):
+        response = await rpc.get_block_slice(block_file_num, tx_data_pos, len(tx_raw))
+        assert_equal(fb_bytes(response, 'Data').hex(), tx_raw.hex())
+
+    async def _check_undo_slice(self, rpc, block_file_num, tx_undo_pos, coins_raw):
+        response = await rpc.get_undo_slice(block_file_num, tx_undo_pos, len(coins_raw))
+        assert_equal(fb_bytes(response, 'Data').hex(), coins_raw.hex())
+
+    async def _test_genesis(self, node, rpc):
         # Assert genesis block matches RPC's
         rpc_genesis_blockhash = node.getblockhash(0)
         rpc_genesis_block = node.getblock(rpc_genesis_blockhash, 2)
@@ -250,78 +114,64 @@ class NngInterfaceTest(BitcoinTestFramework):
         # Test for using both height and blockhash as reference
         for params in [{'height': 0}, {'blockhash': bytes.fromhex(rpc_genesis_blockhash)[::-1]}]:
             # Test GetBlock
-            await self._send_request(rpc_sock, self._make_get_block_request_fbb(**params))
-            response = await self._recv_response(rpc_sock)
-            response = GetBlockResponse.GetBlockResponse.GetRootAs(response, 0)
+            response = await rpc.get_block(**params)
             block = response.Block()
             block_header = block.Header()
             header = CBlockHeader()
-            header.deserialize(BytesIO(get_fb_bytes(block_header, 'Raw')))
+            header.deserialize(BytesIO(fb_bytes(block_header, 'Raw')))
             header.rehash()
             assert_equal(header.hash, rpc_genesis_blockhash)
-            assert_equal(bytes(block_header.PrevBlockHash().Hash().Data())[::-1].hex(), '0'*64)
-            assert_equal(bytes(block_header.BlockHash().Hash().Data())[::-1].hex(), rpc_genesis_blockhash)
+            assert_equal(fb_hash(block_header.PrevBlockHash().Hash())[::-1].hex(), '0'*64)
+            assert_equal(fb_hash(block_header.BlockHash().Hash())[::-1].hex(), rpc_genesis_blockhash)
             assert_equal(block_header.Timestamp(), rpc_genesis_block['time'])
             assert_equal('%08x' % block_header.NBits(), rpc_genesis_block['bits'])
             assert_equal(block.MetadataLength(), 0)
             assert_equal(block.TxsLength(), 1)
             block_tx = block.Txs(0)
-            tx_raw = get_fb_bytes(block_tx.Tx(), 'Raw')
+            tx_raw = fb_bytes(block_tx.Tx(), 'Raw')
             assert_equal(tx_raw.hex(), rpc_genesis_block['tx'][0]['hex'])
-            assert_equal(bytes(block_tx.Tx().Txid().Hash().Data())[::-1].hex(),
+            assert_equal(fb_hash(block_tx.Tx().Txid().Hash())[::-1].hex(),
                          rpc_genesis_block['tx'][0]['txid'])
             assert_equal(block.FileNum(), 0)
             assert_equal(block.DataPos(), 8)
             assert_equal(block_tx.DataPos(), 170)
             assert_equal(block_tx.UndoPos(), 0)
             assert_equal(block_tx.Tx().SpentCoinsLength(), 0)
-            await self._check_block_slice(rpc_sock, block.FileNum(), block_tx.DataPos(), tx_raw)
+            await self._check_block_slice(rpc, block.FileNum(), block_tx.DataPos(), tx_raw)
 
-    async def _test_get_block_errors(self, rpc_sock):
+    async def _test_get_block_errors(self, rpc):
         # Clean chain -> block 1 doesn't exist
-        await self._send_request(rpc_sock, self._make_get_block_request_fbb(height=1))
-        await self._recv_response(rpc_sock, expect_error='Block not found')
+        await self._assert_nng_error(rpc.get_block(height=1), 'Block not found')
         # blockhash doesn't exist
-        await self._send_request(rpc_sock, self._make_get_block_request_fbb(blockhash=bytes(32)))
-        await self._recv_response(rpc_sock, expect_error='Block not found')
+        await self._assert_nng_error(rpc.get_block(blockhash=bytes(32)), 'Block not found')
         # invalid fb
-        await self._send_request(rpc_sock, bytes(31))
-        await self._recv_response(rpc_sock, expect_error='Invalid flatbuffer encoding')
+        await self._assert_nng_error(rpc.request(bytes(31)), 'Invalid flatbuffer encoding')
 
-    async def _test_get_block_slice_errors(self, rpc_sock):
+    async def _test_get_block_slice_errors(self, rpc):
         # file_num doesn't exist
-        await self._send_request(rpc_sock, self._make_get_block_slice_request_fbb(1, 0, 10))
-        await self._recv_response(rpc_sock, expect_error='Invalid block slice')
+        await self._assert_nng_error(rpc.get_block_slice(1, 0, 10), 'Invalid block slice')
         # data_pos out of bounds
-        await self._send_request(rpc_sock, self._make_get_block_slice_request_fbb(1, 1000, 10))
-        await self._recv_response(rpc_sock, expect_error='Invalid block slice')
+        await self._assert_nng_error(rpc.get_block_slice(1, 1000, 10), 'Invalid block slice')
         # num_bytes too long
-        await self._send_request(rpc_sock, self._make_get_block_slice_request_fbb(1, 0, 1000))
-        await self._recv_response(rpc_sock, expect_error='Invalid block slice')
+        await self._assert_nng_error(rpc.get_block_slice(1, 0, 1000), 'Invalid block slice')
 
-    async def _test_send_tx(self, node, rpc_sock):
-        from NngInterface import (
-            GetBlockResponse,
-            GetMempoolResponse,
-        )
+    async def _test_send_tx(self, node, rpc):
         # Generate block and query it
         hashes = node.generatetoaddress(self.NUM_GENERATED_COINS, self.anyone_addr)
         self.coin_blocks = hashes[1:]
         blockhash = bytes.fromhex(hashes[0])[::-1]
 
-        await self._send_request(rpc_sock, self._make_get_block_request_fbb(blockhash=blockhash))
-        response = await self._recv_response(rpc_sock)
-        response = GetBlockResponse.GetBlockResponse.GetRootAs(response, 0)
+        response = await rpc.get_block(blockhash=blockhash)
         block = response.Block()
         header = CBlockHeader()
-        header.deserialize(BytesIO(get_fb_bytes(block.Header(), 'Raw')))
+        header.deserialize(BytesIO(fb_bytes(block.Header(), 'Raw')))
         header.rehash()
         assert_equal(header.hash, blockhash[::-1].hex())
-        assert_equal(bytes(block.Header().BlockHash().Hash().Data())[::-1].hex(),
+        assert_equal(fb_hash(block.Header().BlockHash().Hash())[::-1].hex(),
                      blockhash[::-1].hex())
         assert_equal(block.MetadataLength(), 0)
         assert_equal(block.TxsLength(), 1)
-        tx_raw = get_fb_bytes(block.Txs(0).Tx(), 'Raw')
+        tx_raw = fb_bytes(block.Txs(0).Tx(), 'Raw')
         coinbase_tx = CTransaction()
         coinbase_tx.deserialize(BytesIO(tx_raw))
         coinbase_tx.rehash()
@@ -329,7 +179,7 @@ class NngInterfaceTest(BitcoinTestFramework):
         assert_equal(block.Txs(0).DataPos(), 557)
         assert_equal(block.Txs(0).UndoPos(), 0)
         assert_equal(block.Txs(0).UndoSize(), 0)
-        await self._check_block_slice(rpc_sock, block.FileNum(), block.Txs(0).DataPos(), tx_raw)
+        await self._check_block_slice(rpc, block.FileNum(), block.Txs(0).DataPos(), tx_raw)
 
         # Mature coinbase tx
         node.generatetoaddress(100, self.burn_addr)
@@ -344,24 +194,20 @@ class NngInterfaceTest(BitcoinTestFramework):
 
         # Query mempool -> is empty
         assert_equal(node.getrawmempool(), [])
-        await self._send_request(rpc_sock, self._make_get_mempool_request_fbs())
-        response = await self._recv_response(rpc_sock)
-        response = GetMempoolResponse.GetMempoolResponse.GetRootAs(response, 0)
+        response = await rpc.get_mempool()
         assert_equal(response.TxsLength(), 0)
 
         # Broadcast tx
         node.sendrawtransaction(tx.serialize().hex())
         # Mempool now has tx
         assert_equal(node.getrawmempool(), [tx.txid_hex])
-        await self._send_request(rpc_sock, self._make_get_mempool_request_fbs())
-        response = await self._recv_response(rpc_sock)
-        response = GetMempoolResponse.GetMempoolResponse.GetRootAs(response, 0)
+        response = await rpc.get_mempool()
         assert_equal(response.TxsLength(), 1)
-        assert_equal(get_fb_bytes(response.Txs(0).Tx(), 'Raw').hex(), tx.serialize().hex())
+        assert_equal(fb_bytes(response.Txs(0).Tx(), 'Raw').hex(), tx.serialize().hex())
         assert_equal(response.Txs(0).Tx().SpentCoinsLength(), 1)
         spent_coin = response.Txs(0).Tx().SpentCoins(0)
         assert_equal(spent_coin.TxOut().Amount(), coinbase_value)
-        assert_equal(get_fb_bytes(spent_coin.TxOut(), 'Script').hex(), self.anyone_script)
+        assert_equal(fb_bytes(spent_coin.TxOut(), 'Script').hex(), self.anyone_script)
         assert_equal(spent_coin.IsCoinbase(), True)
         assert_equal(spent_coin.Height(), 1)
         assert_equal(response.Txs(0).Time(), self.TIMESTAMP)
@@ -378,20 +224,18 @@ class NngInterfaceTest(BitcoinTestFramework):
             other_tx.rehash()
         node.sendrawtransaction(other_tx.serialize().hex())
 
-        await self._send_request(rpc_sock, self._make_get_mempool_request_fbs())
-        response = await self._recv_response(rpc_sock)
-        response = GetMempoolResponse.GetMempoolResponse.GetRootAs(response, 0)
+        response = await rpc.get_mempool()
         assert_equal(response.TxsLength(), 2)
         other_tx_fbb = [
             response.Txs(i)
             for i in range(0, 2)
-            if bytes(response.Txs(i).Tx().Txid().Hash().Data()[::-1]).hex() == other_tx.txid_hex
+            if fb_hash(response.Txs(i).Tx().Txid().Hash())[::-1].hex() == other_tx.txid_hex
         ][0]
-        assert_equal(get_fb_bytes(other_tx_fbb.Tx(), 'Raw').hex(), other_tx.serialize().hex())
+        assert_equal(fb_bytes(other_tx_fbb.Tx(), 'Raw').hex(), other_tx.serialize().hex())
         assert_equal(other_tx_fbb.Tx().SpentCoinsLength(), 1)
         spent_coin = other_tx_fbb.Tx().SpentCoins(0)
         assert_equal(spent_coin.TxOut().Amount(), coinbase_value - 1000)
-        assert_equal(get_fb_bytes(spent_coin.TxOut(), 'Script').hex(), self.anyone_script2)
+        assert_equal(fb_bytes(spent_coin.TxOut(), 'Script').hex(), self.anyone_script2)
         assert_equal(spent_coin.IsCoinbase(), False)
         assert_equal(spent_coin.Height(), -1)
         assert_equal(other_tx_fbb.Time(), self.TIMESTAMP)
@@ -400,18 +244,14 @@ class NngInterfaceTest(BitcoinTestFramework):
         hashes = node.generatetoaddress(1, self.burn_addr)
         # Mempool empty again
         assert_equal(node.getrawmempool(), [])
-        await self._send_request(rpc_sock, self._make_get_mempool_request_fbs())
-        response = await self._recv_response(rpc_sock)
-        response = GetMempoolResponse.GetMempoolResponse.GetRootAs(response, 0)
+        response = await rpc.get_mempool()
         assert_equal(response.TxsLength(), 0)
 
         # Block contains tx
         blockhash = bytes.fromhex(hashes[0])[::-1]
-        await self._send_request(rpc_sock, self._make_get_block_request_fbb(blockhash=blockhash))
-        response = await self._recv_response(rpc_sock)
-        response = GetBlockResponse.GetBlockResponse.GetRootAs(response, 0)
+        response = await rpc.get_block(blockhash=blockhash)
         block = response.Block()
-        assert_equal(bytes(response.Block().Header().BlockHash().Hash().Data())[::-1].hex(),
+        assert_equal(fb_hash(response.Block().Header().BlockHash().Hash())[::-1].hex(),
                      blockhash[::-1].hex())
         assert_equal(block.MetadataLength(), 0)
         assert_equal(block.TxsLength(), 3)
@@ -426,87 +266,76 @@ class NngInterfaceTest(BitcoinTestFramework):
         assert_equal(block.Txs(2).DataPos(), 31774)
         assert_equal(block.Txs(2).UndoPos(), 4519 + 26)
         assert_equal(block.Txs(2).UndoSize(), 29)
-        tx0_raw = get_fb_bytes(block.Txs(0).Tx(), 'Raw')
-        tx1_raw = get_fb_bytes(block.Txs(1).Tx(), 'Raw')
-        tx2_raw = get_fb_bytes(block.Txs(2).Tx(), 'Raw')
+        tx0_raw = fb_bytes(block.Txs(0).Tx(), 'Raw')
+        tx1_raw = fb_bytes(block.Txs(1).Tx(), 'Raw')
+        tx2_raw = fb_bytes(block.Txs(2).Tx(), 'Raw')
         assert_equal(tx1_raw.hex(), tx.serialize().hex())
-        assert_equal(bytes(block.Txs(1).Tx().Txid().Hash().Data())[::-1].hex(), tx.txid_hex)
+        assert_equal(fb_hash(block.Txs(1).Tx().Txid().Hash())[::-1].hex(), tx.txid_hex)
         assert_equal(tx2_raw.hex(), other_tx.serialize().hex())
-        assert_equal(bytes(block.Txs(2).Tx().Txid().Hash().Data())[::-1].hex(), other_tx.txid_hex)
-        await self._check_block_slice(rpc_sock, block.FileNum(), block.Txs(0).DataPos(), tx0_raw)
-        await self._check_block_slice(rpc_sock, block.FileNum(), block.Txs(1).DataPos(), tx1_raw)
+        assert_equal(fb_hash(block.Txs(2).Tx().Txid().Hash())[::-1].hex(), other_tx.txid_hex)
+        await self._check_block_slice(rpc, block.FileNum(), block.Txs(0).DataPos(), tx0_raw)
+        await self._check_block_slice(rpc, block.FileNum(), block.Txs(1).DataPos(), tx1_raw)
         # encoding: CompactSize(numInputs)
         #           | VarInt(heightAndIsCoinbase)
         #           | dummy byte
         #           | VarInt(CompressAmount(50_000_000_00))
         #           | CompressScript(script)
         undo_data = bytes.fromhex('010300806e01da1745e9b549bd0bfa1a569971c77eba30cd5a4b')
-        await self._check_undo_slice(rpc_sock, block.FileNum(), block.Txs(1).UndoPos(), undo_data)
+        await self._check_undo_slice(rpc, block.FileNum(), block.Txs(1).UndoPos(), undo_data)
         undo_data = bytes.fromhex('01805e00808de81a0169d7ef8f42a25e8791bb37d5fb48456f10')
-        await self._check_undo_slice(rpc_sock, block.FileNum(), block.Txs(2).UndoPos(), undo_data)
+        await self._check_undo_slice(rpc, block.FileNum(), block.Txs(2).UndoPos(), undo_data)
         
         assert_equal(block.Txs(1).Tx().SpentCoinsLength(), 1)
         spent_coin = block.Txs(1).Tx().SpentCoins(0)
         assert_equal(spent_coin.TxOut().Amount(), int(SUBSIDY * COIN))
-        assert_equal(get_fb_bytes(spent_coin.TxOut(), 'Script').hex(), self.anyone_script)
+        assert_equal(fb_bytes(spent_coin.TxOut(), 'Script').hex(), self.anyone_script)
         assert_equal(spent_coin.IsCoinbase(), True)
         assert_equal(spent_coin.Height(), 1)
 
         assert_equal(block.Txs(2).Tx().SpentCoinsLength(), 1)
         spent_coin = block.Txs(2).Tx().SpentCoins(0)
         assert_equal(spent_coin.TxOut().Amount(), int(SUBSIDY * COIN) - 1000)
-        assert_equal(get_fb_bytes(spent_coin.TxOut(), 'Script').hex(), self.anyone_script2)
+        assert_equal(fb_bytes(spent_coin.TxOut(), 'Script').hex(), self.anyone_script2)
         assert_equal(spent_coin.IsCoinbase(), False)
         assert_equal(spent_coin.Height(), 111)
 
-    async def _test_get_block_range(self, node, rpc_sock):
-        from NngInterface import GetBlockRangeResponse
+    async def _test_get_block_range(self, node, rpc):
         for start_height, num_blocks in [(0, 10), (10, 30), (100, 5)]:
-            await self._send_request(rpc_sock, self._make_get_block_range_request_fbb(start_height, num_blocks))
-            response = await self._recv_response(rpc_sock)
-            response = GetBlockRangeResponse.GetBlockRangeResponse.GetRootAs(response, 0)
+            response = await rpc.get_block_range(start_height, num_blocks)
             assert_equal(response.BlocksLength(), num_blocks)
             for idx in range(num_blocks):
                 block_hash = node.getblockhash(start_height + idx)
                 block = response.Blocks(idx)
-                assert_equal(bytes(block.Header().BlockHash().Hash().Data())[::-1].hex(), block_hash)
+                assert_equal(fb_hash(block.Header().BlockHash().Hash())[::-1].hex(), block_hash)
         # negative index -> empty list
-        await self._send_request(rpc_sock, self._make_get_block_range_request_fbb(-1, 4))
-        response = await self._recv_response(rpc_sock)
-        response = GetBlockRangeResponse.GetBlockRangeResponse.GetRootAs(response, 0)
+        response = await rpc.get_block_range(-1, 4)
         assert_equal(response.BlocksLength(), 0)
         # too many blocks -> rest cut off
-        await self._send_request(rpc_sock, self._make_get_block_range_request_fbb(100, 30))
-        response = await self._recv_response(rpc_sock)
-        response = GetBlockRangeResponse.GetBlockRangeResponse.GetRootAs(response, 0)
+        response = await rpc.get_block_range(100, 30)
         assert_equal(response.BlocksLength(), 12)
 
-    async def _recv_message(self, pub_sock, expected_msg_type, timeout=2):
-        received_msg = await asyncio.wait_for(pub_sock.arecv_msg(), timeout=timeout)
-        actual_msg_type = received_msg.bytes[:12]
-        assert_equal(actual_msg_type.decode(), expected_msg_type)
-        return received_msg.bytes[12:]
-
-    async def _check_timeout(self, fut, timeout=0.1):
-        try:
-            await asyncio.wait_for(fut, timeout=timeout)
-        except asyncio.TimeoutError:
-            pass
-        else:
-            raise AssertionError("Future didn't timeout")
-
-    async def _test_update_chain_tip(self, node, pub_sock):
+    async def _test_pipelined_requests(self, node, rpc):
+        # The requests are in flight at the same time, and the responses are
+        # matched to their request
+        heights = list(range(node.getblockcount() + 1))[::-1]
+        responses = await asyncio.gather(*[rpc.get_block(height=height) for height in heights])
+        for height, response in zip(heights, responses):
+            assert_equal(fb_hash(response.Block().Header().BlockHash().Hash())[::-1].hex(),
+                         node.getblockhash(height))
+        assert rpc.stats['GetBlockRequest'].calls >= len(heights)
+
+    async def _test_update_chain_tip(self, node, sub):
         from NngInterface.UpdatedBlockTip import UpdatedBlockTip
-        pub_sock.subscribe('updateblktip')
+        sub.subscribe('updateblktip')
         hashes = node.generatetoaddress(1, self.burn_addr)
-        msg = await self._recv_message(pub_sock, 'updateblktip')
+        msg = await sub.recv('updateblktip', timeout=2)
         msg = UpdatedBlockTip.GetRootAs(msg, 0)
-        assert_equal(bytes(msg.BlockHash().Hash().Data())[::-1].hex(), hashes[0])
-        pub_sock.unsubscribe('updateblktip')
+        assert_equal(fb_hash(msg.BlockHash().Hash())[::-1].hex(), hashes[0])
+        sub.unsubscribe('updateblktip')
 
-    async def _test_transaction_added_to_mempool(self, node, pub_sock):
+    async def _test_transaction_added_to_mempool(self, node, sub):
         from NngInterface.TransactionAddedToMempool import TransactionAddedToMempool
-        pub_sock.subscribe('mempooltxadd')
+        sub.subscribe('mempooltxadd')
         tx = CTransaction()
         outpoint, value = self._get_utxo(node)
         tx.vin.append(
@@ -514,24 +343,24 @@ class NngInterfaceTest(BitcoinTestFramework):
         tx.vout.append(CTxOut(value - 1000, CScript([OP_HASH160, bytes(20), OP_EQUAL])))
         pad_tx(tx)
         node.sendrawtransaction(tx.serialize().hex())
-        msg = await self._recv_message(pub_sock, 'mempooltxadd')
+        msg = await sub.recv('mempooltxadd', timeout=2)
         msg = TransactionAddedToMempool.GetRootAs(msg, 0)
-        assert_equal(get_fb_bytes(msg.MempoolTx().Tx(), 'Raw').hex(), tx.serialize().hex())
-        assert_equal(bytes(msg.MempoolTx().Tx().Txid().Hash().Data())[::-1].hex(), tx.txid_hex)
+        assert_equal(fb_bytes(msg.MempoolTx().Tx(), 'Raw').hex(), tx.serialize().hex())
+        assert_equal(fb_hash(msg.MempoolTx().Tx().Txid().Hash())[::-1].hex(), tx.txid_hex)
         assert_equal(msg.MempoolTx().Time(), self.TIMESTAMP)
         assert_equal(msg.MempoolTx().Tx().SpentCoinsLength(), 1)
         spent_coins = msg.MempoolTx().Tx().SpentCoins(0)
         assert_equal(spent_coins.TxOut().Amount(), int(SUBSIDY * COIN))
-        assert_equal(get_fb_bytes(spent_coins.TxOut(), 'Script').hex(), self.anyone_script)
+        assert_equal(fb_bytes(spent_coins.TxOut(), 'Script').hex(), self.anyone_script)
         assert_equal(spent_coins.IsCoinbase(), True)
         assert_equal(spent_coins.Height(), 2)
-        pub_sock.unsubscribe('mempooltxadd')
+        sub.unsubscribe('mempooltxadd')
 
-    async def _test_transaction_removed_from_mempool_conflict(self, node, pub_sock):
+    async def _test_transaction_removed_from_mempool_conflict(self, node, sub):
         from NngInterface.TransactionRemovedFromMempool import TransactionRemovedFromMempool
-        pub_sock.subscribe('mempooltxrem')
+        sub.subscribe('mempooltxrem')
         node.generatetoaddress(1, self.burn_addr)  # empty out mempool from previous test
-        await self._check_timeout(pub_sock.arecv_msg(), timeout=0.1) # should not send an eviction message
+        await sub.assert_no_message('mempooltxrem') # should not send an eviction message
         assert_equal(node.getrawmempool(), []) # mempool should be empty
         tx = CTransaction()
         outpoint, value = self._get_utxo(node)
@@ -546,18 +375,18 @@ class NngInterfaceTest(BitcoinTestFramework):
         block.vtx.append(tx)
         prepare_block(block)
         assert_equal(node.submitblock(block.serialize().hex()), None)
-        msg = await self._recv_message(pub_sock, 'mempooltxrem', timeout=5)
+        msg = await sub.recv('mempooltxrem', timeout=5)
         msg = TransactionRemovedFromMempool.GetRootAs(msg, 0)
-        txid = bytes(msg.Txid().Hash().Data())[::-1].hex()
+        txid = fb_hash(msg.Txid().Hash())[::-1].hex()
         assert_equal(txid, conflicted_txid)
         assert_equal(node.getrawmempool(), [])
-        pub_sock.unsubscribe('mempooltxrem')
+        sub.unsubscribe('mempooltxrem')
 
-    async def _test_transaction_removed_from_mempool_expiry(self, node, pub_sock):
+    async def _test_transaction_removed_from_mempool_expiry(self, node, sub):
         from NngInterface.TransactionRemovedFromMempool import TransactionRemovedFromMempool
-        pub_sock.subscribe('mempooltxrem')
+        sub.subscribe('mempooltxrem')
         node.generatetoaddress(1, self.burn_addr)  # empty out mempool from previous test
-        await self._check_timeout(pub_sock.arecv_msg(), timeout=0.1) # should not send an eviction message
+        await sub.assert_no_message('mempooltxrem') # should not send an eviction message
         assert_equal(node.getrawmempool(), []) # mempool should be empty
         tx = CTransaction()
         outpoint, value = self._get_utxo(node)
@@ -573,15 +402,15 @@ class NngInterfaceTest(BitcoinTestFramework):
         tx_notify.vout.append(CTxOut(value - 1000, CScript([OP_HASH160, bytes(20), OP_EQUAL])))
         pad_tx(tx_notify)
         node.sendrawtransaction(tx_notify.serialize().hex())
-        msg = await self._recv_message(pub_sock, 'mempooltxrem', timeout=5)
+        msg = await sub.recv('mempooltxrem', timeout=5)
         msg = TransactionRemovedFromMempool.GetRootAs(msg, 0)
-        assert_equal(bytes(msg.Txid().Hash().Data())[::-1].hex(), tx.txid_hex)
+        assert_equal(fb_hash(msg.Txid().Hash())[::-1].hex(), tx.txid_hex)
         assert_equal(node.getrawmempool(), [tx_notify.txid_hex])
-        pub_sock.unsubscribe('mempooltxrem')
+        sub.unsubscribe('mempooltxrem')
 
-    async def _test_block_connected(self, node, pub_sock):
+    async def _test_block_connected(self, node, sub):
         from NngInterface.BlockConnected import BlockConnected
-        pub_sock.subscribe('blkconnected')
+        sub.subscribe('blkconnected')
         tx = CTransaction()
         outpoint, value = self._get_utxo(node)
         tx.vin.append(CTxIn(outpoint, CScript([b'\x51'])))
@@ -592,26 +421,26 @@ class NngInterfaceTest(BitcoinTestFramework):
         block.vtx.append(tx)
         prepare_block(block)
         assert_equal(node.submitblock(block.serialize().hex()), None)
-        msg = await self._recv_message(pub_sock, 'blkconnected')
+        msg = await sub.recv('blkconnected', timeout=2)
         msg = BlockConnected.GetRootAs(msg, 0)
-        assert_equal(bytes(msg.Block().Header().BlockHash().Hash().Data())[::-1].hex(), block.hash)
-        assert_equal(get_fb_bytes(msg.Block().Header(), 'Raw').hex(),
+        assert_equal(fb_hash(msg.Block().Header().BlockHash().Hash())[::-1].hex(), block.hash)
+        assert_equal(fb_bytes(msg.Block().Header(), 'Raw').hex(),
                      CBlockHeader(block).serialize().hex())
         assert_equal(msg.Block().MetadataLength(), 0)
         assert_equal(msg.Block().TxsLength(), 2)
-        assert_equal(get_fb_bytes(msg.Block().Txs(1).Tx(), 'Raw').hex(), tx.serialize().hex())
+        assert_equal(fb_bytes(msg.Block().Txs(1).Tx(), 'Raw').hex(), tx.serialize().hex())
         assert_equal(msg.Block().Txs(1).Tx().SpentCoinsLength(), 1)
         spent_coin = msg.Block().Txs(1).Tx().SpentCoins(0)
         assert_equal(spent_coin.TxOut().Amount(), int(SUBSIDY * COIN))
-        assert_equal(get_fb_bytes(spent_coin.TxOut(), 'Script').hex(), self.anyone_script)
+        assert_equal(fb_bytes(spent_coin.TxOut(), 'Script').hex(), self.anyone_script)
         assert_equal(spent_coin.IsCoinbase(), True)
         assert_equal(spent_coin.Height(), 6)
         assert_equal(msg.TxsConflictedLength(), 0)
-        pub_sock.unsubscribe('blkconnected')
+        sub.unsubscribe('blkconnected')
 
-    async def _test_block_disconnected(self, node, pub_sock):
+    async def _test_block_disconnected(self, node, sub):
         from NngInterface.BlockDisconnected import BlockDisconnected
-        pub_sock.subscribe('blkdisconctd')
+        sub.subscribe('blkdisconctd')
         tip = node.getbestblockhash()
         tipblock = node.getblock(tip)
         reorged_blockhash = node.generatetoaddress(1, self.burn_addr)[0]
@@ -631,27 +460,27 @@ class NngInterfaceTest(BitcoinTestFramework):
         )
         prepare_block(block2)
         assert_equal(node.submitblock(block2.serialize().hex()), None)
-        msg = await self._recv_message(pub_sock, 'blkdisconctd')
+        msg = await sub.recv('blkdisconctd', timeout=2)
         msg = BlockDisconnected.GetRootAs(msg, 0)
-        assert_equal(bytes(msg.Block().Header().BlockHash().Hash().Data())[::-1].hex(),
+        assert_equal(fb_hash(msg.Block().Header().BlockHash().Hash())[::-1].hex(),
                      reorged_blockhash)
         assert_equal(msg.Block().TxsLength(), 2)
         spent_coin = msg.Block().Txs(1).Tx().SpentCoins(0)
         assert_equal(spent_coin.TxOut().Amount(), int(SUBSIDY * COIN))
-        assert_equal(get_fb_bytes(spent_coin.TxOut(), 'Script').hex(), self.anyone_script)
+        assert_equal(fb_bytes(spent_coin.TxOut(), 'Script').hex(), self.anyone_script)
         assert_equal(spent_coin.IsCoinbase(), True)
         assert_equal(spent_coin.Height(), 5)
-        pub_sock.unsubscribe('blkdisconctd')
+        sub.unsubscribe('blkdisconctd')
 
-    async def _test_chain_state_flushed(self, node, pub_sock):
+    async def _test_chain_state_flushed(self, node, sub):
         from NngInterface.ChainStateFlushed import ChainStateFlushed
-        pub_sock.subscribe('chainstflush')
+        sub.subscribe('chainstflush')
         tip = node.getbestblockhash()
         node.gettxoutsetinfo() # forces chain flush
-        msg = await self._recv_message(pub_sock, 'chainstflush')
+        msg = await sub.recv('chainstflush', timeout=2)
         msg = ChainStateFlushed.GetRootAs(msg, 0)
-        assert_equal(bytes(msg.BlockHash().Hash().Data())[::-1].hex(), tip)
-        pub_sock.unsubscribe('chainstflush')
+        assert_equal(fb_hash(msg.BlockHash().Hash())[::-1].hex(), tip)
+        sub.unsubscribe('chainstflush')
 
     def _test_invalid_params(self, node):
         self.stop_node(0)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Put sustained P2P load on a running lotusd.
+
+Opens a swarm of P2P connections to the node, sends a mix of messages at
+target rates for a given duration, and reports the achieved rates and the
+latency percentiles of the node's responses (see test_framework/loadgen.py
+for the traffic types).
+
+The node limits the number of inbound connections, so it should be started
+with a large enough -maxconnections for big swarms, and with -whitelist for
+the load generator address to avoid being disconnected for misbehaviour.
+
+This is not a functional test and is not run by test_runner.py.
+
+Example:
+    p2p_loadgen.py --port 18444 --peers 200 --duration 60 \\
+        --mix ping=20,inv=500,tx=200,getdata=100,headers=10"""
+
+import argparse
+import json
+import sys
+
+from test_framework.loadgen import (
+    BlockPropagation,
+    LoadGenerator,
+    LoadGenPeer,
+    parse_traffic_mix,
+)
+from test_framework.messages import msg_sendheaders
+from test_framework.p2p import MAGIC_BYTES, NetworkThread
+from test_framework.util import wait_until_helper
+
+
+def format_report(report):
+    lines = ["{} of {} peers connected after {}s".format(
+        report["connected"], report["peers"], report["duration"])]
+    lines.append("{: <10} {: >10} {: >10} {: >11}".format(
+        "sent", "count", "msg/s", "unanswered"))
+    for name, sent in report["sent"].items():
+        lines.append("{: <10} {: >10} {: >10} {: >11}".format(
+            name, sent["count"], sent["rate"], sent["unanswered"]))
+    lines.append("{: <10} {: >10} {: >10} {: >10} {: >10} {: >10}".format(
+        "latency", "count", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+    for name, summary in report["latency_ms"].items():
+        lines.append("{: <10} {: >10} {: >10} {: >10} {: >10} {: >10}".format(
+            name, summary["count"], *[
+                "-" if summary[p] is None else summary[p]
+                for p in ["p50", "p90", "p99", "max"]]))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address of the node (default: %(default)s)')
+    parser.add_argument('--port', type=int, required=True,
+                        help='P2P port of the node')
+    parser.add_argument('--net', default='regtest', choices=sorted(MAGIC_BYTES),
+                        help='network of the node (default: %(default)s)')
+    parser.add_argument('--peers', type=int, default=100,
+                        help='number of connections to open (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='duration of the load, in seconds (default: %(default)s)')
+    parser.add_argument('--mix', default='ping=10,inv=100,tx=50,getdata=50,headers=5',
+                        help='traffic types and their target rates in messages '
+                             'per second across all the peers (default: %(default)s)')
+    parser.add_argument('--networkthreads', type=int, default=1,
+                        help='number of network threads the connections are '
+                             'spread over (default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='timeout for connecting the peers, in seconds (default: %(default)s)')
+    parser.add_argument('--json', dest='json_file',
+                        help='also write the report as json to this file')
+    args = parser.parse_args()
+
+    try:
+        mix = parse_traffic_mix(args.mix)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    network_thread = NetworkThread(args.networkthreads)
+    network_thread.start()
+
+    blocks = BlockPropagation()
+    peers = [LoadGenPeer(blocks) for _ in range(args.peers)]
+    try:
+        print("Connecting {} peers to {}:{}".format(
+            args.peers, args.host, args.port), file=sys.stderr)
+        for peer in peers:
+            peer.peer_connect(args.host, args.port, net=args.net,
+                              timeout_factor=1)()
+        for peer in peers:
+            peer.wait_until(lambda: peer.is_connected, timeout=args.timeout,
+                            check_connected=False)
+            peer.wait_for_verack(timeout=args.timeout)
+            # Ask for block announcements as headers, so block propagation is
+            # timed on the announcement itself
+            peer.send_message(msg_sendheaders())
+
+        print("Sending load for {}s".format(args.duration), file=sys.stderr)
+        generator = LoadGenerator(peers, mix, blocks)
+        elapsed = generator.run(args.duration)
+        report = generator.report(elapsed)
+    finally:
+        for peer in peers:
+            if peer.is_connected:
+                peer.peer_disconnect()
+        wait_until_helper(
+            lambda: not any(peer.is_connected for peer in peers),
+            timeout=10)
+        network_thread.close()
+
+    print(format_report(report))
+    if args.json_file:
+        with open(args.json_file, 'w', encoding='utf8') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
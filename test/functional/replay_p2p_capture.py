@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Read back a P2P capture file written by a test run with --p2pcapture.
+
+By default the captured messages are decoded and printed to stdout. With
+--replay the messages the test framework sent over one connection are sent
+again, in order, to a node listening on the given address."""
+
+import argparse
+import os
+import socket
+import sys
+import time
+from io import BytesIO
+
+from test_framework.p2p import MESSAGEMAP
+from test_framework.p2p_trace import (
+    CAPTURE_CONNECT,
+    CAPTURE_SEND,
+    P2P_HEADER_SIZE,
+    format_timestamp,
+    read_capture,
+)
+
+
+def decode_frame(frame):
+    """Returns the msgtype and the deserialized message of a raw frame. The
+    message is None if it can't be decoded."""
+    msgtype = frame[4:4 + 12].split(b"\x00", 1)[0]
+    if msgtype not in MESSAGEMAP:
+        return msgtype, None
+    msg = MESSAGEMAP[msgtype]()
+    try:
+        msg.deserialize(BytesIO(frame[P2P_HEADER_SIZE:]))
+    except Exception:
+        return msgtype, None
+    return msgtype, msg
+
+
+def print_capture(records, conn_ids, msgtypes):
+    peers = {}
+    for record in records:
+        if record.type == CAPTURE_CONNECT:
+            peers[record.conn_id] = record.data.decode()
+            continue
+        if conn_ids is not None and record.conn_id not in conn_ids:
+            continue
+        msgtype, msg = decode_frame(record.data)
+        if msgtypes is not None and msgtype.decode() not in msgtypes:
+            continue
+        direction = "send" if record.type == CAPTURE_SEND else "receive"
+        print("{} conn{} {} {: <7} {}".format(
+            format_timestamp(record.timestamp), record.conn_id,
+            peers.get(record.conn_id, "?"), direction,
+            repr(msg) if msg is not None else "{} ({} bytes, undecoded)".format(
+                msgtype.decode('ascii', 'replace'),
+                len(record.data) - P2P_HEADER_SIZE)))
+
+
+def replay_capture(records, conn_id, address, realtime):
+    host, port = address.rsplit(':', 1)
+    sock = socket.create_connection((host, int(port)))
+    last_timestamp = None
+    sent = 0
+    try:
+        for record in records:
+            if record.type != CAPTURE_SEND or record.conn_id != conn_id:
+                continue
+            if realtime and last_timestamp is not None:
+                time.sleep(max(0, record.timestamp - last_timestamp))
+            last_timestamp = record.timestamp
+            sock.sendall(record.data)
+            sent += 1
+    finally:
+        sock.close()
+    print("Sent {} messages to {}".format(sent, address), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('capture', help='the p2p.capture file to read')
+    parser.add_argument('--conn', dest='conn_ids', type=int, action='append',
+                        help='only use the messages of this connection id. '
+                             'Can be specified multiple times')
+    parser.add_argument('--msgtype', dest='msgtypes', action='append',
+                        help='only print the messages of this type. Can be '
+                             'specified multiple times')
+    parser.add_argument('--replay', dest='replay', metavar='HOST:PORT',
+                        help='send the messages sent over the connection '
+                             'given by --conn to the node at HOST:PORT')
+    parser.add_argument('--realtime', dest='realtime', action='store_true',
+                        help='when replaying, wait between the messages as '
+                             'long as during the capture')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.capture):
+        print("File {} not found".format(args.capture), file=sys.stderr)
+        sys.exit(1)
+
+    with open(args.capture, 'rb') as f:
+        records = read_capture(f)
+        if args.replay:
+            if not args.conn_ids or len(args.conn_ids) != 1:
+                print("--replay requires exactly one --conn",
+                      file=sys.stderr)
+                sys.exit(1)
+            replay_capture(records, args.conn_ids[0], args.replay,
+                           args.realtime)
+        else:
+            print_capture(records, args.conn_ids, args.msgtypes)
+
+
+if __name__ == '__main__':
+    main()
@@ -85,6 +85,9 @@ class AuthServiceProxy():
         authpair = user + b':' + passwd
         self.__auth_header = b'Basic ' + base64.b64encode(authpair)
         self.timeout = timeout
+        # Sizes of the last request and response, for the RPC telemetry
+        self.request_size = 0
+        self.response_size = 0
         self._set_conn(connection)
 
     def __getattr__(self, name):
@@ -112,6 +115,8 @@ class AuthServiceProxy():
             # Avoid "ConnectionAbortedError: [WinError 10053] An established
             # connection was aborted by the software in your host machine"
             self._set_conn()
+        self.request_size = len(postdata)
+        self.response_size = 0
         try:
             self.__conn.request(method, path, postdata, headers)
             return self._get_response()
@@ -204,7 +209,9 @@ class AuthServiceProxy():
                      http_response.status, http_response.reason)},
                 http_response.status)
 
-        responsedata = http_response.read().decode('utf8')
+        responsebytes = http_response.read()
+        self.response_size = len(responsebytes)
+        responsedata = responsebytes.decode('utf8')
         response = json.loads(responsedata, parse_float=decimal.Decimal)
         elapsed = time.time() - req_start_time
         if "error" in response and response["error"] is None:
@@ -25,7 +25,7 @@ from .messages import (
     msg_avapoll,
     msg_tcpavaresponse,
 )
-from .p2p import P2PInterface, p2p_lock
+from .p2p import P2PInterface
 from .test_node import TestNode
 from .util import assert_equal, satoshi_round, wait_until_helper
 from .wallet_util import bytes_to_wif
@@ -204,7 +204,7 @@ class AvaP2PInterface(P2PInterface):
             lambda: len(self.avaresponses) > 0,
             timeout=timeout)
 
-        with p2p_lock:
+        with self.p2p_lock:
             return self.avaresponses.pop(0)
 
     def send_poll(self, hashes):
@@ -216,7 +216,7 @@ class AvaP2PInterface(P2PInterface):
         self.send_message(msg)
 
     def get_avapoll_if_available(self):
-        with p2p_lock:
+        with self.p2p_lock:
             return self.avapolls.pop(0) if len(self.avapolls) > 0 else None
 
     def wait_for_avahello(self, timeout=5):
@@ -224,7 +224,7 @@ class AvaP2PInterface(P2PInterface):
             lambda: self.avahello is not None,
             timeout=timeout)
 
-        with p2p_lock:
+        with self.p2p_lock:
             return self.avahello
 
     def send_avahello(self, delegation_hex: str, delegated_privkey: ECKey):
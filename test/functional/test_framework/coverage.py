@@ -6,11 +6,234 @@
 
 Provides a way to track which RPC commands are exercised during
 testing.
+
+Only the RPC calls that returned count as covered.
+
+Optionally, the latency and the request and response sizes of the RPC calls
+are also recorded per node (see configure_telemetry()). The calls are
+buffered in memory and written out every FLUSH_INTERVAL seconds and at
+shutdown by flush(), so a killed test loses at most the last interval.
 """
 
+import atexit
+import json
+import math
 import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
 
 REFERENCE_FILENAME = 'rpc_interface.txt'
+TELEMETRY_FILE_PREFIX = 'telemetry.'
+
+# The latency histogram buckets are log-scaled, with this many buckets per
+# doubling of the latency in microseconds (about 9% resolution)
+HISTOGRAM_BUCKETS_PER_DOUBLING = 8
+
+# Maximum time the RPC calls are buffered before they are written out, in
+# seconds
+FLUSH_INTERVAL = 10
+
+
+class TelemetryConfig:
+    """Process-wide telemetry configuration, set up by the test framework."""
+    directory = None
+    # Whether the names of the RPC methods called are recorded, for the
+    # change impact analysis (see impact.py)
+    record_methods = False
+    called_methods = set()
+
+    # The RPCLog of each node, by filename
+    logs = {}
+    lock = threading.Lock()
+
+
+def configure_telemetry(dirname, record_methods=False):
+    """Record the RPC telemetry of the nodes into dirname, or disable it if
+    dirname is None. If record_methods is True, the names of the RPC methods
+    called are available from get_called_methods()."""
+    with TelemetryConfig.lock:
+        TelemetryConfig.directory = dirname
+        TelemetryConfig.record_methods = record_methods
+        TelemetryConfig.called_methods = set()
+
+
+def latency_bucket(elapsed):
+    """Histogram bucket of a latency, in seconds."""
+    micros = elapsed * 1000000
+    if micros <= 1:
+        return 0
+    return int(math.log2(micros) * HISTOGRAM_BUCKETS_PER_DOUBLING)
+
+
+def bucket_latency(bucket):
+    """Upper bound of a histogram bucket, in seconds."""
+    return 2 ** ((bucket + 1) / HISTOGRAM_BUCKETS_PER_DOUBLING) / 1000000
+
+
+class RPCStats():
+    """Call count, latency histogram and payload sizes of an RPC method."""
+
+    def __init__(self):
+        self.calls = 0
+        self.time = 0.0
+        self.max_time = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.histogram = {}
+
+    def add(self, elapsed, request_size, response_size):
+        self.calls += 1
+        self.time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.request_bytes += request_size
+        self.response_bytes += response_size
+        bucket = latency_bucket(elapsed)
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.time += other.time
+        self.max_time = max(self.max_time, other.max_time)
+        self.request_bytes += other.request_bytes
+        self.response_bytes += other.response_bytes
+        for bucket, count in other.histogram.items():
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + count
+
+    def percentile(self, p):
+        """Latency percentile in seconds, within the histogram resolution."""
+        if not self.calls:
+            return None
+        rank = max(1, math.ceil(p / 100 * self.calls))
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= rank:
+                return min(bucket_latency(bucket), self.max_time)
+        return self.max_time
+
+    def to_json(self):
+        return {
+            'calls': self.calls,
+            'time': self.time,
+            'max_time': self.max_time,
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+            'histogram': {str(bucket): count for bucket, count in self.histogram.items()},
+        }
+
+    @classmethod
+    def from_json(cls, obj):
+        stats = cls()
+        stats.calls = obj['calls']
+        stats.time = obj['time']
+        stats.max_time = obj['max_time']
+        stats.request_bytes = obj['request_bytes']
+        stats.response_bytes = obj['response_bytes']
+        stats.histogram = {int(bucket): count
+                           for bucket, count in obj['histogram'].items()}
+        return stats
+
+
+class RPCLog():
+    """The RPC calls made to a node, buffered until flush()."""
+
+    def __init__(self, n_node, coverage_logfile=None, telemetry_file=None,
+                 record_methods=False):
+        self.n_node = n_node
+        self.coverage_logfile = coverage_logfile
+        self.telemetry_file = telemetry_file
+        self.record_methods = record_methods or coverage_logfile is not None
+        self.lock = threading.Lock()
+        self.methods = set()
+        self.stats = {}
+        self.last_flush = time.monotonic()
+
+    def add_call(self, rpc_method):
+        if self.record_methods:
+            with self.lock:
+                self.methods.add(rpc_method)
+        self._flush_if_due()
+
+    def add_timed_call(self, rpc_method, elapsed, request_size, response_size,
+                       returned=True):
+        """Records a call, which only counts as covered if it returned."""
+        if returned and self.record_methods:
+            with self.lock:
+                self.methods.add(rpc_method)
+        if self.telemetry_file:
+            with self.lock:
+                if rpc_method not in self.stats:
+                    self.stats[rpc_method] = RPCStats()
+                self.stats[rpc_method].add(
+                    elapsed, request_size, response_size)
+        self._flush_if_due()
+
+    def _flush_if_due(self):
+        if time.monotonic() - self.last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            methods, self.methods = self.methods, set()
+            stats, self.stats = self.stats, {}
+            self.last_flush = time.monotonic()
+
+        if methods:
+            with TelemetryConfig.lock:
+                TelemetryConfig.called_methods.update(methods)
+        if methods and self.coverage_logfile:
+            with open(self.coverage_logfile, 'a+', encoding='utf8') as f:
+                f.writelines("{}\n".format(m) for m in sorted(methods))
+        if stats:
+            # One line per flush, so the file can be appended to
+            record = {
+                'test': os.path.basename(sys.argv[0]),
+                'node': self.n_node,
+                'methods': {m: s.to_json() for m, s in stats.items()},
+            }
+            with open(self.telemetry_file, 'a+', encoding='utf8') as f:
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def get_rpc_log(coveragedir, n_node):
+    """
+    Get the RPCLog shared by all the RPC proxies of a node, or None if
+    neither coverage, telemetry nor the recording of the methods called is
+    enabled.
+    """
+    coverage_logfile = get_filename(
+        coveragedir, n_node) if coveragedir else None
+    telemetry_file = get_telemetry_filename(
+        TelemetryConfig.directory, n_node) if TelemetryConfig.directory else None
+    record_methods = TelemetryConfig.record_methods
+    if coverage_logfile is None and telemetry_file is None and not record_methods:
+        return None
+
+    key = (n_node, coverage_logfile, telemetry_file, record_methods)
+    with TelemetryConfig.lock:
+        if key not in TelemetryConfig.logs:
+            TelemetryConfig.logs[key] = RPCLog(
+                n_node, coverage_logfile, telemetry_file, record_methods)
+        return TelemetryConfig.logs[key]
+
+
+@atexit.register
+def flush():
+    """Write out the buffered RPC calls of all the nodes."""
+    with TelemetryConfig.lock:
+        logs = list(TelemetryConfig.logs.values())
+    for log in logs:
+        log.flush()
+
+
+def get_called_methods():
+    """Returns the names of the RPC methods called so far, if recorded."""
+    flush()
+    with TelemetryConfig.lock:
+        return set(TelemetryConfig.called_methods)
 
 
 class AuthServiceProxyWrapper():
@@ -19,45 +242,52 @@ class AuthServiceProxyWrapper():
 
     """
 
-    def __init__(self, auth_service_proxy_instance, coverage_logfile=None):
+    def __init__(self, auth_service_proxy_instance, rpc_log=None):
         """
         Kwargs:
             auth_service_proxy_instance (AuthServiceProxy): the instance
                 being wrapped.
-            coverage_logfile (str): if specified, write each service_name
-                out to a file when called.
+            rpc_log (RPCLog): if specified, record each call into it.
 
         """
         self.auth_service_proxy_instance = auth_service_proxy_instance
-        self.coverage_logfile = coverage_logfile
+        self.rpc_log = rpc_log
 
     def __getattr__(self, name):
         return_val = getattr(self.auth_service_proxy_instance, name)
         if not isinstance(return_val, type(self.auth_service_proxy_instance)):
             # If proxy getattr returned an unwrapped value, do the same here.
             return return_val
-        return AuthServiceProxyWrapper(return_val, self.coverage_logfile)
+        return AuthServiceProxyWrapper(return_val, self.rpc_log)
 
     def __call__(self, *args, **kwargs):
         """
-        Delegates to AuthServiceProxy, then writes the particular RPC method
-        called to a file.
+        Delegates to AuthServiceProxy, then records the particular RPC method
+        called if it returned, and its latency and payload sizes.
 
         """
-        return_val = self.auth_service_proxy_instance.__call__(*args, **kwargs)
-        self._log_call()
-        return return_val
+        if self.rpc_log is None:
+            return self.auth_service_proxy_instance.__call__(*args, **kwargs)
 
-    def _log_call(self):
-        rpc_method = self.auth_service_proxy_instance._service_name
+        proxy = self.auth_service_proxy_instance
+        start = time.perf_counter()
+        returned = False
+        try:
+            return_val = proxy.__call__(*args, **kwargs)
+            returned = True
+            return return_val
+        finally:
+            self.rpc_log.add_timed_call(
+                proxy._service_name, time.perf_counter() - start,
+                proxy.request_size, proxy.response_size, returned)
 
-        if self.coverage_logfile:
-            with open(self.coverage_logfile, 'a+', encoding='utf8') as f:
-                f.write("{}\n".format(rpc_method))
+    def _log_call(self):
+        if self.rpc_log is not None:
+            self.rpc_log.add_call(self.auth_service_proxy_instance._service_name)
 
     def __truediv__(self, relative_uri):
         return AuthServiceProxyWrapper(self.auth_service_proxy_instance / relative_uri,
-                                       self.coverage_logfile)
+                                       self.rpc_log)
 
     def get_request(self, *args, **kwargs):
         self._log_call()
@@ -75,6 +305,38 @@ def get_filename(dirname, n_node):
         dirname, "coverage.pid{}.node{}.txt".format(pid, str(n_node)))
 
 
+def get_telemetry_filename(dirname, n_node):
+    """
+    Get a filename unique to the test process ID and node.
+
+    This file will contain the RPC telemetry, one JSON record per line.
+    """
+    pid = str(os.getpid())
+    return os.path.join(
+        dirname, "{}pid{}.node{}.json".format(TELEMETRY_FILE_PREFIX, pid, str(n_node)))
+
+
+def read_telemetry(dirname):
+    """
+    Read the RPC telemetry files of a directory.
+
+    Returns:
+        list of (test name, node number, method, RPCStats).
+
+    """
+    records = []
+    for filename in sorted(os.listdir(dirname)):
+        if not filename.startswith(TELEMETRY_FILE_PREFIX):
+            continue
+        with open(os.path.join(dirname, filename), 'r', encoding='utf8') as f:
+            for line in f:
+                record = json.loads(line)
+                for method, stats in record['methods'].items():
+                    records.append((record['test'], record['node'], method,
+                                    RPCStats.from_json(stats)))
+    return records
+
+
 def write_all_rpc_commands(dirname, node):
     """
     Write out a list of all RPC functions available in `lotus-cli` for
@@ -108,3 +370,65 @@ def write_all_rpc_commands(dirname, node):
         f.writelines(list(commands))
 
     return True
+
+
+class TestFrameworkCoverage(unittest.TestCase):
+    def test_rpc_stats(self):
+        stats = RPCStats()
+        for i in range(1, 101):
+            stats.add(i / 1000, 100, 1000 * i)
+        self.assertEqual(stats.calls, 100)
+        self.assertEqual(stats.max_time, 0.1)
+        self.assertEqual(stats.response_bytes, 5050000)
+        # The percentiles are within the histogram resolution
+        self.assertAlmostEqual(stats.percentile(50), 0.050, delta=0.005)
+        self.assertAlmostEqual(stats.percentile(99), 0.099, delta=0.01)
+        self.assertEqual(stats.percentile(100), 0.1)
+
+        merged = RPCStats.from_json(
+            json.loads(json.dumps(stats.to_json())))
+        merged.merge(stats)
+        self.assertEqual(merged.calls, 200)
+        self.assertEqual(merged.request_bytes, 20000)
+        self.assertEqual(merged.percentile(50), stats.percentile(50))
+        self.assertIsNone(RPCStats().percentile(50))
+
+    def test_rpc_log(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            configure_telemetry(dirname)
+            log = get_rpc_log(dirname, 0)
+            self.assertIs(log, get_rpc_log(dirname, 0))
+            for _ in range(3):
+                log.add_timed_call("getblockcount", 0.001, 50, 10)
+            log.add_call("getblock")
+            # Failed calls are timed but not covered
+            log.add_timed_call("invalidateblock", 0.001, 50, 10, returned=False)
+            flush()
+            log.add_timed_call("getblockcount", 0.002, 50, 10)
+            flush()
+
+            with open(get_filename(dirname, 0), encoding='utf8') as f:
+                self.assertEqual(sorted(f.read().split()),
+                                 ["getblock", "getblockcount", "getblockcount"])
+            records = read_telemetry(dirname)
+            self.assertEqual([(test, node, method, stats.calls)
+                              for test, node, method, stats in records],
+                             [(os.path.basename(sys.argv[0]), 0, "getblockcount", 3),
+                              (os.path.basename(sys.argv[0]), 0, "invalidateblock", 1),
+                              (os.path.basename(sys.argv[0]), 0, "getblockcount", 1)])
+
+            # The calls are written out periodically
+            log.last_flush -= FLUSH_INTERVAL
+            log.add_call("getblockhash")
+            with open(get_filename(dirname, 0), encoding='utf8') as f:
+                self.assertIn("getblockhash", f.read().split())
+
+            configure_telemetry(None, record_methods=True)
+            log = get_rpc_log(None, 1)
+            log.add_call("getbestblockhash")
+            self.assertEqual(get_called_methods(), {"getbestblockhash"})
+
+            configure_telemetry(None)
+            self.assertIsNone(get_rpc_log(None, 0))
+            with TelemetryConfig.lock:
+                TelemetryConfig.logs = {}
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Folded stacks and flamegraphs from the perf profiles of the nodes.
+
+The output of `perf script` is collapsed into the folded format, one line per
+distinct stack: the thread name and the frames from the root to the leaf,
+separated by semicolons, followed by the number of samples. Folded profiles
+can be merged by adding the counts, and rendered as a flamegraph SVG.
+
+A differential flamegraph renders a profile with the width of the frames
+from the new profile, and colors them by the change of their share of the
+samples since a baseline profile: red for hotter, blue for colder."""
+
+import html
+import re
+import unittest
+from collections import Counter
+from io import StringIO
+
+# perf script sample header: "comm pid[/tid] [cpu] time: [period] event:"
+PERF_HEADER_RE = re.compile(r'^(\S.*?)\s+(\d+)(?:/\d+)?\s')
+# Symbol offset, e.g. "CheckBlock+0x1a"
+SYMBOL_OFFSET_RE = re.compile(r'\+0x[0-9a-f]+$')
+
+SVG_WIDTH = 1200
+FRAME_HEIGHT = 16
+# Frames narrower than this, in pixels, are not drawn
+MIN_FRAME_WIDTH = 0.1
+FONT_WIDTH = 7
+
+
+def collapse_perf_script(lines):
+    """Collapses the lines of a `perf script` output into a Counter of folded
+    stacks."""
+    folded = Counter()
+    comm = None
+    frames = []
+
+    def flush():
+        if comm is not None and frames:
+            folded[";".join([comm] + frames[::-1])] += 1
+
+    for line in lines:
+        line = line.rstrip("\n")
+        if not line.strip():
+            flush()
+            comm = None
+            frames = []
+            continue
+        if not line[0].isspace():
+            flush()
+            frames = []
+            match = PERF_HEADER_RE.match(line)
+            comm = match.group(1).replace(";", ":") if match else None
+            continue
+
+        # Stack frame: "address symbol+offset (dso)", from the leaf to the
+        # root
+        parts = line.strip().split(None, 1)
+        if len(parts) < 2:
+            continue
+        symbol, _, dso = parts[1].rpartition(" (")
+        if not symbol or symbol == "[unknown]":
+            symbol = "[{}]".format(dso.rstrip(")").rsplit("/", 1)[-1])
+        frames.append(SYMBOL_OFFSET_RE.sub("", symbol).replace(";", ":"))
+    flush()
+
+    return folded
+
+
+def read_folded(f):
+    """Reads a folded profile file object into a Counter."""
+    folded = Counter()
+    for line in f:
+        stack, _, count = line.rstrip("\n").rpartition(" ")
+        if stack:
+            folded[stack] += int(count)
+    return folded
+
+
+def write_folded(f, folded):
+    """Writes a folded profile to a file object, sorted by stack."""
+    for stack in sorted(folded):
+        f.write("{} {}\n".format(stack, folded[stack]))
+
+
+class Frame:
+    def __init__(self, name):
+        self.name = name
+        self.samples = 0
+        self.children = {}
+
+
+def build_tree(folded):
+    root = Frame("all")
+    for stack, count in folded.items():
+        frame = root
+        frame.samples += count
+        for name in stack.split(";"):
+            if name not in frame.children:
+                frame.children[name] = Frame(name)
+            frame = frame.children[name]
+            frame.samples += count
+    return root
+
+
+def frame_color(name, delta=None, max_delta=None):
+    """The color of a frame: a warm color derived from the name, or a red
+    (hotter) to blue (colder) scale in a differential flamegraph."""
+    if delta is None:
+        h = sum(name.encode()) % 64
+        return "rgb({},{},{})".format(205 + h % 50, 80 + h * 2, 40 + h % 30)
+    if not max_delta or not delta:
+        return "rgb(250,250,250)"
+    intensity = int(210 * min(1, abs(delta) / max_delta))
+    if delta > 0:
+        return "rgb(255,{0},{0})".format(250 - intensity)
+    return "rgb({0},{0},255)".format(250 - intensity)
+
+
+def inclusive_shares(tree):
+    """Returns the share of the samples of each frame, by its path."""
+    shares = {}
+    total = tree.samples
+
+    def visit(frame, path):
+        for child in frame.children.values():
+            child_path = path + (child.name,)
+            shares[child_path] = child.samples / total
+            visit(child, child_path)
+
+    if total:
+        visit(tree, ())
+    return shares
+
+
+def render_svg(folded, title, baseline=None):
+    """Renders a folded profile as a flamegraph SVG. If a baseline folded
+    profile is given, the frames are colored by their change since the
+    baseline."""
+    tree = build_tree(folded)
+    deltas = None
+    max_delta = None
+    if baseline is not None:
+        base_shares = inclusive_shares(build_tree(baseline))
+        deltas = {path: share - base_shares.get(path, 0)
+                  for path, share in inclusive_shares(tree).items()}
+        max_delta = max((abs(d) for d in deltas.values()), default=0)
+
+    rects = []
+    max_depth = 0
+
+    def draw(frame, path, x, depth, width):
+        nonlocal max_depth
+        if width < MIN_FRAME_WIDTH:
+            return
+        max_depth = max(max_depth, depth)
+        delta = deltas.get(path, 0) if deltas is not None else None
+        info = "{} ({} samples, {:.2f}%{})".format(
+            frame.name, frame.samples, 100 * frame.samples / tree.samples,
+            "" if delta is None else ", {:+.2f}%".format(100 * delta))
+        label = frame.name[:int(width / FONT_WIDTH)]
+        if len(label) < len(frame.name):
+            label = label[:-2] + ".." if len(label) > 2 else ""
+        rects.append((x, depth, width, frame_color(
+            frame.name, delta, max_delta), info, label))
+
+        child_x = x
+        for name in sorted(frame.children):
+            child = frame.children[name]
+            child_width = width * child.samples / frame.samples
+            draw(child, path + (name,), child_x, depth + 1, child_width)
+            child_x += child_width
+
+    if tree.samples:
+        draw(tree, (), 0.0, 0, float(SVG_WIDTH))
+
+    height = (max_depth + 1) * FRAME_HEIGHT + 2 * FRAME_HEIGHT
+    lines = [
+        '<?xml version="1.0" standalone="no"?>',
+        '<svg version="1.1" width="{}" height="{}" xmlns="http://www.w3.org/2000/svg" '
+        'font-family="monospace" font-size="12">'.format(SVG_WIDTH, height),
+        '<text x="{}" y="{}" text-anchor="middle" font-size="14">{}</text>'.format(
+            SVG_WIDTH // 2, FRAME_HEIGHT, html.escape(title)),
+    ]
+    for x, depth, width, color, info, label in rects:
+        # The root is at the bottom
+        y = height - (depth + 1) * FRAME_HEIGHT
+        lines.append(
+            '<g><title>{}</title><rect x="{:.1f}" y="{}" width="{:.1f}" height="{}" '
+            'fill="{}" rx="2"/><text x="{:.1f}" y="{}">{}</text></g>'.format(
+                html.escape(info), x, y, width, FRAME_HEIGHT - 1, color,
+                x + 3, y + FRAME_HEIGHT - 4, html.escape(label)))
+    lines.append('</svg>')
+    return "\n".join(lines) + "\n"
+
+
+def self_time_changes(folded, baseline):
+    """Returns the change of the share of the samples spent in each function
+    itself (as the leaf frame), sorted from the most hotter to the most
+    colder, as a list of (function, delta)."""
+    def leaf_shares(profile):
+        total = sum(profile.values())
+        shares = Counter()
+        for stack, count in profile.items():
+            shares[stack.rsplit(";", 1)[-1]] += count / total
+        return shares
+
+    new, base = leaf_shares(folded), leaf_shares(baseline)
+    changes = [(function, new[function] - base[function])
+               for function in set(new) | set(base)]
+    return sorted(changes, key=lambda change: (-change[1], change[0]))
+
+
+class TestFrameworkFlamegraph(unittest.TestCase):
+    PERF_SCRIPT = [
+        "lotusd 4242/4243 100.000001: 10101010 cpu-clock:\n",
+        "\t    55d1c2 CheckBlock+0x12 (/build/src/lotusd)\n",
+        "\t    55d1c3 ProcessNewBlock+0x34 (/build/src/lotusd)\n",
+        "\t    7f0001 [unknown] (/usr/lib/libc.so.6)\n",
+        "\n",
+        "b-msghand 4242/4244 100.000002: 10101010 cpu-clock:\n",
+        "\t    55d1c2 CheckBlock+0x1a (/build/src/lotusd)\n",
+        "\t    55d1c3 ProcessNewBlock+0x34 (/build/src/lotusd)\n",
+        "\t    7f0001 [unknown] (/usr/lib/libc.so.6)\n",
+        "\n",
+        "b-msghand 4242/4244 100.000003: 10101010 cpu-clock:\n",
+        "\t    55d1c2 CheckBlock+0x1a (/build/src/lotusd)\n",
+        "\t    55d1c3 ProcessNewBlock+0x34 (/build/src/lotusd)\n",
+        "\t    7f0001 [unknown] (/usr/lib/libc.so.6)\n",
+    ]
+
+    def test_collapse(self):
+        folded = collapse_perf_script(self.PERF_SCRIPT)
+        self.assertEqual(folded, Counter({
+            "lotusd;[libc.so.6];ProcessNewBlock;CheckBlock": 1,
+            "b-msghand;[libc.so.6];ProcessNewBlock;CheckBlock": 2,
+        }))
+
+        f = StringIO()
+        write_folded(f, folded)
+        f.seek(0)
+        self.assertEqual(read_folded(f), folded)
+
+    def test_render(self):
+        folded = Counter({"a;b;c": 3, "a;b": 1, "a;d": 4})
+        svg = render_svg(folded, "test")
+        self.assertIn("c (3 samples, 37.50%)", svg)
+        self.assertEqual(svg.count("<rect"), 5)
+
+        baseline = Counter({"a;b;c": 1, "a;d": 7})
+        svg = render_svg(folded, "diff", baseline)
+        self.assertIn("c (3 samples, 37.50%, +25.00%)", svg)
+        self.assertIn("d (4 samples, 50.00%, -37.50%)", svg)
+        self.assertEqual(self_time_changes(folded, baseline)[0], ("c", 0.25))
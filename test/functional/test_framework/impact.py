@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Change impact analysis, to run the tests affected by a change first.
+
+Each test records the RPC methods it called, the P2P message types it
+exchanged with the nodes and the test framework modules it imported. The
+records of the previous runs are merged into an ImpactMap.
+
+The changes since a git revision are mapped to the same keys:
+  - a changed test framework module maps to that module;
+  - a change inside the function of an RPC, whether it returns the
+    RPCHelpMan or takes the JSONRPCRequest, maps to that RPC;
+  - a changed line mentioning a NetMsgType, or inside the
+    `msg_type == NetMsgType::X` block processing a message, maps to that
+    message type.
+The changes that can't be mapped (e.g. to the validation code) don't select
+any test."""
+
+import json
+import os
+import re
+import subprocess
+import unittest
+
+IMPACT_FILE_PREFIX = "impact.pid"
+
+RPC_FUNCTION_RE = re.compile(r'^(?:static )?RPCHelpMan (\w+)\(\)')
+HANDLER_FUNCTION_RE = re.compile(r'^(?:static )?UniValue \w+\(')
+RPC_NAME_RE = re.compile(r'RPCHelpMan\s*\{\s*"(\w+)"')
+FUNCTION_END_RE = re.compile(r'^}')
+NET_MSG_TYPE_RE = re.compile(r'NetMsgType::([A-Z0-9]+)')
+NET_MSG_TYPE_DEF_RE = re.compile(r'const char \*([A-Z0-9]+) = "(\w+)";')
+MSG_TYPE_BLOCK_RE = re.compile(r'msg_type == NetMsgType::([A-Z0-9]+)\)')
+HUNK_RE = re.compile(r'^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@')
+
+
+def write_impact(dirname, test, rpcs, msgtypes, modules):
+    """Writes the impact record of a test."""
+    record = {
+        'test': test,
+        'rpcs': sorted(rpcs),
+        'msgtypes': sorted(msgtypes),
+        'modules': sorted(modules),
+    }
+    path = os.path.join(dirname, "{}{}.json".format(
+        IMPACT_FILE_PREFIX, os.getpid()))
+    with open(path, 'w', encoding='utf8') as f:
+        json.dump(record, f, sort_keys=True)
+
+
+def read_impacts(dirname):
+    """Returns the impact records of a directory."""
+    records = []
+    for filename in sorted(os.listdir(dirname)):
+        if filename.startswith(IMPACT_FILE_PREFIX):
+            with open(os.path.join(dirname, filename), encoding='utf8') as f:
+                records.append(json.load(f))
+    return records
+
+
+class ImpactMap:
+    """The RPCs, P2P message types and framework modules used by each test
+    script in the previous runs."""
+
+    def __init__(self, impact_file):
+        self.impact_file = impact_file
+        self.tests = {}
+        if os.path.isfile(impact_file):
+            with open(impact_file, encoding='utf8') as f:
+                self.tests = json.load(f)
+
+    def update(self, records):
+        """Replaces the impact of the tests with their new records. A script
+        run with several sets of parameters gets the union of its records."""
+        updated = {}
+        for record in records:
+            impact = updated.setdefault(
+                record['test'], {'rpcs': set(), 'msgtypes': set(), 'modules': set()})
+            for key in impact:
+                impact[key].update(record[key])
+        for test, impact in updated.items():
+            self.tests[test] = {key: sorted(values)
+                                for key, values in impact.items()}
+
+    def save(self):
+        tmp_file = self.impact_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf8') as f:
+            json.dump(self.tests, f, indent=True, sort_keys=True)
+        os.replace(tmp_file, self.impact_file)
+
+    def get_affected(self, scripts, changes):
+        """Returns the scripts affected by the changes, and the scripts with
+        no recorded impact, which might be affected as well."""
+        affected = set()
+        unknown = set()
+        for script in scripts:
+            impact = self.tests.get(script)
+            if impact is None:
+                unknown.add(script)
+            elif script in changes.scripts or any(
+                    getattr(changes, key).intersection(impact[key]) for key in impact):
+                affected.add(script)
+        return affected, unknown
+
+
+class Changes:
+    """The test framework modules, RPCs and P2P message types changed since a
+    git revision."""
+
+    def __init__(self):
+        self.scripts = set()
+        self.modules = set()
+        self.rpcs = set()
+        self.msgtypes = set()
+        # The changed files that could not be mapped
+        self.unmapped = []
+
+
+def changed_lines(diff):
+    """Returns the line numbers in the new file of the lines changed by a
+    zero context diff, and the content of the added and removed lines. A
+    removal is located at the line preceding it."""
+    lines = set()
+    content = []
+    for line in diff.splitlines():
+        match = HUNK_RE.match(line)
+        if match:
+            start, count = int(match.group(1)), int(match.group(2) or 1)
+            lines.update(range(start, start + max(count, 1)))
+        elif line[:1] in ('+', '-') and line[:3] not in ('+++', '---'):
+            content.append(line[1:])
+    return lines, content
+
+
+def rpc_ranges(source):
+    """Returns the (first line, last line, RPC name) of the RPC functions of a
+    source file, the lines being numbered from 1.
+
+    These are the functions returning an RPCHelpMan, and the UniValue
+    functions whose body checks the request against an RPCHelpMan, with the
+    signature possibly split over several lines. The name of the RPC is
+    taken from the RPCHelpMan."""
+    ranges = []
+    lines = source.splitlines()
+    i = 0
+    while i < len(lines):
+        match = RPC_FUNCTION_RE.match(lines[i])
+        # The return type may be on its own line
+        if not match and not HANDLER_FUNCTION_RE.match(" ".join(lines[i:i + 2])):
+            i += 1
+            continue
+        start = i
+        # Skip the declarations
+        while i < len(lines) and not re.search(r'[{;]', lines[i]):
+            i += 1
+        if i == len(lines) or lines[i].rstrip().endswith(';'):
+            i += 1
+            continue
+        while i < len(lines) and not FUNCTION_END_RE.match(lines[i]):
+            i += 1
+        name_match = RPC_NAME_RE.search("\n".join(lines[start:i + 1]))
+        if name_match:
+            ranges.append((start + 1, i + 1, name_match.group(1)))
+        elif match:
+            ranges.append((start + 1, i + 1, match.group(1)))
+        i += 1
+    return ranges
+
+
+def msgtype_blocks(source):
+    """Returns the (first line, last line, NetMsgType constant name) of the
+    blocks processing a message type, starting with a
+    `msg_type == NetMsgType::X` check and ending with the closing brace at
+    the same indentation."""
+    blocks = []
+    lines = source.splitlines()
+    for i, line in enumerate(lines):
+        match = MSG_TYPE_BLOCK_RE.search(line)
+        if not match:
+            continue
+        indent = line[:len(line) - len(line.lstrip())]
+        end = i + 1
+        while end < len(lines) and not lines[end].startswith(indent + '}'):
+            end += 1
+        blocks.append((i + 1, end + 1, match.group(1)))
+    return blocks
+
+
+def parse_msgtypes(protocol_source):
+    """Returns the message type of each NetMsgType constant name."""
+    return dict(NET_MSG_TYPE_DEF_RE.findall(protocol_source))
+
+
+def map_source_change(source, lines, content, msgtypes, changes):
+    """Maps the changed lines of a source file to RPCs and message types.
+    Returns whether the change could be mapped."""
+    mapped = False
+    for first, last, name in rpc_ranges(source):
+        if any(first <= line <= last for line in lines):
+            changes.rpcs.add(name)
+            mapped = True
+
+    for constant in NET_MSG_TYPE_RE.findall("\n".join(content)):
+        if constant in msgtypes:
+            changes.msgtypes.add(msgtypes[constant])
+            mapped = True
+
+    for first, last, constant in msgtype_blocks(source):
+        if constant in msgtypes and any(first <= line <= last for line in lines):
+            changes.msgtypes.add(msgtypes[constant])
+            mapped = True
+    return mapped
+
+
+def get_changes(src_dir, rev):
+    """Returns the Changes between a git revision and the working tree."""
+    def git(*args):
+        return subprocess.check_output(
+            ['git', '-C', src_dir] + list(args), universal_newlines=True)
+
+    changes = Changes()
+    protocol_file = os.path.join(src_dir, 'src', 'protocol.cpp')
+    msgtypes = {}
+    if os.path.isfile(protocol_file):
+        with open(protocol_file, encoding='utf8') as f:
+            msgtypes = parse_msgtypes(f.read())
+
+    for path in git('diff', '--name-only', rev, '--').splitlines():
+        directory, filename = os.path.split(path)
+        if directory == 'test/functional':
+            changes.scripts.add(filename)
+            continue
+        if directory == 'test/functional/test_framework' and filename.endswith('.py'):
+            changes.modules.add(filename[:-3])
+            continue
+        if not path.startswith('src/') or not path.endswith(('.cpp', '.h')):
+            changes.unmapped.append(path)
+            continue
+
+        full_path = os.path.join(src_dir, path)
+        if not os.path.isfile(full_path):
+            # Deleted file
+            changes.unmapped.append(path)
+            continue
+        with open(full_path, encoding='utf8', errors='replace') as f:
+            source = f.read()
+        lines, content = changed_lines(git('diff', '-U0', rev, '--', path))
+        if not map_source_change(source, lines, content, msgtypes, changes):
+            changes.unmapped.append(path)
+
+    return changes
+
+
+class TestFrameworkImpact(unittest.TestCase):
+    SOURCE = "\n".join([
+        '#include <rpc/server.h>',                       # 1
+        'static RPCHelpMan getblockcount() {',           # 2
+        '    return RPCHelpMan{',                        # 3
+        '        "getblockcount",',                      # 4
+        '        {}};',                                  # 5
+        '}',                                             # 6
+        'static RPCHelpMan getblocktemplate() {',        # 7
+        '    return RPCHelpMan{"getblocktemplate", {}};',  # 8
+        '}',                                             # 9
+        'void ProcessMessage() {',                       # 10
+        '    if (msg_type == NetMsgType::TX) {',         # 11
+        '        AcceptToMemoryPool();',                 # 12
+        '    }',                                         # 13
+        '}',                                             # 14
+    ])
+    # From src/rpc/blockchain.cpp, the helper spans the lines 1-26 and the
+    # handler the lines 28-68
+    BLOCKCHAIN_SOURCE = r'''
+UniValue MempoolToJSON(const CTxMemPool &pool, bool verbose) {
+    if (verbose) {
+        LOCK(pool.cs);
+        UniValue o(UniValue::VOBJ);
+        for (const CTxMemPoolEntry &e : pool.mapTx) {
+            const uint256 &txid = e.GetTx().GetId();
+            UniValue info(UniValue::VOBJ);
+            entryToJSON(pool, info, e);
+            // Mempool has unique entries so there is no advantage in using
+            // UniValue::pushKV, which checks if the key already exists in O(N).
+            // UniValue::__pushKV is used instead which currently is O(1).
+            o.__pushKV(txid.ToString(), info);
+        }
+        return o;
+    } else {
+        std::vector<uint256> vtxids;
+        pool.queryHashes(vtxids);
+
+        UniValue a(UniValue::VARR);
+        for (const uint256 &txid : vtxids) {
+            a.push_back(txid.ToString());
+        }
+
+        return a;
+    }
+}
+
+static UniValue getrawmempool(const Config &config,
+                              const JSONRPCRequest &request) {
+    RPCHelpMan{
+        "getrawmempool",
+        "Returns all transaction ids in memory pool as a json array of "
+        "string transaction ids.\n"
+        "\nHint: use getmempoolentry to fetch a specific transaction from the "
+        "mempool.\n",
+        {
+            {"verbose", RPCArg::Type::BOOL, /* default */ "false",
+             "True for a json object, false for array of transaction ids"},
+        },
+        {
+            RPCResult{"for verbose = false",
+                      RPCResult::Type::ARR,
+                      "",
+                      "",
+                      {
+                          {RPCResult::Type::STR_HEX, "", "The transaction id"},
+                      }},
+            RPCResult{"for verbose = true",
+                      RPCResult::Type::OBJ_DYN,
+                      "",
+                      "",
+                      {
+                          {RPCResult::Type::OBJ, "transactionid", "",
+                           MempoolEntryDescription()},
+                      }},
+        },
+        RPCExamples{HelpExampleCli("getrawmempool", "true") +
+                    HelpExampleRpc("getrawmempool", "true")},
+    }
+        .Check(request);
+
+    bool fVerbose = false;
+    if (!request.params[0].isNull()) {
+        fVerbose = request.params[0].get_bool();
+    }
+
+    return MempoolToJSON(EnsureMemPool(request.context), fVerbose);
+}
+'''[1:]
+
+    def test_changed_lines(self):
+        diff = "\n".join([
+            "--- a/src/rpc/mining.cpp",
+            "+++ b/src/rpc/mining.cpp",
+            "@@ -4 +4 @@ static RPCHelpMan getblockcount() {",
+            "-        \"getblockcount\",",
+            "+        \"getblockcount\", ",
+            "@@ -20,2 +19,0 @@",
+            "-    Send(NetMsgType::PING);",
+            "-    x();",
+        ])
+        lines, content = changed_lines(diff)
+        self.assertEqual(lines, {4, 19})
+        self.assertEqual(len(content), 4)
+
+    def test_map_source_change(self):
+        msgtypes = parse_msgtypes(
+            'const char *TX = "tx";\nconst char *PING = "ping";\n')
+        self.assertEqual(msgtypes, {'TX': 'tx', 'PING': 'ping'})
+        self.assertEqual(rpc_ranges(self.SOURCE), [
+            (2, 6, 'getblockcount'), (7, 9, 'getblocktemplate')])
+
+        changes = Changes()
+        self.assertTrue(map_source_change(
+            self.SOURCE, {8, 12}, ["Send(NetMsgType::PING);"], msgtypes, changes))
+        self.assertEqual(changes.rpcs, {'getblocktemplate'})
+        self.assertEqual(changes.msgtypes, {'tx', 'ping'})
+
+        changes = Changes()
+        self.assertFalse(map_source_change(
+            self.SOURCE, {1, 14}, ["#include <rpc/server.h>"], msgtypes, changes))
+
+    def test_map_handler_change(self):
+        self.assertEqual(rpc_ranges(self.BLOCKCHAIN_SOURCE),
+                         [(28, 68, 'getrawmempool')])
+        declaration = ("UniValue signrawtransactionwithwallet(const Config &config,\n"
+                       "                                      const JSONRPCRequest &request);\n")
+        self.assertEqual(rpc_ranges(declaration + self.BLOCKCHAIN_SOURCE),
+                         [(30, 70, 'getrawmempool')])
+        # As formatted when the name is too long for the line
+        split = self.BLOCKCHAIN_SOURCE.replace(
+            "static UniValue getrawmempool(", "static UniValue\ngetrawmempool(")
+        self.assertEqual(rpc_ranges(split), [(28, 69, 'getrawmempool')])
+
+        changes = Changes()
+        self.assertTrue(map_source_change(
+            self.BLOCKCHAIN_SOURCE, {67}, [], {}, changes))
+        self.assertEqual(changes.rpcs, {'getrawmempool'})
+
+        changes = Changes()
+        self.assertFalse(map_source_change(
+            self.BLOCKCHAIN_SOURCE, {10}, [], {}, changes))
+
+    def test_impact_map(self):
+        impact_map = ImpactMap(os.devnull)
+        impact_map.update([
+            {'test': 'mining_basic.py', 'rpcs': ['getblocktemplate'],
+             'msgtypes': [], 'modules': ['util']},
+            {'test': 'p2p_tx.py', 'rpcs': ['getblockcount'],
+             'msgtypes': ['tx'], 'modules': ['p2p']},
+        ])
+        scripts = ['mining_basic.py', 'p2p_tx.py', 'new_test.py']
+
+        changes = Changes()
+        changes.msgtypes.add('tx')
+        self.assertEqual(impact_map.get_affected(scripts, changes),
+                         ({'p2p_tx.py'}, {'new_test.py'}))
+
+        changes = Changes()
+        changes.modules.add('util')
+        changes.scripts.add('p2p_tx.py')
+        self.assertEqual(impact_map.get_affected(scripts, changes)[0],
+                         {'mining_basic.py', 'p2p_tx.py'})
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Synthetic P2P load generation.
+
+LoadGenPeer is a P2PInterface that sends messages of the traffic types below
+on demand and records the latency of the node's responses. LoadGenerator
+drives a swarm of them at target message rates.
+
+Traffic types and the latency recorded for them:
+  - ping: ping -> pong
+  - inv: tx inv of a random hash -> getdata from the node
+  - tx: a transaction spending a random outpoint (which the node keeps as an
+    orphan) -> no response
+  - getdata: getdata of a random tx hash -> notfound
+  - headers: getheaders from the best known block -> headers
+  - avapoll: poll of the best known block -> avaresponse (the node only
+    responds if avalanche is enabled)
+
+The latency between the first peer seeing a new block and every other peer
+seeing it is recorded as the "block" propagation latency."""
+
+import random
+import threading
+import time
+import unittest
+from collections import defaultdict
+
+from .messages import (
+    MSG_BLOCK,
+    MSG_TX,
+    CInv,
+    COutPoint,
+    CTransaction,
+    CTxIn,
+    CTxOut,
+    msg_avapoll,
+    msg_getdata,
+    msg_getheaders,
+    msg_inv,
+    msg_ping,
+    msg_tx,
+)
+from .p2p import P2PInterface
+
+TRAFFIC_TYPES = ["ping", "inv", "tx", "getdata", "headers", "avapoll"]
+
+# Nonces of the pings sent by the load generator start here, so they don't
+# collide with the ones of P2PInterface.sync_with_ping
+PING_NONCE_BASE = 1 << 32
+
+
+def percentile(sorted_samples, p):
+    """Nearest-rank percentile of an already sorted list of samples."""
+    if not sorted_samples:
+        return None
+    rank = max(0, min(len(sorted_samples) - 1,
+                      int(round(p / 100 * len(sorted_samples))) - 1))
+    return sorted_samples[rank]
+
+
+class LatencyStats:
+    """Latency samples, in seconds."""
+
+    def __init__(self):
+        self.samples = []
+
+    def add(self, latency):
+        self.samples.append(latency)
+
+    def merge(self, other):
+        self.samples.extend(other.samples)
+
+    def summary(self):
+        """Returns the count and the p50/p90/p99/max latencies in ms."""
+        samples = sorted(self.samples)
+        summary = {"count": len(samples)}
+        for name, p in [("p50", 50), ("p90", 90), ("p99", 99), ("max", 100)]:
+            value = percentile(samples, p)
+            summary[name] = None if value is None else round(value * 1000, 3)
+        return summary
+
+
+def parse_traffic_mix(spec):
+    """Parses a traffic mix such as "ping=10,inv=200,tx=50" into a dict of
+    target rates, in messages per second across all the peers."""
+    mix = {}
+    for item in spec.split(','):
+        if not item:
+            continue
+        name, _, rate = item.partition('=')
+        if name not in TRAFFIC_TYPES:
+            raise ValueError("Unknown traffic type '{}', expected one of {}".format(
+                name, ", ".join(TRAFFIC_TYPES)))
+        mix[name] = float(rate)
+        if mix[name] < 0:
+            raise ValueError("Negative rate for traffic type '{}'".format(name))
+    return mix
+
+
+class BlockPropagation:
+    """Records when each peer first sees each block, relative to the first
+    peer seeing it. Shared by all the peers, which can run on several network
+    threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.first_seen = {}
+        self.stats = LatencyStats()
+        self.best_block = None
+
+    def seen(self, peer_seen, block_hash):
+        """Records that a peer saw a block announcement."""
+        if block_hash in peer_seen:
+            return
+        peer_seen.add(block_hash)
+        now = time.time()
+        with self.lock:
+            if block_hash not in self.first_seen:
+                self.first_seen[block_hash] = now
+                self.best_block = block_hash
+            self.stats.add(now - self.first_seen[block_hash])
+
+    def learn_tip(self, block_hash):
+        """Records a block known to the node, without timing it."""
+        with self.lock:
+            if self.best_block is None:
+                self.best_block = block_hash
+
+
+class LoadGenPeer(P2PInterface):
+    """A peer of the swarm. The latency stats are guarded by the connection
+    lock."""
+
+    def __init__(self, blocks):
+        super().__init__()
+        self.blocks = blocks
+        self.blocks_seen = set()
+        self.stats = defaultdict(LatencyStats)
+        # Requests waiting for a response, keyed by (traffic type, key)
+        self.pending = {}
+        self.headers_pending = []
+        self.next_nonce = PING_NONCE_BASE
+        self.avapoll_round = 0
+        self.rng = random.Random()
+
+    def _random_hash(self):
+        return self.rng.getrandbits(256)
+
+    def _request(self, traffic_type, key):
+        with self.p2p_lock:
+            self.pending[(traffic_type, key)] = time.time()
+
+    def _response(self, traffic_type, key):
+        """Must be called with the connection lock held, which is the case in
+        the message callbacks."""
+        start = self.pending.pop((traffic_type, key), None)
+        if start is not None:
+            self.stats[traffic_type].add(time.time() - start)
+
+    def send_traffic(self, traffic_type):
+        """Sends a single message of the given traffic type. Returns False if
+        the message can't be built yet because no block is known."""
+        if traffic_type == "ping":
+            nonce = self.next_nonce
+            self.next_nonce += 1
+            self._request("ping", nonce)
+            self.send_message(msg_ping(nonce=nonce))
+        elif traffic_type == "inv":
+            txhash = self._random_hash()
+            self._request("inv", txhash)
+            self.send_message(msg_inv([CInv(MSG_TX, txhash)]))
+        elif traffic_type == "tx":
+            tx = CTransaction()
+            tx.vin.append(CTxIn(COutPoint(self._random_hash(), 0)))
+            tx.vout.append(CTxOut(1000, b"\x51"))
+            self.send_message(msg_tx(tx))
+        elif traffic_type == "getdata":
+            txhash = self._random_hash()
+            self._request("getdata", txhash)
+            self.send_message(msg_getdata([CInv(MSG_TX, txhash)]))
+        elif traffic_type == "headers":
+            best_block = self.blocks.best_block
+            if best_block is None:
+                return False
+            with self.p2p_lock:
+                self.headers_pending.append(time.time())
+            msg = msg_getheaders()
+            msg.locator.vHave = [best_block]
+            self.send_message(msg)
+        elif traffic_type == "avapoll":
+            best_block = self.blocks.best_block
+            if best_block is None:
+                return False
+            self.avapoll_round += 1
+            self._request("avapoll", self.avapoll_round)
+            msg = msg_avapoll()
+            msg.poll.round = self.avapoll_round
+            msg.poll.invs.append(CInv(MSG_BLOCK, best_block))
+            self.send_message(msg)
+        else:
+            raise ValueError("Unknown traffic type {}".format(traffic_type))
+        return True
+
+    def on_pong(self, message):
+        self._response("ping", message.nonce)
+
+    def on_getdata(self, message):
+        for inv in message.inv:
+            self._response("inv", inv.hash)
+
+    def on_notfound(self, message):
+        for inv in message.vec:
+            self._response("getdata", inv.hash)
+
+    def on_getheaders(self, message):
+        # The node asks for headers when syncing, starting from its tip
+        if message.locator.vHave:
+            self.blocks.learn_tip(message.locator.vHave[0])
+
+    def on_headers(self, message):
+        if self.headers_pending:
+            # Response to our getheaders
+            self.stats["headers"].add(
+                time.time() - self.headers_pending.pop(0))
+            return
+        # Unsolicited headers are block announcements
+        for header in message.headers:
+            header.calc_sha256()
+            self.blocks.seen(self.blocks_seen, header.sha256)
+
+    def on_inv(self, message):
+        for inv in message.inv:
+            if inv.type == MSG_BLOCK:
+                self.blocks.seen(self.blocks_seen, inv.hash)
+
+    def on_cmpctblock(self, message):
+        header = message.header_and_shortids.header
+        header.calc_sha256()
+        self.blocks.seen(self.blocks_seen, header.sha256)
+
+    def on_avaresponse(self, message):
+        self._response("avapoll", message.response.response.round)
+
+
+class LoadGenerator:
+    """Sends a traffic mix through a swarm of peers at target rates."""
+
+    def __init__(self, peers, mix, blocks):
+        self.peers = peers
+        self.mix = mix
+        self.blocks = blocks
+        # Messages due according to the target rates
+        self.due = defaultdict(int)
+        # Messages actually sent
+        self.delivered = defaultdict(int)
+
+    def run(self, duration, tick=0.01):
+        """Sends the traffic for duration seconds. The messages of each type
+        are spread round-robin over the peers, and the rate is enforced over
+        the whole run so that slow ticks are caught up."""
+        start = time.time()
+        next_peer = defaultdict(int)
+        while True:
+            elapsed = time.time() - start
+            if elapsed >= duration:
+                break
+            for traffic_type, rate in self.mix.items():
+                due = int(rate * elapsed) - self.due[traffic_type]
+                for _ in range(due):
+                    peer = self.peers[next_peer[traffic_type] %
+                                      len(self.peers)]
+                    next_peer[traffic_type] += 1
+                    # Messages that can't be sent are not retried
+                    self.due[traffic_type] += 1
+                    if peer.is_connected and peer.send_traffic(traffic_type):
+                        self.delivered[traffic_type] += 1
+            time.sleep(tick)
+        return time.time() - start
+
+    def report(self, elapsed):
+        """Returns the achieved rates and the latency percentiles."""
+        stats = defaultdict(LatencyStats)
+        unanswered = defaultdict(int)
+        for peer in self.peers:
+            with peer.p2p_lock:
+                for name, peer_stats in peer.stats.items():
+                    stats[name].merge(peer_stats)
+                for name, _ in peer.pending:
+                    unanswered[name] += 1
+                unanswered["headers"] += len(peer.headers_pending)
+        with self.blocks.lock:
+            stats["block"].merge(self.blocks.stats)
+        return {
+            "duration": round(elapsed, 3),
+            "peers": len(self.peers),
+            "connected": sum(1 for peer in self.peers if peer.is_connected),
+            "sent": {name: {"count": count,
+                            "rate": round(count / elapsed, 1),
+                            "unanswered": unanswered[name]}
+                     for name, count in sorted(self.delivered.items())},
+            "latency_ms": {name: s.summary()
+                           for name, s in sorted(stats.items())},
+        }
+
+
+class TestFrameworkLoadGen(unittest.TestCase):
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile(samples, 100), 100)
+        self.assertEqual(percentile([3], 50), 3)
+        self.assertIsNone(percentile([], 50))
+
+        stats = LatencyStats()
+        for latency in [0.001, 0.002, 0.003, 0.004]:
+            stats.add(latency)
+        self.assertEqual(stats.summary(), {
+            "count": 4, "p50": 2.0, "p90": 4.0, "p99": 4.0, "max": 4.0})
+
+    def test_parse_traffic_mix(self):
+        self.assertEqual(parse_traffic_mix("ping=10,inv=200.5"),
+                         {"ping": 10, "inv": 200.5})
+        self.assertRaises(ValueError, parse_traffic_mix, "foo=1")
+        self.assertRaises(ValueError, parse_traffic_mix, "ping=-1")
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Asynchronous clients of the NNG interface of the node.
+
+NngRpcClient sends the FlatBuffers RpcCall requests to -nngrpc. A Req0 socket
+only has one request in flight per context, so the requests are pipelined
+over a pool of contexts: up to `pipeline` requests are waiting for the node at
+a time.
+
+NngSubscriber receives the messages published on -nngpub and dispatches them
+by topic, the 12 characters message type the messages start with, to a queue
+or a callback per topic.
+
+The byte vectors of the messages are read with fb_vector, which returns a
+memoryview of the message buffer instead of building bytes one element at a
+time through the generated accessors. The messages, bytes and request
+latencies are counted, to benchmark the interface.
+
+pynng, flatbuffers and the NngInterface package generated by the build are
+only imported when needed."""
+
+import asyncio
+import copy
+import importlib
+import time
+import unittest
+from collections import namedtuple
+
+from .coverage import RPCStats
+
+# Published messages start with their type, padded to 12 characters
+TOPIC_SIZE = 12
+HASH_SIZE = 32
+
+DEFAULT_PIPELINE = 16
+# The messages published while the subscriber is busy are queued by NNG up to
+# this number, and dropped beyond it. This is the maximum allowed by NNG.
+RECV_BUFFER_SIZE = 8192
+DEFAULT_TIMEOUT = 10
+
+NngMessage = namedtuple('NngMessage', ['time', 'payload'])
+
+
+class NngError(Exception):
+    """The node returned an error for an RPC request."""
+
+    def __init__(self, code, message):
+        super().__init__("{} ({})".format(message, code))
+        self.code = code
+        self.message = message
+
+
+class _OffsetRecorder:
+    """Stands for the table of a FlatBuffers object, and records the vtable
+    offset looked up by a generated accessor."""
+
+    def __init__(self, tab):
+        self.tab = tab
+        self.vtable_offset = None
+
+    def Offset(self, vtable_offset):
+        self.vtable_offset = vtable_offset
+        return self.tab.Offset(vtable_offset)
+
+    def __getattr__(self, name):
+        return getattr(self.tab, name)
+
+
+# The vtable offset of the vector fields, by (table class, field name)
+_vtable_offsets = {}
+
+
+def _get_vtable_offset(obj, name):
+    key = (type(obj), name)
+    if key not in _vtable_offsets:
+        # The generated <name>Length() accessor looks up the field
+        probe = copy.copy(obj)
+        probe._tab = _OffsetRecorder(obj._tab)
+        getattr(probe, name + 'Length')()
+        _vtable_offsets[key] = probe._tab.vtable_offset
+    return _vtable_offsets[key]
+
+
+def fb_vector(obj, name):
+    """Returns the byte vector field `name` of a FlatBuffers table as a
+    memoryview of the message buffer, without copying."""
+    tab = obj._tab
+    offset = tab.Offset(_get_vtable_offset(obj, name))
+    if offset == 0:
+        return memoryview(b'')
+    start = tab.Vector(offset)
+    return memoryview(tab.Bytes)[start:start + tab.VectorLen(offset)]
+
+
+def fb_bytes(obj, name):
+    """Returns the byte vector field `name` of a FlatBuffers table as
+    bytes."""
+    return bytes(fb_vector(obj, name))
+
+
+def fb_hash(hash_struct):
+    """Returns the bytes of a Hash struct, in serialization order, so the hex
+    of a txid or block hash is fb_hash(...)[::-1].hex()."""
+    tab = hash_struct._tab
+    return bytes(tab.Bytes[tab.Pos:tab.Pos + HASH_SIZE])
+
+
+class TopicStats:
+    """Number of messages and bytes received for a topic, and the receive
+    time of the first and last ones."""
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.first_time = None
+        self.last_time = None
+
+    def add(self, received_time, size):
+        self.messages += 1
+        self.bytes += size
+        if self.first_time is None:
+            self.first_time = received_time
+        self.last_time = received_time
+
+    def rate(self):
+        """Messages per second between the first and last message."""
+        if self.messages < 2 or self.last_time == self.first_time:
+            return None
+        return (self.messages - 1) / (self.last_time - self.first_time)
+
+    def to_json(self):
+        return {
+            'messages': self.messages,
+            'bytes': self.bytes,
+            'rate': self.rate(),
+        }
+
+
+def make_rpc_call(build_request, rpc_type):
+    """Serializes an RpcCall. build_request(fbb) builds the request table in
+    the FlatBuffers builder and returns its offset, and rpc_type is the
+    RpcRequest union type name, e.g. 'GetBlockRequest'."""
+    import flatbuffers
+    from NngInterface import RpcCall, RpcRequest
+    fbb = flatbuffers.Builder()
+    request = build_request(fbb)
+    RpcCall.Start(fbb)
+    RpcCall.AddRpcType(fbb, getattr(RpcRequest.RpcRequest, rpc_type))
+    RpcCall.AddRpc(fbb, request)
+    fbb.Finish(RpcCall.End(fbb))
+    return bytes(fbb.Output())
+
+
+class NngRpcClient:
+    """Pipelined client of the -nngrpc interface. Must be used from a single
+    asyncio event loop."""
+
+    def __init__(self, url, *, pipeline=DEFAULT_PIPELINE, timeout=DEFAULT_TIMEOUT):
+        import pynng
+        self.timeout = timeout
+        self.sock = pynng.Req0()
+        self.sock.dial(url)
+        self.contexts = asyncio.Queue()
+        for _ in range(pipeline):
+            self.contexts.put_nowait(self.sock.new_context())
+        self.stats = {}
+
+    def close(self):
+        while not self.contexts.empty():
+            self.contexts.get_nowait().close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    async def request_raw(self, payload, *, name='raw'):
+        """Sends a request and returns the whole response message. Up to
+        `pipeline` requests wait for the node at a time, the others wait for
+        a context."""
+        context = await self.contexts.get()
+        try:
+            start = time.perf_counter()
+            await asyncio.wait_for(context.asend(payload), timeout=self.timeout)
+            response = await asyncio.wait_for(
+                context.arecv_msg(), timeout=self.timeout)
+            elapsed = time.perf_counter() - start
+        finally:
+            self.contexts.put_nowait(context)
+        self.stats.setdefault(name, RPCStats()).add(
+            elapsed, len(payload), len(response.bytes))
+        return response.bytes
+
+    async def request(self, payload, *, name='raw'):
+        """Sends a request and returns the data of the result, as a
+        memoryview of the response. Raises NngError if the node returned an
+        error."""
+        from NngInterface import RpcResult
+        result = RpcResult.RpcResult.GetRootAs(
+            await self.request_raw(payload, name=name), 0)
+        if not result.IsSuccess():
+            raise NngError(result.ErrorCode(), result.ErrorMsg().decode())
+        return fb_vector(result, 'Data')
+
+    async def call(self, rpc_type, build_request):
+        """Sends an RpcCall of the RpcRequest type `rpc_type` and returns the
+        decoded response table."""
+        response_type = rpc_type[:-len('Request')] + 'Response'
+        module = importlib.import_module('NngInterface.' + response_type)
+        data = await self.request(
+            make_rpc_call(build_request, rpc_type), name=rpc_type)
+        return getattr(module, response_type).GetRootAs(data, 0)
+
+    async def get_block(self, *, height=None, blockhash=None):
+        """Returns the GetBlockResponse of a block, by height or by hash (in
+        serialization order)."""
+        from NngInterface import BlockHash, BlockHeight, BlockIdentifier, GetBlockRequest, Hash
+
+        def build(fbb):
+            if height is not None:
+                BlockHeight.Start(fbb)
+                BlockHeight.AddHeight(fbb, height)
+                block_id = BlockHeight.End(fbb)
+                id_type = BlockIdentifier.BlockIdentifier.Height
+            else:
+                BlockHash.Start(fbb)
+                BlockHash.AddHash(fbb, Hash.CreateHash(fbb, blockhash))
+                block_id = BlockHash.End(fbb)
+                id_type = BlockIdentifier.BlockIdentifier.Hash
+            GetBlockRequest.Start(fbb)
+            GetBlockRequest.AddBlockIdType(fbb, id_type)
+            GetBlockRequest.AddBlockId(fbb, block_id)
+            return GetBlockRequest.End(fbb)
+        return await self.call('GetBlockRequest', build)
+
+    async def get_block_range(self, start_height, num_blocks):
+        from NngInterface import GetBlockRangeRequest
+
+        def build(fbb):
+            GetBlockRangeRequest.Start(fbb)
+            GetBlockRangeRequest.AddStartHeight(fbb, start_height)
+            GetBlockRangeRequest.AddNumBlocks(fbb, num_blocks)
+            return GetBlockRangeRequest.End(fbb)
+        return await self.call('GetBlockRangeRequest', build)
+
+    async def get_block_slice(self, file_num, data_pos, num_bytes):
+        from NngInterface import GetBlockSliceRequest
+
+        def build(fbb):
+            GetBlockSliceRequest.Start(fbb)
+            GetBlockSliceRequest.AddFileNum(fbb, file_num)
+            GetBlockSliceRequest.AddDataPos(fbb, data_pos)
+            GetBlockSliceRequest.AddNumBytes(fbb, num_bytes)
+            return GetBlockSliceRequest.End(fbb)
+        return await self.call('GetBlockSliceRequest', build)
+
+    async def get_undo_slice(self, file_num, undo_pos, num_bytes):
+        from NngInterface import GetUndoSliceRequest
+
+        def build(fbb):
+            GetUndoSliceRequest.Start(fbb)
+            GetUndoSliceRequest.AddFileNum(fbb, file_num)
+            GetUndoSliceRequest.AddUndoPos(fbb, undo_pos)
+            GetUndoSliceRequest.AddNumBytes(fbb, num_bytes)
+            return GetUndoSliceRequest.End(fbb)
+        return await self.call('GetUndoSliceRequest', build)
+
+    async def get_mempool(self):
+        from NngInterface import GetMempoolRequest
+
+        def build(fbb):
+            GetMempoolRequest.Start(fbb)
+            return GetMempoolRequest.End(fbb)
+        return await self.call('GetMempoolRequest', build)
+
+
+class NngSubscriber:
+    """Client of the -nngpub interface. A dispatcher task receives the
+    messages and hands them to the queue or the callback of their topic; the
+    messages of the other topics are dropped. Must be used from a single
+    asyncio event loop."""
+
+    def __init__(self, url):
+        import pynng
+        self.sock = pynng.Sub0(recv_buffer_size=RECV_BUFFER_SIZE)
+        self.sock.dial(url)
+        self.queues = {}
+        self.callbacks = {}
+        self.stats = {}
+        self.dispatcher = asyncio.ensure_future(self._dispatch())
+
+    def close(self):
+        self.dispatcher.cancel()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def subscribe(self, topic, callback=None):
+        """Receives the messages of a topic. They are passed to
+        callback(NngMessage) if given, or queued for recv()."""
+        if callback is not None:
+            self.callbacks[topic] = callback
+        else:
+            self.queues[topic] = asyncio.Queue()
+        self.stats.setdefault(topic, TopicStats())
+        self.sock.subscribe(topic)
+
+    def unsubscribe(self, topic):
+        self.sock.unsubscribe(topic)
+        self.queues.pop(topic, None)
+        self.callbacks.pop(topic, None)
+
+    async def _dispatch(self):
+        import pynng
+        while True:
+            try:
+                msg = await self.sock.arecv_msg()
+            except pynng.Closed:
+                return
+            received_time = time.perf_counter()
+            data = msg.bytes
+            topic = data[:TOPIC_SIZE].decode()
+            if topic in self.stats:
+                self.stats[topic].add(received_time, len(data))
+            message = NngMessage(received_time, memoryview(data)[TOPIC_SIZE:])
+            if topic in self.callbacks:
+                self.callbacks[topic](message)
+            elif topic in self.queues:
+                self.queues[topic].put_nowait(message)
+
+    async def recv(self, topic, *, timeout=DEFAULT_TIMEOUT):
+        """Returns the payload of the next message of a topic."""
+        message = await asyncio.wait_for(self.queues[topic].get(), timeout=timeout)
+        return message.payload
+
+    async def assert_no_message(self, topic, *, timeout=0.1):
+        try:
+            await asyncio.wait_for(self.queues[topic].get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return
+        raise AssertionError("Unexpected {} message".format(topic))
+
+
+class TestFrameworkNng(unittest.TestCase):
+    def test_fb_vector(self):
+        try:
+            import flatbuffers
+        except ImportError:
+            self.skipTest("flatbuffers module not available.")
+
+        # Like the code generated for a table with a byte vector as second
+        # field
+        class Table:
+            def __init__(self, buf):
+                self._tab = flatbuffers.table.Table(
+                    buf, flatbuffers.encode.Get(
+                        flatbuffers.packer.uoffset, buf, 0))
+
+            def DataLength(self):
+                o = flatbuffers.number_types.UOffsetTFlags.py_type(
+                    self._tab.Offset(6))
+                return self._tab.VectorLen(o) if o != 0 else 0
+
+        fbb = flatbuffers.Builder()
+        data = fbb.CreateByteVector(b'\x01\x02\x03')
+        fbb.StartObject(2)
+        fbb.PrependInt32Slot(0, 42, 0)
+        fbb.PrependUOffsetTRelativeSlot(1, data, 0)
+        fbb.Finish(fbb.EndObject())
+        buf = bytes(fbb.Output())
+
+        table = Table(buf)
+        vector = fb_vector(table, 'Data')
+        self.assertIsInstance(vector, memoryview)
+        self.assertIs(vector.obj, buf)
+        self.assertEqual(bytes(vector), b'\x01\x02\x03')
+        self.assertEqual(_vtable_offsets[(Table, 'Data')], 6)
+
+        fbb = flatbuffers.Builder()
+        fbb.StartObject(2)
+        fbb.Finish(fbb.EndObject())
+        self.assertEqual(fb_bytes(Table(bytes(fbb.Output())), 'Data'), b'')
+
+    def test_topic_stats(self):
+        stats = TopicStats()
+        self.assertIsNone(stats.rate())
+        for i in range(5):
+            stats.add(10 + i / 2, 100)
+        self.assertEqual(stats.to_json(), {
+            'messages': 5, 'bytes': 500, 'rate': 2.0})
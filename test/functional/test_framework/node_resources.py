@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Sampling of the resources used by the nodes.
+
+While a node runs, a ResourceSampler thread reads /proc/<pid>/stat, status,
+io and fd at a fixed interval and appends the samples to resources.log,
+beside the debug.log of the node. Each line of the file is a sample made of
+the time since the node started, the CPU seconds, the RSS and peak RSS in
+kB, the number of open file descriptors, and the bytes read from and written
+to the storage.
+
+When the node stops, a summary of its run is appended to a file in the
+summary directory, if any, for test_runner.py to aggregate across the suite.
+This is only supported on Linux."""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from collections import namedtuple
+
+RESOURCES_LOG = "resources.log"
+SUMMARY_FILE_PREFIX = "resources.pid"
+
+DEFAULT_INTERVAL = 1.0
+
+ResourceSample = namedtuple(
+    'ResourceSample',
+    ['time', 'cpu', 'rss', 'peak_rss', 'fds', 'read_bytes', 'write_bytes'])
+
+
+class ResourceConfig:
+    """Process-wide sampling configuration, set up by the test framework."""
+    interval = None
+    directory = None
+
+    # The samplers of the running nodes
+    samplers = []
+    lock = threading.Lock()
+
+
+def configure(interval=None, directory=None):
+    """Samples the resources of the nodes started from now on every interval
+    seconds, and writes the summaries into directory. The sampling is
+    disabled if interval is None."""
+    with ResourceConfig.lock:
+        ResourceConfig.interval = interval
+        ResourceConfig.directory = directory
+
+
+def parse_stat(text):
+    """Returns the state and the CPU seconds (user + system) from the content
+    of /proc/<pid>/stat."""
+    # The command name is in parentheses and can contain spaces
+    fields = text[text.rindex(')') + 2:].split()
+    utime, stime = int(fields[11]), int(fields[12])
+    return fields[0], (utime + stime) / os.sysconf('SC_CLK_TCK')
+
+
+def parse_key_values(text):
+    """Parses the "key: value" lines of /proc/<pid>/status and io into a dict
+    of ints, the "kB" unit being dropped."""
+    values = {}
+    for line in text.splitlines():
+        key, _, value = line.partition(':')
+        value = value.split()
+        if value and value[0].isdigit():
+            values[key] = int(value[0])
+    return values
+
+
+def read_sample(pid, start_time):
+    """Reads a ResourceSample of a process. Returns None if the process is
+    gone or is a zombie."""
+    proc = "/proc/{}".format(pid)
+    try:
+        with open(os.path.join(proc, "stat"), encoding='utf8') as f:
+            state, cpu = parse_stat(f.read())
+        if state in ('Z', 'X'):
+            return None
+        with open(os.path.join(proc, "status"), encoding='utf8') as f:
+            status = parse_key_values(f.read())
+        with open(os.path.join(proc, "io"), encoding='utf8') as f:
+            io = parse_key_values(f.read())
+        fds = len(os.listdir(os.path.join(proc, "fd")))
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+    return ResourceSample(
+        round(time.time() - start_time, 3), cpu, status.get('VmRSS', 0),
+        status.get('VmHWM', 0), fds, io.get('read_bytes', 0),
+        io.get('write_bytes', 0))
+
+
+def format_sample(sample):
+    return "{:.3f} {:.2f} {} {} {} {} {}\n".format(*sample)
+
+
+class ResourceSummary:
+    """Running summary of the samples of a process, so the samples don't need
+    to be kept in memory."""
+
+    def __init__(self):
+        self.samples = 0
+        self.last = None
+        self.peak_rss = 0
+        self.peak_fds = 0
+
+    def add(self, sample):
+        self.samples += 1
+        self.last = sample
+        self.peak_rss = max(self.peak_rss, sample.peak_rss, sample.rss)
+        self.peak_fds = max(self.peak_fds, sample.fds)
+
+    def to_json(self):
+        last = self.last or ResourceSample(0, 0, 0, 0, 0, 0, 0)
+        return {
+            'samples': self.samples,
+            'duration': last.time,
+            'cpu_seconds': last.cpu,
+            'peak_rss_kb': self.peak_rss,
+            'peak_fds': self.peak_fds,
+            'read_bytes': last.read_bytes,
+            'write_bytes': last.write_bytes,
+        }
+
+
+class ResourceSampler(threading.Thread):
+    """Samples the resources of a node process until it exits or stop() is
+    called."""
+
+    def __init__(self, pid, n_node, log_path, interval, summary_file=None):
+        super().__init__(name="ResourceSampler-{}".format(pid), daemon=True)
+        self.pid = pid
+        self.n_node = n_node
+        self.interval = interval
+        self.summary_file = summary_file
+        self.start_time = time.time()
+        self.summary = ResourceSummary()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.log_file = open(log_path, 'a', encoding='utf8')
+        self.log_file.write("# pid {} started at {:.3f}\n".format(
+            pid, self.start_time))
+
+    def sample(self):
+        """Takes a sample now. Returns False if the process is gone."""
+        with self.lock:
+            if self.log_file is None:
+                return False
+            sample = read_sample(self.pid, self.start_time)
+            if sample is None:
+                return False
+            self.summary.add(sample)
+            self.log_file.write(format_sample(sample))
+            return True
+
+    def run(self):
+        while self.sample() and not self.stopped.wait(self.interval):
+            pass
+
+    def stop(self):
+        """Stops sampling and writes the summary. Can be called several
+        times."""
+        self.stopped.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+        with self.lock:
+            if self.log_file is None:
+                return
+            self.log_file.close()
+            self.log_file = None
+        with ResourceConfig.lock:
+            if self in ResourceConfig.samplers:
+                ResourceConfig.samplers.remove(self)
+
+        if self.summary_file is not None and self.summary.samples:
+            record = dict(self.summary.to_json(),
+                          test=os.path.basename(sys.argv[0]), node=self.n_node)
+            with open(self.summary_file, 'a', encoding='utf8') as f:
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def start_sampler(pid, n_node, log_dir):
+    """Starts sampling the resources of a node process, if enabled. Returns
+    the ResourceSampler or None."""
+    with ResourceConfig.lock:
+        interval = ResourceConfig.interval
+        directory = ResourceConfig.directory
+    if interval is None or not sys.platform.startswith('linux'):
+        return None
+
+    os.makedirs(log_dir, exist_ok=True)
+    sampler = ResourceSampler(
+        pid, n_node, os.path.join(log_dir, RESOURCES_LOG), interval,
+        get_summary_filename(directory, n_node) if directory else None)
+    with ResourceConfig.lock:
+        ResourceConfig.samplers.append(sampler)
+    sampler.start()
+    return sampler
+
+
+def stop_samplers():
+    """Stops the samplers of the nodes still running."""
+    with ResourceConfig.lock:
+        samplers = list(ResourceConfig.samplers)
+    for sampler in samplers:
+        sampler.stop()
+
+
+def get_summary_filename(dirname, n_node):
+    """
+    Get a filename unique to the test process ID and node.
+
+    This file will contain the resource summaries, one JSON record per line.
+    """
+    return os.path.join(dirname, "{}{}.node{}.json".format(
+        SUMMARY_FILE_PREFIX, os.getpid(), n_node))
+
+
+def read_summaries(dirname):
+    """Returns the resource summaries of a directory, as a list of dicts."""
+    summaries = []
+    for filename in sorted(os.listdir(dirname)):
+        if not filename.startswith(SUMMARY_FILE_PREFIX):
+            continue
+        with open(os.path.join(dirname, filename), 'r', encoding='utf8') as f:
+            summaries.extend(json.loads(line) for line in f)
+    return summaries
+
+
+class TestFrameworkNodeResources(unittest.TestCase):
+    def test_parse(self):
+        state, cpu = parse_stat(
+            "42 (lotusd (x) y) S 1 42 42 0 -1 4194304 81 0 0 0 "
+            "{} {} 0 0 20 0 1 0".format(
+                3 * os.sysconf('SC_CLK_TCK'), os.sysconf('SC_CLK_TCK')))
+        self.assertEqual(state, 'S')
+        self.assertEqual(cpu, 4)
+        self.assertEqual(
+            parse_key_values("Name:\tlotusd\nVmHWM:\t    1800 kB\nVmRSS:\t    1700 kB\n"),
+            {'VmHWM': 1800, 'VmRSS': 1700})
+
+    @unittest.skipIf(not sys.platform.startswith('linux'), "requires /proc")
+    def test_sampler(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            configure(0.01, dirname)
+            sampler = start_sampler(os.getpid(), 3, dirname)
+            self.assertTrue(sampler.sample())
+            sampler.stop()
+            sampler.stop()
+            configure()
+
+            with open(os.path.join(dirname, RESOURCES_LOG), encoding='utf8') as f:
+                lines = f.read().splitlines()
+            self.assertTrue(lines[0].startswith("# pid {}".format(os.getpid())))
+            self.assertEqual(len(lines[1].split()), len(ResourceSample._fields))
+
+            [summary] = read_summaries(dirname)
+            self.assertEqual(summary['node'], 3)
+            self.assertGreater(summary['peak_rss_kb'], 0)
+            self.assertGreater(summary['peak_fds'], 0)
+            self.assertEqual(summary['samples'], len(lines) - 1)
+            self.assertEqual(ResourceConfig.samplers, [])
@@ -13,6 +13,11 @@ node. Messages are sent to/received from the node on an asyncio event loop.
 State held inside the objects must be guarded by the p2p_lock to avoid data
 races between the main testing thread and the event loop.
 
+By default there is a single event loop. The NetworkThread can also run
+several event loops in as many threads, in which case the connections are
+assigned to the loops in a round-robin fashion and each connection is guarded
+by its own lock (see P2PConnection.p2p_lock and GlobalP2PLock).
+
 P2PConnection: A low-level connection object to a node's P2P interface
 P2PInterface: A high-level interface object for communicating to a node over P2P
 P2PDataStore: A p2p interface class that keeps a store of transactions and blocks
@@ -21,10 +26,14 @@ P2PTxInvStore: A p2p interface class that inherits from P2PDataStore, and keeps
               a count of how many times each txid has been announced."""
 
 import asyncio
+import itertools
 import logging
 import struct
 import sys
 import threading
+import time
+import unittest
+import weakref
 from collections import defaultdict
 from io import BytesIO
 
@@ -72,6 +81,7 @@ from test_framework.messages import (
     msg_version,
     sha256,
 )
+from test_framework.p2p_trace import MessageTrace, should_log_messages
 from test_framework.util import wait_until_helper
 
 logger = logging.getLogger("TestFramework.p2p")
@@ -113,6 +123,13 @@ MESSAGEMAP = {
     b"version": msg_version,
 }
 
+# The P2P message header: magic, msgtype, payload size, checksum
+MSG_HEADER = struct.Struct("<4s12sI4s")
+
+# The consumed bytes at the front of the recv buffer are only dropped once
+# there are at least that many of them
+RECVBUF_COMPACT_SIZE = 1024 * 1024
+
 MAGIC_BYTES = {
     "mainnet": b"\xec\xe7\xef\xf3",
     "testnet3": b"\xec\xf4\xf3\xf4",
@@ -128,7 +145,7 @@ class P2PConnection(asyncio.Protocol):
     - opening and closing the TCP connection to the node
     - reading bytes from and writing bytes to the socket
     - deserializing and serializing the P2P message header
-    - logging messages as they are sent and received
+    - tracing and logging messages as they are sent and received
 
     This class contains no logic for handing the P2P message payloads. It must be
     sub-classed and the on_message() callback overridden."""
@@ -138,12 +155,24 @@ class P2PConnection(asyncio.Protocol):
         # Should only call methods on this from the NetworkThread, c.f.
         # call_soon_threadsafe
         self._transport = None
+        # The event loop the connection is assigned to, set on connection
+        self._loop = None
+        # The lock guarding the state of this connection. This is the global
+        # p2p_lock, or the plain lock it wraps once connected, unless there
+        # are several network event loops.
+        self.p2p_lock = p2p_lock
 
     @property
     def is_connected(self):
         return self._transport is not None
 
-    def peer_connect(self, dstaddr, dstport, *, net, timeout_factor):
+    def peer_connect(self, dstaddr, dstport, *, net, timeout_factor,
+                     verify_checksum=True):
+        """Prepare the connection to the node.
+
+        The checksum of the received messages can be left unverified with
+        verify_checksum=False, which is only sensible for trusted local peers
+        and saves hashing every payload twice."""
         assert not self.is_connected
         self.timeout_factor = timeout_factor
         self.dstaddr = dstaddr
@@ -151,12 +180,17 @@ class P2PConnection(asyncio.Protocol):
         # The initial message to send after the connection was made:
         self.on_connection_send_msg = None
         self.on_connection_send_msg_is_raw = False
-        self.recvbuf = b""
+        self.recvbuf = bytearray()
+        self.recvbuf_offset = 0
+        self.verify_checksum = verify_checksum
         self.magic_bytes = MAGIC_BYTES[net]
+        self.trace = MessageTrace(self.dstaddr, self.dstport)
+        self._loop = NetworkThread.next_event_loop()
+        self.p2p_lock = p2p_lock.connection_lock(self)
         logger.debug('Connecting to Bitcoin Node: {}:{}'.format(
             self.dstaddr, self.dstport))
 
-        loop = NetworkThread.network_event_loop
+        loop = self._loop
         conn_gen_unsafe = loop.create_connection(
             lambda: self, host=self.dstaddr, port=self.dstport)
 
@@ -166,7 +200,7 @@ class P2PConnection(asyncio.Protocol):
 
     def peer_disconnect(self):
         # Connection could have already been closed by other end.
-        NetworkThread.network_event_loop.call_soon_threadsafe(
+        self._loop.call_soon_threadsafe(
             lambda: self._transport and self._transport.abort())
 
     # Connection and disconnection methods
@@ -195,14 +229,15 @@ class P2PConnection(asyncio.Protocol):
             logger.debug("Closed connection to: {}:{}".format(
                 self.dstaddr, self.dstport))
         self._transport = None
-        self.recvbuf = b""
+        self.recvbuf = bytearray()
+        self.recvbuf_offset = 0
         self.on_close()
 
     # Socket read methods
 
     def data_received(self, t):
         """asyncio callback when data is read from the socket."""
-        with p2p_lock:
+        with self.p2p_lock:
             if len(t) > 0:
                 self.recvbuf += t
 
@@ -217,30 +252,44 @@ class P2PConnection(asyncio.Protocol):
 
         This method reads data from the buffer in a loop. It deserializes,
         parses and verifies the P2P header, then passes the P2P payload to
-        the on_message callback for processing."""
+        the on_message callback for processing.
+
+        The messages are read in place starting at recvbuf_offset, and the
+        consumed bytes are only dropped from the buffer once they make up
+        most of it, so receiving many messages doesn't copy the remaining
+        buffer each time."""
         try:
-            with p2p_lock:
-                if len(self.recvbuf) < 4:
+            with self.p2p_lock:
+                buf = self.recvbuf
+                offset = self.recvbuf_offset
+                if len(buf) - offset < 4:
                     return None
-                if self.recvbuf[:4] != self.magic_bytes:
+                if buf[offset:offset + 4] != self.magic_bytes:
                     raise ValueError(
                         "magic bytes mismatch: {} != {}".format(
                             repr(
                                 self.magic_bytes), repr(
-                                self.recvbuf)))
-                if len(self.recvbuf) < 4 + 12 + 4 + 4:
+                                bytes(buf[offset:]))))
+                if len(buf) - offset < MSG_HEADER.size:
                     return None
-                msgtype = self.recvbuf[4:4 + 12].split(b"\x00", 1)[0]
-                msglen = struct.unpack(
-                    "<i", self.recvbuf[4 + 12:4 + 12 + 4])[0]
-                checksum = self.recvbuf[4 + 12 + 4:4 + 12 + 4 + 4]
-                if len(self.recvbuf) < 4 + 12 + 4 + 4 + msglen:
+                _, msgtype, msglen, checksum = MSG_HEADER.unpack_from(
+                    buf, offset)
+                msgtype = msgtype.split(b"\x00", 1)[0]
+                end = offset + MSG_HEADER.size + msglen
+                if len(buf) < end:
                     return None
-                msg = self.recvbuf[4 + 12 + 4 + 4:4 + 12 + 4 + 4 + msglen]
-                h = sha256(sha256(msg))
-                if checksum != h[:4]:
-                    raise ValueError("got bad checksum " + repr(self.recvbuf))
-                self.recvbuf = self.recvbuf[4 + 12 + 4 + 4 + msglen:]
+                # The view must be released before the buffer is resized
+                with memoryview(buf) as view:
+                    msg = bytes(view[offset + MSG_HEADER.size:end])
+                    frame = bytes(view[offset:end]) \
+                        if self.trace.wants_frames else None
+                if self.verify_checksum:
+                    h = sha256(sha256(msg))
+                    if checksum != h[:4]:
+                        raise ValueError(
+                            "got bad checksum " + repr(bytes(buf[offset:])))
+                self.trace.record("receive", msgtype, msglen, checksum, frame)
+                self._consume_recvbuf(end)
                 if msgtype not in MESSAGEMAP:
                     raise ValueError("Received unknown msgtype from {}:{}: '{}' {}".format(
                         self.dstaddr, self.dstport, msgtype, repr(msg)))
@@ -253,6 +302,22 @@ class P2PConnection(asyncio.Protocol):
             logger.exception('Error reading message:', repr(e))
             raise
 
+    def _consume_recvbuf(self, end):
+        """Mark the recv buffer as read up to end. Must be called with the
+        connection lock held."""
+        if end == len(self.recvbuf):
+            # Everything has been read, which is the common case: reset the
+            # buffer without copying anything.
+            self.recvbuf.clear()
+            self.recvbuf_offset = 0
+        elif end >= RECVBUF_COMPACT_SIZE and 2 * end >= len(self.recvbuf):
+            # Drop the consumed bytes once they make up most of the buffer,
+            # so the copy of the unread bytes is amortized.
+            del self.recvbuf[:end]
+            self.recvbuf_offset = 0
+        else:
+            self.recvbuf_offset = end
+
     def on_message(self, message):
         """Callback for processing a P2P payload. Must be overridden by derived class."""
         raise NotImplementedError
@@ -277,6 +342,7 @@ class P2PConnection(asyncio.Protocol):
         socket."""
         if not self.is_connected:
             raise IOError('Not connected')
+        self.trace.record_frame("send", raw_message_bytes)
 
         def maybe_write():
             if not self._transport:
@@ -284,7 +350,7 @@ class P2PConnection(asyncio.Protocol):
             if self._transport.is_closing():
                 return
             self._transport.write(raw_message_bytes)
-        NetworkThread.network_event_loop.call_soon_threadsafe(maybe_write)
+        self._loop.call_soon_threadsafe(maybe_write)
 
     # Class utility methods
 
@@ -303,7 +369,12 @@ class P2PConnection(asyncio.Protocol):
         return tmsg
 
     def _log_message(self, direction, msg):
-        """Logs a message being sent or received over the connection."""
+        """Logs a message being sent or received over the connection.
+
+        Building the repr of a message is expensive, so this is only done if
+        the trace level asks for it (see p2p_trace)."""
+        if not should_log_messages() or not logger.isEnabledFor(logging.DEBUG):
+            return
         if direction == "send":
             log_message = "Send message to "
         elif direction == "receive":
@@ -370,7 +441,7 @@ class P2PInterface(P2PConnection):
 
         We keep a count of how many of each message type has been received
         and the most recent message of each type."""
-        with p2p_lock:
+        with self.p2p_lock:
             try:
                 msgtype = message.msgtype.decode('ascii')
                 self.message_count[msgtype] += 1
@@ -481,7 +552,7 @@ class P2PInterface(P2PConnection):
                 assert self.is_connected
             return test_function_in()
 
-        wait_until_helper(test_function, timeout=timeout, lock=p2p_lock,
+        wait_until_helper(test_function, timeout=timeout, lock=self.p2p_lock,
                           timeout_factor=self.timeout_factor)
 
     def wait_for_disconnect(self, timeout=60):
@@ -585,39 +656,152 @@ class P2PInterface(P2PConnection):
         self.ping_counter += 1
 
 
+class GlobalP2PLock:
+    """The lock for synchronizing all data access between the networking
+    threads and the thread running the test logic.
+
+    With a single network event loop, the connections use the plain lock
+    wrapped by this one, so delivering a message doesn't run any python code
+    to acquire it.
+
+    With several network event loops, each connection has its own lock so the
+    connections of different loops don't serialize each other. This lock is
+    then kept as a compatibility shim: acquiring it acquires the locks of all
+    the connections, including the ones registered while it is held. Only
+    this lock ever holds several connection locks at once, and its holders are
+    serialized, so this can't deadlock."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections = weakref.WeakSet()
+        # Guards _connections and _held, and is held while acquiring the
+        # connection locks so no connection is registered in the meantime
+        self._connections_lock = threading.Lock()
+        # The connection locks held, None unless this lock is held
+        self._held = None
+
+    def connection_lock(self, conn):
+        """Returns the lock to be used by conn."""
+        if len(NetworkThread.network_event_loops) <= 1:
+            return self._lock
+        with self._connections_lock:
+            # Assign the lock before registering the connection, so this
+            # never attempts to acquire itself
+            conn.p2p_lock = threading.Lock()
+            self._connections.add(conn)
+            if self._held is not None:
+                # Nothing else knows of the new lock yet
+                conn.p2p_lock.acquire()
+                self._held.append(conn.p2p_lock)
+        return conn.p2p_lock
+
+    def acquire(self, blocking=True, timeout=-1):
+        deadline = time.monotonic() + timeout if timeout >= 0 else None
+        if not self._lock.acquire(blocking, timeout):
+            return False
+        with self._connections_lock:
+            locks = [conn.p2p_lock for conn in self._connections]
+            for i, lock in enumerate(locks):
+                if not blocking:
+                    acquired = lock.acquire(False)
+                elif deadline is not None:
+                    acquired = lock.acquire(True, max(0, deadline - time.monotonic()))
+                else:
+                    acquired = lock.acquire()
+                if not acquired:
+                    for held in reversed(locks[:i]):
+                        held.release()
+                    self._lock.release()
+                    return False
+            self._held = locks
+        return True
+
+    def release(self):
+        with self._connections_lock:
+            locks, self._held = self._held, None
+        for lock in reversed(locks):
+            lock.release()
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
 # One lock for synchronizing all data access between the networking thread (see
 # NetworkThread below) and the thread running the test logic.  For simplicity,
 # P2PConnection acquires this lock whenever delivering a message to a P2PInterface.
 # This lock should be acquired in the thread running the test logic to synchronize
 # access to any data shared with the P2PInterface or P2PConnection.
-p2p_lock = threading.Lock()
+p2p_lock = GlobalP2PLock()
 
 
 class NetworkThread(threading.Thread):
+    """Runs the event loops of the P2P connections.
+
+    The first event loop is run by this thread, and each additional one by a
+    helper thread. Note that the loops share the interpreter lock, so extra
+    loops help with the connections waiting on each other (socket I/O,
+    hashing, lock contention) rather than with pure python work."""
     network_event_loop = None
+    network_event_loops = []
+    _loop_counter = itertools.count()
 
-    def __init__(self):
+    def __init__(self, num_threads=1):
         super().__init__(name="NetworkThread")
-        # There is only one event loop and no more than one thread must be
-        # created
+        # There is only one set of event loops and no more than one thread
+        # must be created
         assert not self.network_event_loop
-
-        NetworkThread.network_event_loop = asyncio.new_event_loop()
+        assert num_threads >= 1
+
+        NetworkThread.network_event_loops = [
+            asyncio.new_event_loop() for _ in range(num_threads)]
+        NetworkThread.network_event_loop = self.network_event_loops[0]
+        NetworkThread._loop_counter = itertools.count()
+        self.helper_threads = [
+            threading.Thread(target=loop.run_forever,
+                             name="NetworkThread{}".format(i))
+            for i, loop in enumerate(self.network_event_loops[1:], 1)]
+
+    @classmethod
+    def next_event_loop(cls):
+        """Returns the event loop the next connection is assigned to."""
+        loops = cls.network_event_loops
+        return loops[next(cls._loop_counter) % len(loops)]
+
+    def start(self):
+        for thread in self.helper_threads:
+            thread.start()
+        super().start()
 
     def run(self):
         """Start the network thread."""
         self.network_event_loop.run_forever()
 
     def close(self, timeout=10):
-        """Close the connections and network event loop."""
-        self.network_event_loop.call_soon_threadsafe(
-            self.network_event_loop.stop)
-        wait_until_helper(lambda: not self.network_event_loop.is_running(),
-                          timeout=timeout)
-        self.network_event_loop.close()
-        self.join(timeout)
-        # Safe to remove event loop.
+        """Close the connections and network event loops."""
+        loops = self.network_event_loops
+        for loop in loops:
+            loop.call_soon_threadsafe(loop.stop)
+        # The stop callbacks are processed even if a loop didn't start
+        # running yet, so wait for the threads to exit before closing.
+        for thread in self.helper_threads + [self]:
+            if thread.ident is not None:
+                thread.join(timeout)
+        wait_until_helper(
+            lambda: not any(loop.is_running() for loop in loops),
+            timeout=timeout)
+        for loop in loops:
+            loop.close()
+        # Safe to remove event loops.
         NetworkThread.network_event_loop = None
+        NetworkThread.network_event_loops = []
 
 
 class P2PDataStore(P2PInterface):
@@ -692,7 +876,7 @@ class P2PDataStore(P2PInterface):
          - if success is False: assert that the node's tip doesn't advance
          - if reject_reason is set: assert that the correct reject message is logged"""
 
-        with p2p_lock:
+        with self.p2p_lock:
             for block in blocks:
                 self.block_store[block.sha256] = block
                 self.last_block_hash = block.sha256
@@ -738,7 +922,7 @@ class P2PDataStore(P2PInterface):
          - if expect_disconnect is True: Skip the sync with ping
          - if reject_reason is set: assert that the correct reject message is logged."""
 
-        with p2p_lock:
+        with self.p2p_lock:
             for tx in txs:
                 self.tx_store[tx.txid] = tx
 
@@ -787,7 +971,7 @@ class P2PTxInvStore(P2PInterface):
                 self.tx_invs_received[i.hash] += 1
 
     def get_invs(self):
-        with p2p_lock:
+        with self.p2p_lock:
             return list(self.tx_invs_received.keys())
 
     def wait_for_broadcast(self, txns, timeout=60):
@@ -799,3 +983,51 @@ class P2PTxInvStore(P2PInterface):
             [int(tx, 16) for tx in txns]), timeout=timeout)
         # Flush messages and wait for the getdatas to be processed
         self.sync_with_ping()
+
+
+class TestFrameworkP2P(unittest.TestCase):
+    def test_network_threads(self):
+        network_thread = NetworkThread(num_threads=3)
+        network_thread.start()
+        try:
+            loops = NetworkThread.network_event_loops
+            self.assertEqual(len(loops), 3)
+            self.assertEqual([NetworkThread.next_event_loop()
+                              for _ in range(4)], loops + loops[:1])
+
+            conns = [P2PConnection() for _ in range(2)]
+            for conn in conns:
+                conn.p2p_lock = p2p_lock.connection_lock(conn)
+            self.assertIsNot(conns[0].p2p_lock, conns[1].p2p_lock)
+
+            # The connection locks are independent
+            with conns[0].p2p_lock:
+                self.assertTrue(conns[1].p2p_lock.acquire(blocking=False))
+                conns[1].p2p_lock.release()
+                # The global lock can't be acquired while a connection is
+                # locked...
+                self.assertFalse(p2p_lock.acquire(blocking=False))
+                self.assertFalse(p2p_lock.locked())
+            # ... and it holds all the connection locks, including the ones
+            # registered while it is held
+            with p2p_lock:
+                conns.append(P2PConnection())
+                p2p_lock.connection_lock(conns[-1])
+                for conn in conns:
+                    self.assertFalse(conn.p2p_lock.acquire(blocking=False))
+            for conn in conns:
+                self.assertFalse(conn.p2p_lock.locked())
+            # The timeout applies to the connection locks
+            with conns[1].p2p_lock:
+                self.assertFalse(p2p_lock.acquire(timeout=0.01))
+                self.assertFalse(p2p_lock.locked())
+        finally:
+            network_thread.close()
+        self.assertIsNone(NetworkThread.network_event_loop)
+        # With a single loop the connections use the global lock
+        network_thread = NetworkThread()
+        network_thread.start()
+        try:
+            self.assertIs(p2p_lock.connection_lock(P2PConnection()), p2p_lock._lock)
+        finally:
+            network_thread.close()
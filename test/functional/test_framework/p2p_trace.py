@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Low overhead tracing of the P2P messages exchanged with the nodes.
+
+Every P2PConnection records a compact TraceRecord for each message it sends
+or receives into a fixed size ring buffer. The buffers are dumped to a file
+when a test fails, which gives the last messages seen on every connection
+without paying for a repr() of each message during the test.
+
+Optionally, the raw frames can also be written to a capture file, which can
+be read back with read_capture() (see the replay_p2p_capture.py tool).
+
+The capture file format is a header (CAPTURE_MAGIC followed by a 1-byte
+version), followed by records made of a CAPTURE_RECORD header and a payload:
+  - CAPTURE_CONNECT: the payload is the "host:port" of the connection
+  - CAPTURE_RECV/CAPTURE_SEND: the payload is the raw P2P frame"""
+
+import struct
+import threading
+import time
+import unittest
+from collections import deque, namedtuple
+from io import BytesIO
+
+# Trace levels
+# Nothing is recorded
+TRACE_NONE = "none"
+# Messages are recorded into the per-connection ring buffers
+TRACE_RING = "ring"
+# Messages are also logged with their repr() to the test framework log
+TRACE_LOG = "log"
+
+TRACE_LEVELS = [TRACE_NONE, TRACE_RING, TRACE_LOG]
+
+DEFAULT_RING_SIZE = 1000
+
+CAPTURE_MAGIC = b"P2PCAP"
+CAPTURE_VERSION = 1
+
+CAPTURE_CONNECT = 0
+CAPTURE_RECV = 1
+CAPTURE_SEND = 2
+
+# type, timestamp, connection id, payload size
+CAPTURE_RECORD = struct.Struct("<BdII")
+
+# The P2P frame header: magic, msgtype, payload size, checksum
+P2P_HEADER_SIZE = 4 + 12 + 4 + 4
+
+TraceRecord = namedtuple(
+    'TraceRecord', ['timestamp', 'direction', 'msgtype', 'size', 'hash'])
+TraceRecord.__doc__ = """A traced message.
+
+hash is the checksum from the P2P header (the first 4 bytes of the double
+sha256 of the payload), which is computed anyway and identifies the payload
+cheaply."""
+
+CaptureRecord = namedtuple(
+    'CaptureRecord', ['type', 'timestamp', 'conn_id', 'data'])
+
+
+class TraceConfig:
+    """Process-wide tracing configuration, set up by the test framework."""
+    level = TRACE_RING
+    ring_size = DEFAULT_RING_SIZE
+    capture = None
+
+    # All the traces created so far, in creation order
+    traces = []
+    # The types of all the messages exchanged so far, whatever the level, for
+    # the change impact analysis (see impact.py)
+    msgtypes = set()
+    lock = threading.Lock()
+
+
+def configure(level=TRACE_RING, ring_size=DEFAULT_RING_SIZE,
+              capture_path=None):
+    """Sets the tracing configuration for the connections created from now
+    on. The traces of the previous connections are discarded."""
+    assert level in TRACE_LEVELS
+    close_capture()
+    with TraceConfig.lock:
+        TraceConfig.level = level
+        TraceConfig.ring_size = ring_size
+        TraceConfig.traces = []
+        TraceConfig.msgtypes = set()
+        if capture_path is not None:
+            TraceConfig.capture = CaptureWriter(open(capture_path, 'wb'))
+
+
+def close_capture():
+    """Flushes and closes the capture file, if any."""
+    with TraceConfig.lock:
+        if TraceConfig.capture is not None:
+            TraceConfig.capture.close()
+            TraceConfig.capture = None
+
+
+def should_log_messages():
+    """Cheap check used to skip building the repr() of every message."""
+    return TraceConfig.level == TRACE_LOG
+
+
+class MessageTrace:
+    """The trace of the messages exchanged over a single connection."""
+
+    def __init__(self, dstaddr, dstport):
+        self.dstaddr = dstaddr
+        self.dstport = dstport
+        self.enabled = TraceConfig.level != TRACE_NONE
+        self.records = deque(maxlen=TraceConfig.ring_size)
+        self.capture = TraceConfig.capture
+        with TraceConfig.lock:
+            self.conn_id = len(TraceConfig.traces)
+            if self.enabled:
+                TraceConfig.traces.append(self)
+        if self.capture is not None:
+            self.capture.write(
+                CAPTURE_CONNECT, self.conn_id,
+                "{}:{}".format(dstaddr, dstport).encode())
+
+    @property
+    def wants_frames(self):
+        """Whether the raw frames should be passed to record()."""
+        return self.enabled and self.capture is not None
+
+    def record(self, direction, msgtype, size, checksum, frame=None):
+        """Records a message. The raw frame is only needed when capturing.
+        Only the message type is recorded if tracing is disabled."""
+        TraceConfig.msgtypes.add(msgtype)
+        if not self.enabled:
+            return
+        self.records.append(
+            TraceRecord(time.time(), direction, msgtype, size, checksum))
+        if self.capture is not None and frame is not None:
+            self.capture.write(
+                CAPTURE_SEND if direction == "send" else CAPTURE_RECV,
+                self.conn_id, frame)
+
+    def record_frame(self, direction, frame):
+        """Records a message from its raw P2P frame."""
+        if len(frame) < P2P_HEADER_SIZE:
+            return
+        msgtype = bytes(frame[4:4 + 12]).split(b"\x00", 1)[0]
+        if not self.enabled:
+            TraceConfig.msgtypes.add(msgtype)
+            return
+        size = struct.unpack_from("<I", frame, 4 + 12)[0]
+        checksum = bytes(frame[4 + 12 + 4:P2P_HEADER_SIZE])
+        self.record(direction, msgtype, size, checksum, frame)
+
+    def format_records(self):
+        """Returns the recorded messages as a list of log lines."""
+        return [format_record(self.conn_id, self.dstaddr, self.dstport, r)
+                for r in self.records]
+
+
+def format_timestamp(timestamp):
+    """Formats a timestamp the same way the node and framework logs do."""
+    return "{}.{:06d}Z".format(
+        time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(timestamp)),
+        int(timestamp * 1000000) % 1000000)
+
+
+def format_record(conn_id, dstaddr, dstport, record):
+    return "{} conn{} {}:{} {: <7} {: <12} {: >8} {}".format(
+        format_timestamp(record.timestamp), conn_id, dstaddr, dstport,
+        record.direction, record.msgtype.decode('ascii', 'replace'),
+        record.size, record.hash.hex())
+
+
+def get_msgtypes():
+    """Returns the types of all the messages exchanged so far."""
+    return sorted(msgtype.decode('ascii', 'replace')
+                  for msgtype in list(TraceConfig.msgtypes))
+
+
+def dump_traces(path):
+    """Writes the recorded messages of all the connections, merged in time
+    order, to path. Returns the number of records written."""
+    with TraceConfig.lock:
+        traces = list(TraceConfig.traces)
+    lines = []
+    for trace in traces:
+        lines.extend((record.timestamp, line) for record, line in zip(
+            list(trace.records), trace.format_records()))
+    lines.sort(key=lambda entry: entry[0])
+    with open(path, 'w', encoding='utf8') as f:
+        for _, line in lines:
+            f.write(line + "\n")
+    return len(lines)
+
+
+class CaptureWriter:
+    """Appends raw frames to a binary capture file object. Writes can come
+    from both the network thread and the test thread."""
+
+    def __init__(self, f):
+        self.lock = threading.Lock()
+        self.file = f
+        self.file.write(CAPTURE_MAGIC + bytes([CAPTURE_VERSION]))
+
+    def write(self, record_type, conn_id, data):
+        header = CAPTURE_RECORD.pack(
+            record_type, time.time(), conn_id, len(data))
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(header)
+            self.file.write(data)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def read_capture(f):
+    """Generator returning the CaptureRecords of a capture file object."""
+    magic = f.read(len(CAPTURE_MAGIC) + 1)
+    if magic[:-1] != CAPTURE_MAGIC:
+        raise ValueError("Not a P2P capture file")
+    if magic[-1] != CAPTURE_VERSION:
+        raise ValueError(
+            "Unsupported P2P capture version {}".format(magic[-1]))
+    while True:
+        header = f.read(CAPTURE_RECORD.size)
+        if len(header) < CAPTURE_RECORD.size:
+            # A truncated header means the capture was interrupted
+            return
+        record_type, timestamp, conn_id, size = CAPTURE_RECORD.unpack(header)
+        data = f.read(size)
+        if len(data) < size:
+            return
+        yield CaptureRecord(record_type, timestamp, conn_id, data)
+
+
+class TestFrameworkP2PTrace(unittest.TestCase):
+    def test_ring_buffer(self):
+        configure(TRACE_RING, ring_size=3)
+        trace = MessageTrace("127.0.0.1", 1234)
+        for i in range(5):
+            trace.record("send", b"ping", 8, bytes([i] * 4))
+        self.assertEqual([r.hash for r in trace.records],
+                         [bytes([i] * 4) for i in range(2, 5)])
+
+        configure(TRACE_NONE)
+        trace = MessageTrace("127.0.0.1", 1234)
+        trace.record("send", b"ping", 8, b"\x00" * 4)
+        self.assertEqual(len(trace.records), 0)
+        self.assertEqual(TraceConfig.traces, [])
+        # The message types are recorded anyway
+        self.assertEqual(get_msgtypes(), ["ping"])
+        configure()
+
+    def test_capture_roundtrip(self):
+        f = BytesIO()
+        writer = CaptureWriter(f)
+        frame = b"\xec\xf2\xe5\xe7" + b"ping" + b"\x00" * 8 + \
+            struct.pack("<I", 8) + b"\x01\x02\x03\x04" + b"\x00" * 8
+        writer.write(CAPTURE_CONNECT, 0, b"127.0.0.1:1234")
+        writer.write(CAPTURE_SEND, 0, frame)
+        # Truncated record
+        f.write(CAPTURE_RECORD.pack(CAPTURE_RECV, 0, 0, 100) + b"\x00")
+
+        records = list(read_capture(BytesIO(f.getvalue())))
+        self.assertEqual([r.type for r in records],
+                         [CAPTURE_CONNECT, CAPTURE_SEND])
+        self.assertEqual(records[0].data, b"127.0.0.1:1234")
+        self.assertEqual(records[1].data, frame)
+
+        configure(TRACE_RING)
+        trace = MessageTrace("127.0.0.1", 1234)
+        trace.record_frame("send", frame)
+        self.assertEqual(trace.records[0][1:],
+                         ("send", b"ping", 8, b"\x01\x02\x03\x04"))
+        configure()
@@ -17,7 +17,7 @@ import time
 from enum import Enum
 from typing import Optional
 
-from . import coverage
+from . import coverage, impact, node_resources, p2p_trace
 from .authproxy import JSONRPCException
 from .avatools import get_proof_ids
 from .p2p import NetworkThread
@@ -166,14 +166,30 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                             help="The seed to use for assigning port numbers (default: current process id)")
         parser.add_argument("--coveragedir", dest="coveragedir",
                             help="Write tested RPC commands into this directory")
+        parser.add_argument("--impactdir", dest="impactdir",
+                            help="Write the RPC commands, P2P message types and test framework modules used by the test into this directory, for the change impact analysis of test_runner.py")
+        parser.add_argument("--rpctelemetrydir", dest="rpctelemetrydir",
+                            help="Write the call count, latency and payload sizes of the RPC commands into this directory")
         parser.add_argument("--configfile", dest="configfile", default=os.path.abspath(os.path.dirname(os.path.realpath(
             __file__)) + "/../../config.ini"), help="Location of the test framework config file (default: %(default)s)")
         parser.add_argument("--pdbonfailure", dest="pdbonfailure", default=False, action="store_true",
                             help="Attach a python debugger if test fails")
         parser.add_argument("--usecli", dest="usecli", default=False, action="store_true",
                             help="use lotus-cli instead of RPC for all commands")
+        parser.add_argument("--p2ptrace", dest="p2ptrace", default=p2p_trace.TRACE_RING, choices=p2p_trace.TRACE_LEVELS,
+                            help="how the P2P messages exchanged with the nodes are traced: 'none' disables tracing, 'ring' keeps the last --p2ptracesize messages per connection and dumps them to p2p_trace.log on failure, 'log' also logs every message to the test framework log (default: %(default)s)")
+        parser.add_argument("--p2ptracesize", dest="p2ptracesize", default=p2p_trace.DEFAULT_RING_SIZE, type=int,
+                            help="number of P2P messages kept per connection by --p2ptrace (default: %(default)s)")
+        parser.add_argument("--p2pcapture", dest="p2pcapture", default=False, action="store_true",
+                            help="write the raw P2P frames exchanged with the nodes to p2p.capture in the test directory. Use replay_p2p_capture.py to read it back")
+        parser.add_argument("--networkthreads", dest="network_threads", default=1, type=int,
+                            help="number of threads running the event loops of the P2P connections. With more than one, the connections are spread over the threads and each connection is guarded by its own lock (default: %(default)s)")
         parser.add_argument("--perf", dest="perf", default=False, action="store_true",
                             help="profile running nodes with perf for the duration of the test")
+        parser.add_argument("--resourcesampling", dest="resourcesampling", type=float,
+                            help="sample the CPU time, memory, file descriptors and I/O of the nodes every RESOURCESAMPLING seconds into resources.log, beside their debug.log")
+        parser.add_argument("--resourcesdir", dest="resourcesdir",
+                            help="write a summary of the resources used by each node into this directory. Implies --resourcesampling={}".format(node_resources.DEFAULT_INTERVAL))
         parser.add_argument("--valgrind", dest="valgrind", default=False, action="store_true",
                             help="run nodes under the valgrind memory error detector: expect at least a ~10x slowdown, valgrind 3.14 or later required")
         parser.add_argument("--randomseed", type=int,
@@ -250,8 +266,24 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         random.seed(seed)
         self.log.debug("PRNG seed is: {}".format(seed))
 
+        coverage.configure_telemetry(
+            self.options.rpctelemetrydir,
+            record_methods=self.options.impactdir is not None)
+
+        resource_sampling = self.options.resourcesampling
+        if resource_sampling is None and self.options.resourcesdir is not None:
+            resource_sampling = node_resources.DEFAULT_INTERVAL
+        node_resources.configure(
+            resource_sampling, self.options.resourcesdir)
+
+        p2p_trace.configure(
+            self.options.p2ptrace,
+            self.options.p2ptracesize,
+            os.path.join(self.options.tmpdir, 'p2p.capture')
+            if self.options.p2pcapture else None)
+
         self.log.debug('Setting up network thread')
-        self.network_thread = NetworkThread()
+        self.network_thread = NetworkThread(self.options.network_threads)
         self.network_thread.start()
 
         if self.options.usecli:
@@ -273,6 +305,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
 
         self.log.debug('Closing down network thread')
         self.network_thread.close()
+        p2p_trace.close_capture()
         if not self.options.noshutdown:
             self.log.info("Stopping nodes")
             if self.nodes:
@@ -282,12 +315,23 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                 node.cleanup_on_exit = False
             self.log.info(
                 "Note: lotusds were not stopped and may still be running")
+        node_resources.stop_samplers()
+        coverage.flush()
+        if self.options.impactdir is not None:
+            impact.write_impact(
+                self.options.impactdir,
+                os.path.basename(sys.argv[0]),
+                coverage.get_called_methods(),
+                p2p_trace.get_msgtypes(),
+                [name.split('.', 1)[1] for name in list(sys.modules)
+                 if name.startswith('test_framework.')])
 
         should_clean_up = (
             not self.options.nocleanup and
             not self.options.noshutdown and
             self.success != TestStatus.FAILED and
-            not self.options.perf
+            not self.options.perf and
+            not self.options.p2pcapture
         )
         if should_clean_up:
             self.log.info("Cleaning up {} on exit".format(self.options.tmpdir))
@@ -297,6 +341,11 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                 "Not cleaning up dir {} due to perf data".format(
                     self.options.tmpdir))
             cleanup_tree_on_exit = False
+        elif self.options.p2pcapture:
+            self.log.warning(
+                "Not cleaning up dir {} due to P2P capture data".format(
+                    self.options.tmpdir))
+            cleanup_tree_on_exit = False
         else:
             self.log.warning(
                 "Not cleaning up dir {}".format(self.options.tmpdir))
@@ -312,6 +361,11 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             self.log.error(
                 "Test failed. Test logging available at {}/test_framework.log".format(self.options.tmpdir))
             self.log.error("")
+            trace_file = os.path.join(self.options.tmpdir, 'p2p_trace.log')
+            if p2p_trace.dump_traces(trace_file):
+                self.log.error(
+                    "The last P2P messages of each connection are available at {}".format(trace_file))
+                self.log.error("")
             self.log.error("Hint: Call {} '{}' to consolidate all logs".format(os.path.normpath(
                 os.path.dirname(os.path.realpath(__file__)) + "/../combine_logs.py"), self.options.tmpdir))
             self.log.error("")
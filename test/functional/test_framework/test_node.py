@@ -21,6 +21,7 @@ import time
 import urllib.parse
 from enum import Enum
 
+from . import node_resources
 from .authproxy import JSONRPCException
 from .descriptors import descsum_create
 from .messages import COIN, MY_SUBVERSION, CTransaction, FromHex
@@ -147,6 +148,7 @@ class TestNode():
         self.cleanup_on_exit = True
         # Cache perf subprocesses here by their data output filename.
         self.perf_subprocesses = {}
+        self.resource_sampler = None
         self.p2ps = []
         self.timeout_factor = timeout_factor
 
@@ -287,6 +289,9 @@ class TestNode():
         if self.start_perf:
             self._start_perf()
 
+        self.resource_sampler = node_resources.start_sampler(
+            self.process.pid, self.index, os.path.join(self.datadir, self.chain))
+
     def wait_for_rpc_connection(self):
         """Sets up an RPC connection to the lotusd process. Returns False if unable to connect."""
         # Poll at a rate of four times per second
@@ -412,6 +417,9 @@ class TestNode():
         if not self.running:
             return
         self.log.debug("Stopping node")
+        if self.resource_sampler is not None:
+            # Last sample before the process exits
+            self.resource_sampler.sample()
         try:
             self.stop(wait=wait)
         except http.client.CannotSendRequest:
@@ -454,6 +462,7 @@ class TestNode():
         self.process = None
         self.rpc_connected = False
         self.rpc = None
+        self._stop_resource_sampler()
         self.log.debug("Node stopped")
         return True
 
@@ -597,6 +606,12 @@ class TestNode():
             report_cmd = "perf report -i {}".format(output_path)
             self.log.info("See perf output by running '{}'".format(report_cmd))
 
+    def _stop_resource_sampler(self):
+        """Stop the resource sampler of the node, if any."""
+        if self.resource_sampler is not None:
+            self.resource_sampler.stop()
+            self.resource_sampler = None
+
     def assert_start_raises_init_error(
             self, extra_args=None, expected_msg=None, match=ErrorMatch.FULL_TEXT, *args, **kwargs):
         """Attempt to start the node and expect it to raise an error.
@@ -618,6 +633,7 @@ class TestNode():
                 self.log.debug('lotusd failed to start: {}'.format(e))
                 self.running = False
                 self.process = None
+                self._stop_resource_sampler()
                 # Check stderr for expected message
                 if expected_msg is not None:
                     log_stderr.seek(0)
@@ -325,10 +325,8 @@ def get_rpc_proxy(url, node_number, *, timeout=None, coveragedir=None):
     proxy = AuthServiceProxy(url, **proxy_kwargs)
     proxy.url = url  # store URL on proxy for info
 
-    coverage_logfile = coverage.get_filename(
-        coveragedir, node_number) if coveragedir else None
-
-    return coverage.AuthServiceProxyWrapper(proxy, coverage_logfile)
+    return coverage.AuthServiceProxyWrapper(
+        proxy, coverage.get_rpc_log(coveragedir, node_number))
 
 
 def p2p_port(n):
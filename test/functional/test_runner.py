@@ -16,12 +16,15 @@ For a description of arguments recognized by test scripts, see
 import argparse
 import configparser
 import datetime
+import hashlib
 import json
 import logging
 import multiprocessing
 import os
+import platform
 import re
 import shutil
+import statistics
 import subprocess
 import sys
 import tempfile
@@ -29,9 +32,21 @@ import threading
 import time
 import unittest
 import xml.etree.ElementTree as ET
-from collections import deque
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from queue import Empty, Queue
 
+from test_framework.coverage import RPCStats, read_telemetry
+from test_framework.flamegraph import (
+    collapse_perf_script,
+    read_folded,
+    render_svg,
+    self_time_changes,
+    write_folded,
+)
+from test_framework.impact import ImpactMap, get_changes, read_impacts
+from test_framework.node_resources import read_summaries
+
 # Formatting. Default colors to empty strings.
 BOLD, GREEN, RED, GREY = ("", ""), ("", ""), ("", ""), ("", "")
 try:
@@ -74,11 +89,33 @@ if os.name != 'nt' or sys.getwindowsversion() >= (10, 0, 14393):  # type: ignore
 TEST_EXIT_PASSED = 0
 TEST_EXIT_SKIPPED = 77
 
+# Number of RPC methods listed in the --rpctelemetry report
+RPC_TELEMETRY_REPORT_SIZE = 20
+
+# Number of functions listed in the --perfbaseline report
+PERF_REPORT_SIZE = 15
+
+DEFAULT_RESOURCES_THRESHOLD = 20
+# The node resources compared against the --resourcesbaseline, with the
+# minimum increase to report, so the noise on small values is ignored
+RESOURCES_MIN_INCREASE = {
+    'peak_rss_kb': 10 * 1024,
+    'write_bytes': 10 * 1024 * 1024,
+}
+
 TEST_FRAMEWORK_MODULES = [
     "address",
     "blocktools",
+    "coverage",
+    "flamegraph",
+    "impact",
+    "loadgen",
     "messages",
     "muhash",
+    "nng",
+    "node_resources",
+    "p2p",
+    "p2p_trace",
     "script",
     "util",
 ]
@@ -86,8 +123,13 @@ TEST_FRAMEWORK_MODULES = [
 NON_SCRIPTS = [
     # These are python files that live in the functional tests directory, but
     # are not test scripts.
+    "bench_mempool.py",
+    "bench_notifications.py",
+    "bench_p2p_recv.py",
     "combine_logs.py",
     "create_cache.py",
+    "p2p_loadgen.py",
+    "replay_p2p_capture.py",
     "test_runner.py",
 ]
 
@@ -117,6 +159,18 @@ TEST_PARAMS = {
 DEFAULT_EXTENDED_CUTOFF = 40
 DEFAULT_JOBS = (multiprocessing.cpu_count() // 3) + 1
 
+# Number of runs kept in the timing history
+TIMING_HISTORY_SIZE = 20
+# Minimum number of runs on the same machine to use the timing statistics
+TIMING_HISTORY_MIN_RUNS = 3
+# A test is reported as slower when its duration exceeds the median of the
+# previous runs by more than SLOWDOWN_MAD_FACTOR times the (normally scaled)
+# median absolute deviation, and by at least SLOWDOWN_MIN_RATIO and
+# SLOWDOWN_MIN_SECONDS
+SLOWDOWN_MAD_FACTOR = 3
+SLOWDOWN_MIN_RATIO = 0.1
+SLOWDOWN_MIN_SECONDS = 1
+
 
 class TestCase():
     """
@@ -199,12 +253,26 @@ def main():
                              'and all test nodes.')
     parser.add_argument('--coverage', action='store_true',
                         help='generate a basic coverage report for the RPC interface')
+    parser.add_argument('--perf', action='store_true',
+                        help='profile the nodes of every test with perf, and merge the profiles into perf.folded and flamegraph.svg in the temporary directory')
+    parser.add_argument('--perfbaseline', metavar='FILE',
+                        help='with --perf, render the changes since the folded profile FILE into flamegraph-diff.svg. The profile is saved to FILE if it does not exist')
+    parser.add_argument('--resources', action='store_true',
+                        help='sample the resources used by the nodes and print the peak RSS, CPU time and I/O of each test')
+    parser.add_argument('--resourcesbaseline', metavar='FILE',
+                        help='with --resources, flag the tests whose node memory or I/O grew over the baseline saved in FILE. The baseline is recorded if FILE does not exist')
+    parser.add_argument('--resourcesthreshold', type=float, default=DEFAULT_RESOURCES_THRESHOLD, metavar='PCT',
+                        help='the growth in percent over the --resourcesbaseline that gets flagged')
+    parser.add_argument('--rpctelemetry', action='store_true',
+                        help='report the RPC commands the tests spend the most time in, and save the per method statistics to rpc_telemetry.json in the temporary directory')
     parser.add_argument(
         '--exclude', '-x', help='specify a comma-separated-list of scripts to exclude.')
     parser.add_argument('--extended', action='store_true',
                         help='run the extended test suite in addition to the basic tests')
     parser.add_argument('--cutoff', type=int, default=DEFAULT_EXTENDED_CUTOFF,
                         help='set the cutoff runtime for what tests get run')
+    parser.add_argument('--changed-since', metavar='REV',
+                        help='run the tests affected by the changes since the git revision REV first, then the other tests. The tests affected are derived from the RPC commands, P2P messages and test framework modules they used in the previous runs')
     parser.add_argument('--help', '-h', '-?',
                         action='store_true', help='print help text and exit')
     parser.add_argument('--jobs', '-j', type=int, default=DEFAULT_JOBS,
@@ -315,7 +383,12 @@ def main():
 
     # Add test parameters and remove long running tests if needed
     test_list = get_tests_to_run(
-        test_list, TEST_PARAMS, cutoff, src_timings)
+        test_list, TEST_PARAMS, cutoff, src_timings, build_timings)
+
+    test_impact = TestImpact(os.path.join(build_dir, 'test', 'impact.json'))
+    if args.changed_since:
+        test_list = test_impact.prioritize(
+            test_list, get_changes(src_dir, args.changed_since), args.changed_since)
 
     if not test_list:
         print("No valid test scripts specified. Check that your test is in one "
@@ -345,6 +418,12 @@ def main():
         num_jobs=args.jobs,
         test_suite_name=args.testsuitename,
         enable_coverage=args.coverage,
+        enable_rpc_telemetry=args.rpctelemetry,
+        resources=NodeResources(args.resourcesbaseline,
+                                args.resourcesthreshold) if args.resources else None,
+        perf=PerfProfiles(tmpdir, args.jobs,
+                          args.perfbaseline) if args.perf else None,
+        test_impact=test_impact,
         args=passon_args,
         combined_logs_len=args.combinedlogslen,
         build_timings=build_timings,
@@ -353,7 +432,7 @@ def main():
 
 
 def run_tests(test_list, build_dir, tests_dir, junitoutput, tmpdir, num_jobs, test_suite_name,
-              enable_coverage=False, args=None, combined_logs_len=0, build_timings=None, failfast=False):
+              enable_coverage=False, enable_rpc_telemetry=False, resources=None, perf=None, test_impact=None, args=None, combined_logs_len=0, build_timings=None, failfast=False):
     args = args or []
 
     # Warn if lotusd is already running
@@ -397,6 +476,25 @@ def run_tests(test_list, build_dir, tests_dir, junitoutput, tmpdir, num_jobs, te
     else:
         coverage = None
 
+    if enable_rpc_telemetry:
+        rpc_telemetry = RPCTelemetry()
+        flags.append(rpc_telemetry.flag)
+        logging.debug(
+            "Initializing RPC telemetry directory at {}".format(rpc_telemetry.dir))
+    else:
+        rpc_telemetry = None
+
+    if perf:
+        flags.append(perf.flag)
+
+    if test_impact:
+        flags.append(test_impact.flag)
+
+    if resources:
+        flags.append(resources.flag)
+        logging.debug(
+            "Initializing node resources directory at {}".format(resources.dir))
+
     if len(test_list) > 1 and num_jobs > 1:
         # Populate cache
         try:
@@ -424,6 +522,7 @@ def run_tests(test_list, build_dir, tests_dir, junitoutput, tmpdir, num_jobs, te
             test_suite_name)
 
     if (build_timings is not None):
+        print_slowdowns(build_timings.get_slowdowns(test_results))
         build_timings.save_timings(test_results)
 
     if coverage:
@@ -434,6 +533,25 @@ def run_tests(test_list, build_dir, tests_dir, junitoutput, tmpdir, num_jobs, te
     else:
         coverage_passed = True
 
+    if rpc_telemetry:
+        rpc_telemetry.report(os.path.join(tmpdir, 'rpc_telemetry.json'))
+
+        logging.debug("Cleaning up RPC telemetry data")
+        rpc_telemetry.cleanup()
+
+    if perf:
+        perf.report()
+
+    if test_impact:
+        test_impact.save(test_results)
+        test_impact.cleanup()
+
+    if resources:
+        resources.report()
+
+        logging.debug("Cleaning up node resources data")
+        resources.cleanup()
+
     # Clear up the temp directory if all subdirectories are gone
     if not os.listdir(tmpdir):
         os.rmdir(tmpdir)
@@ -701,7 +819,8 @@ def check_script_prefixes(all_scripts):
                 len(bad_script_names), EXPECTED_VIOLATION_COUNT)
 
 
-def get_tests_to_run(test_list, test_params, cutoff, src_timings):
+def get_tests_to_run(test_list, test_params, cutoff,
+                     src_timings, build_timings=None):
     """
     Returns only test that will not run longer that cutoff.
     Long running tests are returned first to favor running tests in parallel
@@ -709,9 +828,13 @@ def get_tests_to_run(test_list, test_params, cutoff, src_timings):
     """
 
     def get_test_time(test):
-        # Return 0 if test is unknown to always run it
-        return next(
-            (x['time'] for x in src_timings.existing_timings if x['name'] == test), 0)
+        # Use the median duration from the history of this machine if there
+        # is enough of it. Return 0 if test is unknown to always run it
+        if build_timings is not None:
+            median = build_timings.get_median_time(test)
+            if median is not None:
+                return median
+        return src_timings.get_test_time(test)
 
     # Some tests must also be run with additional parameters. Add them to the
     # list.
@@ -803,6 +926,359 @@ class RPCCoverage():
         return all_cmds - covered_cmds
 
 
+class RPCTelemetry():
+    """
+    RPC telemetry reporting utilities for test_runner.
+
+    Each test script subprocess writes the call count, latency histogram and
+    payload sizes of the RPC commands it called, per node, into a particular
+    directory. After all tests complete, they are merged per RPC command
+    across the suite.
+
+    See also: test/functional/test_framework/coverage.py
+
+    """
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix="rpc_telemetry")
+        self.flag = '--rpctelemetrydir={}'.format(self.dir)
+
+    def get_stats(self):
+        """
+        Return the merged RPCStats of each RPC command, and the RPCStats of
+        each RPC command per test.
+
+        """
+        stats = {}
+        tests = {}
+        for test, _, method, method_stats in read_telemetry(self.dir):
+            stats.setdefault(method, RPCStats()).merge(method_stats)
+            tests.setdefault(method, {}).setdefault(
+                test, RPCStats()).merge(method_stats)
+        return stats, tests
+
+    def report(self, json_file):
+        """
+        Print out the RPC commands the tests spent the most time in, and save
+        the statistics of all the RPC commands to json_file.
+
+        """
+        stats, tests = self.get_stats()
+        if not stats:
+            print("No RPC telemetry recorded.")
+            return
+
+        def to_json(method_stats):
+            return {
+                'calls': method_stats.calls,
+                'time': round(method_stats.time, 6),
+                'p50': round(method_stats.percentile(50), 6),
+                'p99': round(method_stats.percentile(99), 6),
+                'max': round(method_stats.max_time, 6),
+                'request_bytes': method_stats.request_bytes,
+                'response_bytes': method_stats.response_bytes,
+            }
+
+        with open(json_file, 'w', encoding="utf8") as f:
+            json.dump({
+                method: dict(to_json(method_stats), tests={
+                    test: to_json(test_stats) for test, test_stats in tests[method].items()})
+                for method, method_stats in stats.items()
+            }, f, indent=True, sort_keys=True)
+
+        slowest = sorted(stats.items(), key=lambda item: (-item[1].time, item[0]))[
+            :RPC_TELEMETRY_REPORT_SIZE]
+        max_len_name = max(len(method) for method, _ in slowest)
+        header = "{} | {:>8} | {:>10} | {:>9} | {:>9} | {:>9} | {:>10} | {:>10} | {}".format(
+            "RPC".ljust(max_len_name), "CALLS", "TIME (s)", "P50 (ms)", "P99 (ms)",
+            "MAX (ms)", "REQ (B)", "RESP (B)", "SLOWEST TEST")
+        print("\n" + BOLD[1] + header + BOLD[0])
+        for method, method_stats in slowest:
+            slowest_test = max(tests[method].items(),
+                               key=lambda item: (item[1].time, item[0]))[0]
+            print("{} | {:>8} | {:>10.3f} | {:>9.3f} | {:>9.3f} | {:>9.3f} | {:>10} | {:>10} | {}".format(
+                method.ljust(max_len_name), method_stats.calls, method_stats.time,
+                method_stats.percentile(50) * 1000, method_stats.percentile(99) * 1000,
+                method_stats.max_time * 1000,
+                method_stats.request_bytes // method_stats.calls,
+                method_stats.response_bytes // method_stats.calls, slowest_test))
+        print("\nRPC telemetry of all the RPC commands saved to {}".format(json_file))
+
+    def cleanup(self):
+        return shutil.rmtree(self.dir)
+
+
+class TestImpact():
+    """
+    Change impact utilities for test_runner.
+
+    Each test script subprocess writes the RPC commands, P2P message types and
+    test framework modules it used into a particular directory. After all
+    tests complete, they are merged into the impact map of the previous runs,
+    which is used to find the tests affected by a change. The map is updated
+    on every run, not only with --changed-since, so it is up to date when the
+    option is used.
+
+    See also: test/functional/test_framework/impact.py
+
+    """
+
+    def __init__(self, impact_file):
+        self.impact_map = ImpactMap(impact_file)
+        self.dir = tempfile.mkdtemp(prefix="impact")
+        self.flag = '--impactdir={}'.format(self.dir)
+
+    def prioritize(self, test_list, changes, rev):
+        """
+        Return the test list with the tests affected by the changes first,
+        keeping the order of the list otherwise.
+
+        """
+        scripts = set(test.split()[0] for test in test_list)
+        affected, unknown = self.impact_map.get_affected(scripts, changes)
+        first = [test for test in test_list
+                 if test.split()[0] in affected | unknown]
+        print("{} of {} tests affected by the changes since {}, {} without impact data, running them first".format(
+            len(affected), len(scripts), rev, len(unknown)))
+        if changes.unmapped:
+            print("{}WARNING!{} The impact of {} changed files is unknown, e.g. {}".format(
+                BOLD[1], BOLD[0], len(changes.unmapped), ", ".join(changes.unmapped[:3])))
+        return first + [test for test in test_list if test not in first]
+
+    def save(self, test_results):
+        """
+        Update the impact map with the records of the scripts that passed.
+
+        """
+        failed = set(test.name.split()[0] for test in test_results
+                     if test.status == 'Failed')
+        passed = set(test.name.split()[0] for test in test_results
+                     if test.status == 'Passed') - failed
+        self.impact_map.update([record for record in read_impacts(self.dir)
+                                if record['test'] in passed])
+        if passed:
+            self.impact_map.save()
+
+    def cleanup(self):
+        return shutil.rmtree(self.dir)
+
+
+class PerfProfiles():
+    """
+    Perf profile aggregation utilities for test_runner.
+
+    Each test script subprocess profiles its nodes with perf for the duration
+    of the test, and leaves the perf data in the node data directories. After
+    all tests complete, the profiles are collapsed into folded stacks per test
+    and merged into a profile of the suite, rendered as a flamegraph.
+
+    See also: test/functional/test_framework/flamegraph.py
+
+    """
+
+    def __init__(self, tmpdir, num_jobs, baseline_file=None):
+        self.tmpdir = tmpdir
+        self.num_jobs = max(1, num_jobs)
+        self.baseline_file = baseline_file
+        self.flag = '--perf'
+
+    def find_perf_data(self):
+        """
+        Return the perf data files recorded for the whole duration of the
+        tests, as a list of (test directory, perf data file).
+
+        """
+        perf_data = []
+        for root, _, files in os.walk(self.tmpdir):
+            for filename in files:
+                if filename.startswith('test.perf.data.'):
+                    testdir = os.path.relpath(
+                        root, self.tmpdir).split(os.sep)[0]
+                    perf_data.append(
+                        (testdir, os.path.join(root, filename)))
+        return sorted(perf_data)
+
+    @staticmethod
+    def collapse(perf_data_file):
+        process = subprocess.Popen(
+            ['perf', 'script', '-i', perf_data_file],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True, errors='replace')
+        folded = collapse_perf_script(process.stdout)
+        process.wait()
+        return folded
+
+    def report(self):
+        """
+        Write the folded profile of each test and of the suite, render the
+        flamegraphs and print out the functions that got hotter since the
+        baseline.
+
+        """
+        perf_data = self.find_perf_data()
+        if not perf_data:
+            print("No perf data recorded.")
+            return
+
+        tests = {}
+        with ThreadPoolExecutor(max_workers=self.num_jobs) as executor:
+            for (testdir, _), folded in zip(perf_data, executor.map(
+                    self.collapse, [path for _, path in perf_data])):
+                tests.setdefault(testdir, Counter()).update(folded)
+
+        suite = Counter()
+        for testdir, folded in tests.items():
+            with open(os.path.join(self.tmpdir, testdir, 'perf.folded'), 'w', encoding="utf8") as f:
+                write_folded(f, folded)
+            suite.update(folded)
+
+        folded_file = os.path.join(self.tmpdir, 'perf.folded')
+        with open(folded_file, 'w', encoding="utf8") as f:
+            write_folded(f, suite)
+        flamegraph_file = os.path.join(self.tmpdir, 'flamegraph.svg')
+        with open(flamegraph_file, 'w', encoding="utf8") as f:
+            f.write(render_svg(suite, "Functional tests ({} tests, {} samples)".format(
+                len(tests), sum(suite.values()))))
+        print("\nPerf profile of {} tests saved to {} and {}".format(
+            len(tests), folded_file, flamegraph_file))
+
+        if self.baseline_file is None:
+            return
+
+        if not os.path.isfile(self.baseline_file):
+            shutil.copyfile(folded_file, self.baseline_file)
+            print("Perf baseline recorded to {}".format(self.baseline_file))
+            return
+
+        with open(self.baseline_file, 'r', encoding="utf8") as f:
+            baseline = read_folded(f)
+        diff_file = os.path.join(self.tmpdir, 'flamegraph-diff.svg')
+        with open(diff_file, 'w', encoding="utf8") as f:
+            f.write(render_svg(suite, "Functional tests, changes since {}".format(
+                self.baseline_file), baseline))
+        print("Differential flamegraph saved to {}".format(diff_file))
+
+        hotter = [(function, delta) for function, delta in self_time_changes(
+            suite, baseline)[:PERF_REPORT_SIZE] if delta > 0]
+        if hotter:
+            print("\n" + BOLD[1] + "Hotter functions (share of the samples spent in the function itself):" + BOLD[0])
+            for function, delta in hotter:
+                print("  {:+.2f}% {}".format(100 * delta, function))
+
+
+class NodeResources():
+    """
+    Node resources reporting utilities for test_runner.
+
+    Each test script subprocess samples the resources used by its nodes and
+    writes a summary per node run into a particular directory. After all tests
+    complete, the summaries are aggregated per test and optionally compared
+    against a baseline.
+
+    See also: test/functional/test_framework/node_resources.py
+
+    """
+
+    def __init__(self, baseline_file=None, threshold=DEFAULT_RESOURCES_THRESHOLD):
+        self.dir = tempfile.mkdtemp(prefix="node_resources")
+        self.flag = '--resourcesdir={}'.format(self.dir)
+        self.baseline_file = baseline_file
+        self.threshold = threshold
+
+    def get_usage(self):
+        """
+        Return the resources used by the nodes of each test: the peak RSS of
+        the nodes, and the CPU time and I/O summed over the nodes.
+
+        """
+        usage = {}
+        for summary in read_summaries(self.dir):
+            test_usage = usage.setdefault(summary['test'], {
+                'peak_rss_kb': 0,
+                'cpu_seconds': 0.0,
+                'read_bytes': 0,
+                'write_bytes': 0,
+            })
+            test_usage['peak_rss_kb'] = max(
+                test_usage['peak_rss_kb'], summary['peak_rss_kb'])
+            test_usage['cpu_seconds'] = round(
+                test_usage['cpu_seconds'] + summary['cpu_seconds'], 2)
+            test_usage['read_bytes'] += summary['read_bytes']
+            test_usage['write_bytes'] += summary['write_bytes']
+        return usage
+
+    def get_regressions(self, usage, baseline):
+        """
+        Return the (test, resource, baseline value, value) for the resources
+        that grew more than the threshold over the baseline.
+
+        """
+        regressions = []
+        for test, test_usage in sorted(usage.items()):
+            if test not in baseline:
+                continue
+            for resource, min_increase in sorted(RESOURCES_MIN_INCREASE.items()):
+                base, value = baseline[test].get(resource, 0), test_usage[resource]
+                if value - base >= min_increase and value > base * \
+                        (1 + self.threshold / 100):
+                    regressions.append((test, resource, base, value))
+        return regressions
+
+    def report(self):
+        """
+        Print out the resources used by each test, and the tests that grew
+        over the baseline.
+
+        """
+        usage = self.get_usage()
+        if not usage:
+            print("No node resources recorded.")
+            return
+
+        max_len_name = max(len(test) for test in usage)
+        print("\n" + BOLD[1] + "{} | {:>13} | {:>8} | {:>9} | {:>12}".format(
+            "TEST".ljust(max_len_name), "PEAK RSS (MB)", "CPU (s)",
+            "READ (MB)", "WRITTEN (MB)") + BOLD[0])
+        for test, test_usage in sorted(usage.items()):
+            print("{} | {:>13.1f} | {:>8.2f} | {:>9.1f} | {:>12.1f}".format(
+                test.ljust(max_len_name), test_usage['peak_rss_kb'] / 1024,
+                test_usage['cpu_seconds'], test_usage['read_bytes'] / 1024 ** 2,
+                test_usage['write_bytes'] / 1024 ** 2))
+
+        if self.baseline_file is None:
+            return
+
+        if not os.path.isfile(self.baseline_file):
+            with open(self.baseline_file, 'w', encoding="utf8") as f:
+                json.dump(usage, f, indent=True, sort_keys=True)
+            print("\nNode resources baseline recorded to {}".format(
+                self.baseline_file))
+            return
+
+        with open(self.baseline_file, 'r', encoding="utf8") as f:
+            baseline = json.load(f)
+        regressions = self.get_regressions(usage, baseline)
+        if not regressions:
+            print("\nNo test grew more than {}% over the node resources baseline.".format(
+                self.threshold))
+            return
+        print()
+        for test, resource, base, value in regressions:
+            print("{}WARNING!{} {} {} grew from {} to {} ({:+.0f}%)".format(
+                RED[1], RED[0], test, resource, base, value,
+                (value / base - 1) * 100 if base else float('inf')))
+
+    def cleanup(self):
+        return shutil.rmtree(self.dir)
+
+
+def print_slowdowns(slowdowns):
+    for name, median, time_ in slowdowns:
+        print("{}WARNING!{} {} took {} s, {:+.0f}% over its median of {} s".format(
+            RED[1], RED[0], name, TimeResolution.milliseconds(time_),
+            (time_ / median - 1) * 100, TimeResolution.milliseconds(median)))
+
+
 def save_results_as_junit(test_results, file_name, time, test_suite_name):
     """
     Save tests results to file in JUnit format
@@ -840,14 +1316,39 @@ def save_results_as_junit(test_results, file_name, time, test_suite_name):
         file_name, "UTF-8", xml_declaration=True)
 
 
+def get_machine_fingerprint():
+    """
+    Identify the machine, so the timings are only compared between runs on
+    the same hardware.
+    """
+    cpu_model = ""
+    try:
+        with open('/proc/cpuinfo', encoding="utf8") as f:
+            cpu_model = next(
+                (line.split(':', 1)[1].strip() for line in f if line.startswith('model name')), "")
+    except OSError:
+        pass
+    machine = "{} {} {} {}".format(platform.system(), platform.machine(),
+                                   cpu_model or platform.processor(), multiprocessing.cpu_count())
+    return hashlib.sha256(machine.encode()).hexdigest()[:16]
+
+
 class Timings():
     """
     Takes care of loading, merging and saving tests execution times.
+
+    timing.json holds the median duration of each test, rounded to the second.
+    The durations of the last TIMING_HISTORY_SIZE runs are kept in
+    timing_history.jsonl beside it, one JSON record per run, along with the
+    fingerprint of the machine they ran on.
     """
 
     def __init__(self, timing_file):
         self.timing_file = timing_file
+        self.history_file = os.path.splitext(timing_file)[0] + '_history.jsonl'
+        self.fingerprint = get_machine_fingerprint()
         self.existing_timings = self.load_timings()
+        self.history = self.load_history()
 
     def load_timings(self):
         if os.path.isfile(self.timing_file):
@@ -856,6 +1357,62 @@ class Timings():
         else:
             return []
 
+    def load_history(self):
+        """
+        Return the durations of each test in the previous runs on this
+        machine, oldest first.
+        """
+        history = {}
+        if not os.path.isfile(self.history_file):
+            return history
+        with open(self.history_file, encoding="utf8") as file:
+            for line in file:
+                try:
+                    run = json.loads(line)
+                except ValueError:
+                    # Partially written record of an interrupted run
+                    continue
+                if run.get('machine') != self.fingerprint:
+                    continue
+                for name, time_ in run['timings'].items():
+                    history.setdefault(name, []).append(time_)
+        return {name: times[-TIMING_HISTORY_SIZE:]
+                for name, times in history.items()}
+
+    def get_test_time(self, name):
+        return next(
+            (x['time'] for x in self.existing_timings if x['name'] == name), 0)
+
+    def get_median_time(self, name):
+        """
+        Return the median duration of a test on this machine, or None if
+        there is not enough history.
+        """
+        times = self.history.get(name, [])
+        if len(times) < TIMING_HISTORY_MIN_RUNS:
+            return None
+        return statistics.median(times)
+
+    def get_slowdowns(self, test_results):
+        """
+        Return the (name, median, time) of the passed tests that are
+        significantly slower than in the previous runs on this machine.
+        """
+        slowdowns = []
+        for test in test_results:
+            times = self.history.get(test.name, [])
+            if test.status != 'Passed' or len(times) < TIMING_HISTORY_MIN_RUNS:
+                continue
+            median = statistics.median(times)
+            # Scale the MAD to estimate the standard deviation of normally
+            # distributed durations
+            mad = 1.4826 * statistics.median(abs(t - median) for t in times)
+            excess = test.time - median
+            if excess > SLOWDOWN_MAD_FACTOR * mad and excess >= SLOWDOWN_MIN_SECONDS \
+                    and excess > SLOWDOWN_MIN_RATIO * median:
+                slowdowns.append((test.name, median, test.time))
+        return sorted(slowdowns)
+
     def get_merged_timings(self, new_timings):
         """
         Return new list containing existing timings updated with new timings
@@ -875,13 +1432,47 @@ class Timings():
         merged.sort(key=lambda t, key=key: t[key])
         return merged
 
+    def append_history(self, times):
+        """
+        Append a run to the history file. The file is only rewritten once it
+        holds twice the number of runs to keep.
+        """
+        run = {
+            'timestamp': int(time.time()),
+            'machine': self.fingerprint,
+            'timings': times,
+        }
+        lines = []
+        if os.path.isfile(self.history_file):
+            with open(self.history_file, encoding="utf8") as file:
+                lines = file.readlines()
+
+        if len(lines) + 1 < 2 * TIMING_HISTORY_SIZE:
+            with open(self.history_file, 'a', encoding="utf8") as file:
+                file.write(json.dumps(run, sort_keys=True) + "\n")
+            return
+
+        lines = lines[-(TIMING_HISTORY_SIZE - 1):] + \
+            [json.dumps(run, sort_keys=True) + "\n"]
+        tmp_file = self.history_file + '.tmp'
+        with open(tmp_file, 'w', encoding="utf8") as file:
+            file.writelines(lines)
+        os.replace(tmp_file, self.history_file)
+
     def save_timings(self, test_results):
         # we only save test that have passed - timings for failed test might be
         # wrong (timeouts or early fails)
         passed_results = [
             test for test in test_results if test.status == 'Passed']
-        new_timings = list(map(lambda test: {'name': test.name, 'time': TimeResolution.seconds(test.time)},
-                               passed_results))
+        times = {test.name: TimeResolution.milliseconds(test.time)
+                 for test in passed_results}
+        self.append_history(times)
+        for name, time_ in times.items():
+            self.history.setdefault(name, []).append(time_)
+            del self.history[name][:-TIMING_HISTORY_SIZE]
+
+        new_timings = list(map(lambda name: {'name': name, 'time': TimeResolution.seconds(statistics.median(self.history[name]))},
+                               times))
         merged_timings = self.get_merged_timings(new_timings)
 
         with open(self.timing_file, 'w', encoding="utf8") as file:
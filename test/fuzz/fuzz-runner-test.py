@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Test the sharding, time budget and result cache of test/fuzz/test_runner.py
+against stub fuzz targets.
+"""
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+import test_runner  # noqa: E402
+
+# Prints the libFuzzer line of each input it is passed, after sleeping
+STUB_TARGET = """#!{python}
+import sys
+import time
+time.sleep({sleep})
+for arg in sys.argv[1:]:
+    if not arg.startswith('-'):
+        print('Executed {{}} in 1 ms'.format(arg), file=sys.stderr)
+sys.exit({exit_code})
+"""
+
+
+class TestFuzzRunner(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='fuzz_runner_test')
+        self.test_dir = os.path.join(self.dir, 'targets')
+        self.corpus = os.path.join(self.dir, 'corpus')
+        self.cache_file = os.path.join(self.dir, 'cache', 'results.json')
+        os.makedirs(self.test_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def add_target(self, name, num_inputs, sleep=0, exit_code=0):
+        path = os.path.join(self.test_dir, name)
+        with open(path, 'w', encoding='utf8') as f:
+            f.write(STUB_TARGET.format(
+                python=sys.executable, sleep=sleep, exit_code=exit_code))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        os.makedirs(os.path.join(self.corpus, name))
+        for i in range(num_inputs):
+            with open(os.path.join(self.corpus, name, str(i)), 'wb') as f:
+                f.write(bytes([i]))
+
+    def run_targets(self, test_list, workers=1, **kwargs):
+        with ThreadPoolExecutor(max_workers=workers) as fuzz_pool:
+            test_runner.run_once(
+                fuzz_pool=fuzz_pool, corpus=self.corpus, test_list=test_list,
+                test_dir=self.test_dir, use_valgrind=False,
+                cache=test_runner.ResultCache(self.cache_file), **kwargs)
+
+    def cached_inputs(self, target):
+        cache = test_runner.ResultCache(self.cache_file)
+        return cache.passed.get(target, {}).get('inputs', [])
+
+    def test_cache(self):
+        self.add_target('passing', 2)
+        with self.assertLogs(level='INFO') as logs:
+            self.run_targets(['passing'])
+        self.assertIn('2 run', '\n'.join(logs.output))
+        self.assertEqual(len(self.cached_inputs('passing')), 2)
+
+        with self.assertLogs(level='INFO') as logs:
+            self.run_targets(['passing'])
+        self.assertIn('0 run in 0.0s, 2 skipped as passed before',
+                      '\n'.join(logs.output))
+
+    def test_failing_target(self):
+        # The errors reported at exit can't be traced to an input, so none
+        # of the inputs executed is cached
+        self.add_target('failing', 2, exit_code=1)
+        for _ in range(2):
+            with self.assertLogs(level='INFO'), self.assertRaises(SystemExit):
+                self.run_targets(['failing'])
+            self.assertEqual(self.cached_inputs('failing'), [])
+
+    def test_time_budget(self):
+        # The second shard of the slow target starts once the fast target
+        # completed, and only gets the rest of the budget of the slow target
+        self.add_target('fast', 1, sleep=1)
+        self.add_target('slow', 2, sleep=60)
+        start = time.monotonic()
+        with self.assertLogs(level='INFO') as logs:
+            self.run_targets(['fast', 'slow'], workers=2, shard_size=1,
+                             time_budget=2)
+        self.assertLess(time.monotonic() - start, 2.5)
+        self.assertIn('2 skipped over the time budget', '\n'.join(logs.output))
+        self.assertEqual(self.cached_inputs('slow'), [])
+        self.assertEqual(len(self.cached_inputs('fast')), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
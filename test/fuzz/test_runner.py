@@ -3,16 +3,41 @@
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Run fuzz test targets.
+
+The inputs of a target are run in shards of at most --shard-size files, so
+the shards of a large corpus are spread across the workers. The inputs that
+passed are recorded in a cache, by the hash of the target binary and of the
+input, and are skipped by the next runs until the binary or the input
+changes.
+
+With --minimize, the corpus of each target is deduplicated by content and
+merged by libFuzzer into a fresh directory, keeping only the inputs that add
+coverage. The new directory replaces the corpus once the merge succeeded.
 """
 
 import argparse
 import configparser
+import hashlib
+import json
 import logging
 import os
+import re
+import shutil
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+# The maximum number of inputs run by a single fuzz target process
+DEFAULT_SHARD_SIZE = 500
+# The number of slowest inputs reported
+SLOWEST_INPUTS_REPORT_SIZE = 10
+
+# Printed by libFuzzer after running each input file
+EXECUTED_RE = re.compile(r'^Executed (.+) in (\d+) ms$', re.MULTILINE)
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -64,6 +89,35 @@ def main():
              ' the given targets for a finite number of times. Outputs them to'
              ' the passed seed_dir.'
     )
+    parser.add_argument(
+        '--minimize',
+        action='store_true',
+        help='Deduplicate and minimize the corpus of the targets in the'
+             ' seed_dir, keeping the inputs that add coverage.',
+    )
+    parser.add_argument(
+        '--shard-size',
+        type=int,
+        default=DEFAULT_SHARD_SIZE,
+        help='The maximum number of inputs run by a single fuzz target process.',
+    )
+    parser.add_argument(
+        '--time-budget',
+        type=float,
+        help='The time in seconds after which the remaining inputs of a target'
+             ' are not run. By default all the inputs are run.',
+    )
+    parser.add_argument(
+        '--cache-file',
+        help='The cache of the inputs that passed, by hash of the target binary'
+             ' and of the input. Default is fuzz_results.json in the test'
+             ' directory of the build.',
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help="Run all the inputs, and don't update the cache.",
+    )
 
     args = parser.parse_args()
 
@@ -180,12 +234,29 @@ def main():
             )
             return
 
+        if args.minimize:
+            minimize_inputs(
+                fuzz_pool=fuzz_pool,
+                corpus=args.seed_dir,
+                test_list=test_list_selection,
+                test_dir=test_dir,
+            )
+            return
+
+        cache = None
+        if not args.no_cache:
+            cache = ResultCache(args.cache_file or os.path.join(
+                config["environment"]["BUILDDIR"], 'test', 'fuzz_results.json'))
+
         run_once(
             fuzz_pool=fuzz_pool,
             corpus=args.seed_dir,
             test_list=test_list_selection,
             test_dir=test_dir,
             use_valgrind=args.valgrind,
+            shard_size=max(1, args.shard_size),
+            time_budget=args.time_budget,
+            cache=cache,
         )
 
 
@@ -251,36 +322,282 @@ def merge_inputs(*, fuzz_pool, corpus, test_list, test_dir, merge_dir):
         future.result()
 
 
-def run_once(*, fuzz_pool, corpus, test_list, test_dir, use_valgrind):
-    jobs = []
-    for t in test_list:
+def replay_time(binary, corpus_path):
+    """Returns the time in seconds to run all the inputs of a corpus once."""
+    start = time.monotonic()
+    subprocess.run([binary, '-runs=1', corpus_path],
+                   stderr=subprocess.DEVNULL)
+    return time.monotonic() - start
+
+
+def corpus_size(corpus_path):
+    inputs = list_inputs(corpus_path)
+    return len(inputs), sum(os.path.getsize(path) for path in inputs)
+
+
+def minimize_inputs(*, fuzz_pool, corpus, test_list, test_dir):
+    logging.info("Minimize the corpus of the targets in {}".format(corpus))
+
+    def job(t):
+        binary = os.path.join(test_dir, t)
         corpus_path = os.path.join(corpus, t)
-        os.makedirs(corpus_path, exist_ok=True)
-        args = [
-            os.path.join(test_dir, t),
-            '-runs=1',
-            corpus_path,
-        ]
-        if use_valgrind:
+        inputs = list_inputs(corpus_path)
+        if not inputs:
+            return None
+        before = corpus_size(corpus_path) + (replay_time(binary, corpus_path),)
+
+        # The work directories are in the seed_dir so they can be renamed
+        # into place
+        work_dir = tempfile.mkdtemp(dir=corpus, prefix='.{}.'.format(t))
+        try:
+            # Deduplicate the inputs by content, named by hash like libFuzzer
+            # does
+            unique_dir = os.path.join(work_dir, 'unique')
+            os.mkdir(unique_dir)
+            for path in inputs:
+                with open(path, 'rb') as f:
+                    name = hashlib.sha1(f.read()).hexdigest()
+                unique_path = os.path.join(unique_dir, name)
+                if not os.path.exists(unique_path):
+                    shutil.copyfile(path, unique_path)
+            unique = len(os.listdir(unique_dir))
+
+            minimized_dir = os.path.join(work_dir, 'minimized')
+            os.mkdir(minimized_dir)
             args = [
-                'valgrind',
-                '--quiet',
-                '--error-exitcode=1'] + args
+                binary,
+                '-merge=1',
+                '-use_value_profile=1',
+                minimized_dir,
+                unique_dir,
+            ]
+            result = subprocess.run(args,
+                                    stderr=subprocess.PIPE,
+                                    universal_newlines=True)
+            logging.debug('Run {} with args {}\n{}'.format(
+                t, " ".join(args), result.stderr))
+            result.check_returncode()
+            if not os.listdir(minimized_dir):
+                raise RuntimeError("The merge of {} kept no input".format(t))
+
+            # Swap the directories, restoring the corpus if the second rename
+            # fails
+            old_dir = os.path.join(work_dir, 'old')
+            os.rename(corpus_path, old_dir)
+            try:
+                os.rename(minimized_dir, corpus_path)
+            except OSError:
+                os.rename(old_dir, corpus_path)
+                raise
+        finally:
+            shutil.rmtree(work_dir)
+
+        after = corpus_size(corpus_path) + (replay_time(binary, corpus_path),)
+        return before, unique, after
+
+    jobs = {fuzz_pool.submit(job, t): t for t in test_list}
+    results = {}
+    failed = False
+    for future in as_completed(jobs):
+        t = jobs[future]
+        try:
+            results[t] = future.result()
+        except (subprocess.CalledProcessError, OSError, RuntimeError) as e:
+            logging.error("Target \"{}\" could not be minimized: {}".format(t, e))
+            failed = True
+
+    logging.info("{:<32} {:>17} {:>8} {:>23} {:>17}".format(
+        "target", "inputs", "unique", "bytes", "replay (s)"))
+    for t in sorted(results):
+        if results[t] is None:
+            continue
+        (inputs, size, replay), unique, (new_inputs, new_size, new_replay) = results[t]
+        logging.info("{:<32} {:>7} -> {:>6} {:>8} {:>10} -> {:>9} {:>7.2f} -> {:>6.2f}".format(
+            t, inputs, new_inputs, unique, size, new_size, replay, new_replay))
+
+    if failed:
+        sys.exit(1)
 
-        def job(t, args):
-            output = 'Run {} with args {}'.format(t, args)
+
+def file_digest(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def list_inputs(corpus_path):
+    """Returns the input files of a corpus directory, like libFuzzer does,
+    sorted."""
+    inputs = []
+    for root, _, files in os.walk(corpus_path):
+        inputs.extend(os.path.join(root, f) for f in files)
+    return sorted(inputs)
+
+
+class ResultCache:
+    """The hashes of the inputs that passed, by target, along with the key of
+    the target binary they passed against. The digest of each binary is
+    cached by size and modification time, to avoid hashing it again."""
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.binaries = {}
+        self.passed = {}
+        self.lock = threading.Lock()
+        try:
+            with open(cache_file, 'r', encoding="utf8") as f:
+                cache = json.load(f)
+            self.binaries = cache['binaries']
+            self.passed = cache['passed']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def get_binary_key(self, binary, use_valgrind):
+        stat = os.stat(binary)
+        path = os.path.realpath(binary)
+        entry = self.binaries.get(path)
+        if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+            entry = [stat.st_size, stat.st_mtime_ns, file_digest(path)]
+            self.binaries[path] = entry
+        # The inputs that passed without valgrind still need to be run with
+        return entry[2] + (':valgrind' if use_valgrind else '')
+
+    def get_passed(self, target, key, digests):
+        """Returns the digests that passed against the binary key. The other
+        digests are dropped, as the inputs no longer exist or the binary
+        changed."""
+        with self.lock:
+            entry = self.passed.get(target)
+            if entry is None or entry['key'] != key:
+                entry = self.passed[target] = {'key': key, 'inputs': []}
+            passed = digests.intersection(entry['inputs'])
+            entry['inputs'] = sorted(passed)
+            return passed
+
+    def add_passed(self, target, digests):
+        with self.lock:
+            entry = self.passed[target]
+            entry['inputs'] = sorted(set(entry['inputs']).union(digests))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        tmp_file = '{}.{}.tmp'.format(self.cache_file, os.getpid())
+        with self.lock, open(tmp_file, 'w', encoding="utf8") as f:
+            json.dump({'binaries': self.binaries, 'passed': self.passed}, f)
+        os.replace(tmp_file, self.cache_file)
+
+
+class TargetStats:
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.cached = 0
+        self.run = 0
+        self.over_budget = 0
+        # Time spent running the shards of the target, in seconds
+        self.time = 0.0
+        # When the time budget of the target runs out, set when its first
+        # shard starts
+        self.deadline = None
+        self.lock = threading.Lock()
+
+
+def run_once(*, fuzz_pool, corpus, test_list, test_dir, use_valgrind,
+             shard_size=DEFAULT_SHARD_SIZE, time_budget=None, cache=None):
+    stats = {}
+    shards = []
+    for t in test_list:
+        corpus_path = os.path.join(corpus, t)
+        os.makedirs(corpus_path, exist_ok=True)
+        binary = os.path.join(test_dir, t)
+        inputs = list_inputs(corpus_path)
+        stats[t] = TargetStats(len(inputs))
+        if not inputs:
+            # Run the empty input once
+            shards.append((t, [binary, '-runs=1', corpus_path], {}))
+            continue
+
+        digests = {path: file_digest(path) for path in inputs}
+        if cache is not None:
+            passed = cache.get_passed(
+                t, cache.get_binary_key(binary, use_valgrind),
+                set(digests.values()))
+            inputs = [path for path in inputs if digests[path] not in passed]
+            stats[t].cached = stats[t].inputs - len(inputs)
+
+        for i in range(0, len(inputs), shard_size):
+            shard = inputs[i:i + shard_size]
+            # libFuzzer runs each input file once
+            shards.append((t, [binary, '-runs=1'] + shard,
+                           {path: digests[path] for path in shard}))
+
+    def job(t, args, shard):
+        target_stats = stats[t]
+        timeout = None
+        if time_budget is not None:
+            with target_stats.lock:
+                if target_stats.deadline is None:
+                    target_stats.deadline = time.monotonic() + time_budget
+                timeout = target_stats.deadline - time.monotonic()
+            if timeout <= 0:
+                return '', None, []
+        output = 'Run {} with args {}'.format(t, args)
+        start = time.monotonic()
+        try:
             result = subprocess.run(
                 args,
                 stderr=subprocess.PIPE,
-                universal_newlines=True)
-            output += result.stderr
-            return output, result
-
-        jobs.append(fuzz_pool.submit(job, t, args))
-
+                universal_newlines=True,
+                timeout=timeout)
+            stderr = result.stderr
+        except subprocess.TimeoutExpired as e:
+            # The time budget is exhausted
+            result = None
+            stderr = e.stderr or ''
+            if isinstance(stderr, bytes):
+                stderr = stderr.decode('utf8', 'replace')
+        with target_stats.lock:
+            target_stats.time += time.monotonic() - start
+        output += stderr
+        executed = [(int(ms), path)
+                    for path, ms in EXECUTED_RE.findall(stderr) if path in shard]
+        return output, result, executed
+
+    if use_valgrind:
+        shards = [(t, ['valgrind', '--quiet', '--error-exitcode=1'] + args, shard)
+                  for t, args, shard in shards]
+
+    # Start with the largest shards, so they don't delay the end of the run
+    shards.sort(key=lambda s: -len(s[2]))
+    jobs = {fuzz_pool.submit(job, *s): s for s in shards}
+
+    failed = False
+    slowest = []
     for future in as_completed(jobs):
-        output, result = future.result()
+        t, args, shard = jobs[future]
+        output, result, executed = future.result()
         logging.debug(output)
+        executed_paths = set(path for _, path in executed)
+        if result is None:
+            # The inputs of a shard interrupted by the time budget that
+            # completed before passed
+            passed = executed_paths
+        elif result.returncode == 0:
+            passed = set(shard)
+        else:
+            # The errors reported at exit, like leaks or valgrind errors,
+            # can't be traced to an input, so none of them passed
+            passed = set()
+        stats[t].run += len(shard) if result is not None and result.returncode == 0 else len(
+            executed_paths)
+        slowest.extend((ms, t, path) for ms, path in executed)
+        if cache is not None and passed:
+            cache.add_passed(t, set(shard[path] for path in passed))
+
+        if result is None:
+            stats[t].over_budget += len(shard) - len(passed)
+            continue
         try:
             result.check_returncode()
         except subprocess.CalledProcessError as e:
@@ -293,7 +610,26 @@ def run_once(*, fuzz_pool, corpus, test_list, test_dir, use_valgrind):
                     " ".join(
                         result.args),
                     e.returncode))
-            sys.exit(1)
+            failed = True
+
+    if cache is not None:
+        cache.save()
+
+    for t in test_list:
+        target_stats = stats[t]
+        logging.info(
+            "{}: {} inputs, {} run in {:.1f}s, {} skipped as passed before{}".format(
+                t, target_stats.inputs, target_stats.run, target_stats.time,
+                target_stats.cached,
+                ", {} skipped over the time budget".format(
+                    target_stats.over_budget) if target_stats.over_budget else ""))
+    if slowest:
+        logging.info("Slowest inputs:")
+        for ms, t, path in sorted(slowest, reverse=True)[:SLOWEST_INPUTS_REPORT_SIZE]:
+            logging.info("{:>8} ms  {}: {}".format(ms, t, path))
+
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == '__main__':